@@ -4,19 +4,73 @@
 
 import os
 import re
+import json
 import time
 import uuid
+import queue
+import base64
+import shutil
 import socket
+import struct
+import hashlib
 import logging
+import threading
 import webbrowser
 import subprocess
+from dataclasses import dataclass
+from itertools import islice
 from subprocess import DEVNULL
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Iterable, Iterator, Any, Callable
 
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
+RPC_TIMEOUT = 30            # RPC请求超时(秒)
+BATCH_SIZE = 200            # system.multicall 每批添加的任务数
+DOWNLOAD_HEADERS = ["Referer: https://www.notion.so/"]  # 每个任务附加的请求头 (RPC添加与输入文件一致)
+BATCH_FLUSH_INTERVAL = 0.5  # 流式输入时一批最多攒多久(秒)，不足 BATCH_SIZE 也立即提交
+POLL_INTERVAL = 1.0         # 无 WebSocket 时批量轮询任务状态的间隔(秒)
+SAFETY_POLL_INTERVAL = 30.0 # 有 WebSocket 时兜底轮询的间隔(秒)，防止漏掉通知
+STOPPED_STATUSES = ('complete', 'error', 'removed')
+STARTUP_TIMEOUT = 10.0      # 等待 aria2c 就绪的最长时间(秒)
+PROBE_DELAY = 0.02          # 就绪探测的初始间隔(秒)，之后指数增长
+PROBE_MAX_DELAY = 0.5       # 就绪探测的最大间隔(秒)
+RECOVERY_INTERVAL = 5.0     # 检查过期链接的间隔(秒)
+RECOVERY_LOOKAHEAD = 20     # 提前刷新等待队列最前面多少个任务的链接
+RECOVERY_RETRIES = 3        # 同一文件最多重新获取链接的次数
+ERROR_HTTP = '22'           # aria2 errorCode: HTTP 响应状态异常 (错误信息中带 status=NNN)
+
+# 会话配置
+SESSION_FILE = "aria2.session"      # 未完成任务的会话文件 (也是下次启动时的输入文件)
+SESSION_SAVE_INTERVAL = 30          # 会话自动保存间隔(秒)
+KEYS_SUFFIX = ".keys"               # gid -> block ID 映射 (会话文件旁路)
+
+# 自适应并发配置
+TUNE_SAMPLE_INTERVAL = 1.0  # 吞吐采样间隔(秒)
+TUNE_WINDOW = 5             # 每个决策窗口的采样次数
+TUNE_GAIN = 0.05            # 增加并发后吞吐至少提升5%才保留
+TUNE_PROBE_EVERY = 6        # 稳定后每隔多少个窗口重新尝试增加并发
+CONNECTION_BUDGET = 32      # 总连接数预算，单任务连接数 = 预算 / 并发数 (1~16)
+
+
+def _timed_batches(items: Iterable, size: int, interval: float) -> Iterator[list]:
+    """把流式输入分批：第一批只含第一项，之后每批最多 size 项或跨越 interval 秒"""
+    chunk: list = []
+    started = 0.0
+    first = True
+    for item in items:
+        if not chunk:
+            started = time.monotonic()
+        chunk.append(item)
+        if first or len(chunk) >= size or time.monotonic() - started >= interval:
+            yield chunk
+            chunk = []
+            first = False
+    if chunk:
+        yield chunk
+
 
 def sanitize_filename(name: str) -> str:
     """清理文件名"""
@@ -34,37 +88,229 @@ def sanitize_filename(name: str) -> str:
     return name.strip() or "unnamed_file"
 
 
+# ============ WebSocket 通知 ============
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def _ws_accept_key(key: str) -> str:
+    """计算握手响应的 Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("WebSocket连接已关闭")
+        data += chunk
+    return data
+
+
+def _ws_send(sock: socket.socket, payload: bytes, opcode: int = 0x1, mask: bool = True):
+    """发送一个 WebSocket 帧 (客户端发送的帧必须加掩码)"""
+    header = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header += bytes([mask_bit | length])
+    elif length < 65536:
+        header += bytes([mask_bit | 126]) + struct.pack('!H', length)
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack('!Q', length)
+    if mask:
+        key = os.urandom(4)
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+        header += key
+    sock.sendall(header + payload)
+
+
+def _ws_recv(sock: socket.socket) -> Tuple[int, bytes]:
+    """接收一条完整的 WebSocket 消息 (合并分片)，返回 (opcode, payload)"""
+    message = b''
+    message_opcode = None
+    while True:
+        first, second = _recv_exact(sock, 2)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', _recv_exact(sock, 2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', _recv_exact(sock, 8))[0]
+        key = _recv_exact(sock, 4) if second & 0x80 else None
+        payload = _recv_exact(sock, length)
+        if key:
+            payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+
+        if opcode >= 0x8:
+            # 控制帧不分片，可以插在数据帧分片之间
+            return opcode, payload
+        if opcode:
+            message_opcode = opcode
+        message += payload
+        if first & 0x80:
+            return message_opcode or opcode, message
+
+
+class Aria2Notifier:
+    """
+    Aria2 WebSocket 通知订阅 (仅依赖标准库)
+
+    连接 ws://host:port/jsonrpc，收到 aria2.onDownloadStart / onDownloadComplete /
+    onDownloadError / onDownloadStop 等通知时在后台线程中调用 on_event(method, gid)。
+    """
+
+    def __init__(self, host: str, port: int, on_event: Callable[[str, str], None]):
+        self.host = host
+        self.port = port
+        self.on_event = on_event
+        self.sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def connect(self, timeout: float = 5.0) -> bool:
+        """建立 WebSocket 连接，失败 (如 aria2 不支持) 时返回 False"""
+        key = base64.b64encode(os.urandom(16)).decode()
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=timeout)
+            sock.sendall((
+                f"GET /jsonrpc HTTP/1.1\r\n"
+                f"Host: {self.host}:{self.port}\r\n"
+                f"Upgrade: websocket\r\n"
+                f"Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {key}\r\n"
+                f"Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode())
+
+            response = b''
+            while b'\r\n\r\n' not in response:
+                chunk = sock.recv(1024)
+                if not chunk:
+                    raise ConnectionError("握手时连接被关闭")
+                response += chunk
+            head = response.split(b'\r\n\r\n', 1)[0].decode('latin-1')
+            if ' 101 ' not in head.split('\r\n', 1)[0] or _ws_accept_key(key) not in head:
+                raise ConnectionError(head.split('\r\n', 1)[0])
+        except Exception as e:
+            logger.debug(f"Aria2 WebSocket连接失败: {e}")
+            return False
+
+        sock.settimeout(None)
+        self.sock = sock
+        self._thread = threading.Thread(target=self._run, daemon=True, name="aria2-notifier")
+        self._thread.start()
+        return True
+
+    def close(self):
+        """关闭连接"""
+        if self.sock:
+            try:
+                _ws_send(self.sock, b'', opcode=0x8)
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def _run(self):
+        try:
+            while True:
+                opcode, payload = _ws_recv(self.sock)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    _ws_send(self.sock, payload, opcode=0xA)
+                    continue
+                if opcode != 0x1:
+                    continue
+                message = json.loads(payload.decode('utf-8'))
+                method = message.get('method')
+                if method:
+                    for event in message.get('params', []):
+                        self.on_event(method, event.get('gid', ''))
+        except (OSError, ConnectionError, ValueError, AttributeError) as e:
+            logger.debug(f"Aria2 WebSocket连接断开: {e}")
+
+
+# ============ RPC 客户端 ============
+
 class Aria2Client:
-    """Aria2 RPC客户端"""
+    """Aria2 RPC客户端 (复用 keep-alive 连接)"""
     
-    def __init__(self, host: str = "127.0.0.1", port: int = 6800, token: str = ""):
+    def __init__(self, host: str = "127.0.0.1", port: int = 6800, token: str = "",
+                 batch_size: int = BATCH_SIZE):
+        self.host = host
+        self.port = port
         self.url = f"http://{host}:{port}/jsonrpc"
         self.token = f"token:{token}" if token else ""
-    
-    def _call(self, method: str, params: list = None) -> Optional[dict]:
-        """发送RPC请求"""
-        request_params = [self.token] + (params or []) if self.token else (params or [])
+        self.batch_size = max(1, batch_size)
         
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+        self.session.mount("http://", adapter)
+    
+    def _params(self, params: Optional[list]) -> list:
+        """在参数前加上RPC密钥"""
+        return [self.token] + (params or []) if self.token else (params or [])
+    
+    def _post(self, method: str, params: list) -> Any:
+        """发送RPC请求，失败时抛出异常"""
         payload = {
             "jsonrpc": "2.0",
             "id": str(uuid.uuid4()),
             "method": method,
-            "params": request_params
+            "params": params
         }
+        resp = self.session.post(self.url, json=payload, timeout=RPC_TIMEOUT)
+        resp.raise_for_status()
+        result = resp.json()
         
+        if "error" in result:
+            raise Exception(result['error']['message'])
+        return result.get("result")
+    
+    def _call(self, method: str, params: list = None) -> Optional[dict]:
+        """发送RPC请求"""
         try:
-            resp = requests.post(self.url, json=payload, timeout=30)
-            resp.raise_for_status()
-            result = resp.json()
-            
-            if "error" in result:
-                raise Exception(result['error']['message'])
-            return result.get("result")
-            
+            return self._post(method, self._params(params))
         except Exception as e:
             logger.error(f"Aria2 RPC调用失败: {e}")
             return None
     
+    def multicall(self, calls: List[Tuple[str, list]]) -> List[Tuple[Any, Optional[str]]]:
+        """
+        用 system.multicall 在一次请求中执行多个RPC
+        
+        Args:
+            calls: [(method, params), ...] (params 不含密钥，每个子调用会单独加上)
+        
+        Returns:
+            与 calls 一一对应的 [(result, error), ...]；整个请求失败时每项都带同一个错误
+        """
+        if not calls:
+            return []
+        
+        batch = [{"methodName": method, "params": self._params(params)} for method, params in calls]
+        try:
+            results = self._post("system.multicall", [batch])
+        except Exception as e:
+            logger.error(f"Aria2 multicall失败 ({len(calls)} 个调用): {e}")
+            return [(None, str(e))] * len(calls)
+        
+        # 成功的子调用返回 [result]，失败的返回 {"code": ..., "message": ...}
+        return [
+            (item[0], None) if isinstance(item, list) else (None, item.get('message', str(item)))
+            for item in results
+        ]
+    
+    def close(self):
+        """关闭连接"""
+        self.session.close()
+    
     def is_connected(self) -> bool:
         """检查连接"""
         stat = self._call("aria2.getGlobalStat")
@@ -78,108 +324,687 @@ class Aria2Client:
         """获取任务状态"""
         return self._call("aria2.tellStatus", [gid])
     
-    def add_download(self, url: str, filename: str, save_dir: str = "downloads") -> Optional[str]:
-        """添加下载任务"""
-        params = [
+    @staticmethod
+    def _add_uri_params(url: str, filename: str, save_dir: str) -> list:
+        return [
             [url],
-            {"out": sanitize_filename(filename), "dir": os.path.abspath(save_dir)}
+            {"out": sanitize_filename(filename), "dir": os.path.abspath(save_dir),
+             "header": list(DOWNLOAD_HEADERS)}
         ]
-        return self._call("aria2.addUri", params)
     
-    def add_downloads_batch(self, file_urls: List[Tuple[str, str]], save_dir: str = "downloads") -> List[str]:
-        """批量添加下载任务"""
+    def add_download(self, url: str, filename: str, save_dir: str = "downloads") -> Optional[str]:
+        """添加下载任务"""
+        return self._call("aria2.addUri", self._add_uri_params(url, filename, save_dir))
+    
+    def add_downloads_batch(self, file_urls: Iterable[tuple], save_dir: str = "downloads",
+                            batch_size: Optional[int] = None,
+                            on_added: Optional[Callable[[str, tuple], None]] = None) -> List[str]:
+        """
+        批量添加下载任务 (file_urls 可以是流式迭代器)
+        
+        每 batch_size 个任务合并为一次 system.multicall 请求，逐项报告失败的任务。
+        第一个任务立即提交 (aria2 不必等列表加载完就开始下载)；之后一批攒够 batch_size
+        个或距这批第一个任务超过 BATCH_FLUSH_INTERVAL 秒时提交
+        
+        Args:
+            file_urls: [(filename, url, ...), ...]，多余的字段原样传给 on_added
+            on_added: 每个任务添加成功后调用 on_added(gid, item)
+        """
+        batch_size = batch_size or self.batch_size
         gids = []
-        for filename, url in file_urls:
-            gid = self.add_download(url, filename, save_dir)
-            if gid:
-                gids.append(gid)
-                print(f"✅ 已添加: {sanitize_filename(filename)}")
-            else:
-                print(f"❌ 添加失败: {filename}")
-            time.sleep(0.1)
+        failed = 0
+        
+        for chunk in _timed_batches(file_urls, batch_size, BATCH_FLUSH_INTERVAL):
+            calls = [("aria2.addUri", self._add_uri_params(item[1], item[0], save_dir))
+                     for item in chunk]
+            for item, (gid, error) in zip(chunk, self.multicall(calls)):
+                filename = item[0]
+                if gid:
+                    gids.append(gid)
+                    if on_added:
+                        on_added(gid, item)
+                else:
+                    failed += 1
+                    print(f"❌ 添加失败: {filename} ({error})")
+            print(f"✅ 已添加 {len(gids)} 个任务" + (f", 失败 {failed} 个" if failed else ""))
+        
         return gids
     
-    def add_downloads_queued(self, file_urls: List[Tuple[str, str]], save_dir: str = "downloads",
-                            max_active: int = 3, check_interval: int = 10) -> List[str]:
+    def add_downloads_queued(self, file_urls: Iterable[tuple], save_dir: str = "downloads",
+                            max_active: int = 3, check_interval: float = POLL_INTERVAL,
+                            use_websocket: bool = True,
+                            on_added: Optional[Callable[[str, tuple], None]] = None) -> List[str]:
         """
         队列式添加下载任务
         
+        任务结束由 WebSocket 通知驱动 (到达即补位)；WebSocket 不可用或断开时，
+        每 check_interval 秒用一次 system.multicall (tellActive/tellWaiting/tellStopped) 批量轮询。
+        
         Args:
-            file_urls: [(filename, url), ...]
+            file_urls: [(filename, url, ...), ...] (可以是流式迭代器)，多余的字段原样传给 on_added
             save_dir: 保存目录
             max_active: 最大并发数
-            check_interval: 检查间隔(秒)
+            check_interval: 轮询间隔(秒)
+            use_websocket: 是否尝试订阅 WebSocket 通知
+            on_added: 每个任务添加成功后调用 on_added(gid, item)
         """
         gids = []
         active: Dict[str, Tuple[str, float]] = {}  # gid -> (filename, start_time)
+        total = len(file_urls) if hasattr(file_urls, '__len__') else None
+        items = iter(file_urls)
+        exhausted = False
+        added = 0
+        
+        # 通知可能先于 addUri 的返回到达，先记下来等匹配
+        events: queue.Queue = queue.Queue()
+        notifier = None
+        if use_websocket:
+            notifier = Aria2Notifier(self.host, self.port, lambda method, gid: events.put((method, gid)))
+            if not notifier.connect():
+                notifier = None
+                print("ℹ️ WebSocket不可用，改为批量轮询")
+        
+        print(f"🎯 开始队列下载 (共{total if total is not None else '?'}个, 并发{max_active})")
+        
+        timeout = 3600  # 1小时无任何任务结束则超时
+        last_change = time.time()
+        next_poll = time.time() + (SAFETY_POLL_INTERVAL if notifier else check_interval)
+        pending_events: Dict[str, str] = {}
+        
+        try:
+            while True:
+                # 补满队列
+                free = max_active - len(active)
+                if free > 0 and not exhausted:
+                    chunk = list(islice(items, free))
+                    exhausted = len(chunk) < free
+                    calls = [("aria2.addUri", self._add_uri_params(item[1], item[0], save_dir))
+                             for item in chunk]
+                    for item, (gid, error) in zip(chunk, self.multicall(calls)):
+                        added += 1
+                        filename = item[0]
+                        clean_name = sanitize_filename(filename)
+                        if gid:
+                            gids.append(gid)
+                            active[gid] = (clean_name, time.time())
+                            if on_added:
+                                on_added(gid, item)
+                            print(f"📥 [{added}/{total if total is not None else '?'}] {clean_name}")
+                        else:
+                            print(f"❌ 添加失败: {filename} ({error})")
+                    if len(active) < max_active and not exhausted:
+                        continue
+                
+                if not active:
+                    break
+                if time.time() - last_change > timeout:
+                    print(f"⚠️ 超时，还有{len(active)}个任务未完成")
+                    break
+                
+                # 等待任务结束
+                finished: Dict[str, dict] = {}
+                use_events = notifier is not None and notifier.connected
+                wait = max(0.0, next_poll - time.time())
+                events_batch: List[Tuple[str, str]] = []
+                if use_events:
+                    try:
+                        events_batch.append(events.get(timeout=wait))
+                        while True:
+                            events_batch.append(events.get_nowait())
+                    except queue.Empty:
+                        pass
+                else:
+                    time.sleep(wait)
+                
+                for method, gid in events_batch:
+                    if method == "aria2.onDownloadStart":
+                        if gid in active:
+                            # 以实际开始下载的时间计时
+                            active[gid] = (active[gid][0], time.time())
+                    else:
+                        pending_events[gid] = method
+                
+                for gid in [g for g in pending_events if g in active]:
+                    method = pending_events.pop(gid)
+                    if method == "aria2.onDownloadComplete":
+                        finished[gid] = {'status': 'complete'}
+                    else:
+                        finished[gid] = self.get_status(gid) or {'status': 'error'}
+                
+                if time.time() >= next_poll:
+                    finished.update(self.poll_finished(list(active)))
+                    next_poll = time.time() + (SAFETY_POLL_INTERVAL if use_events else check_interval)
+                
+                for gid, status in finished.items():
+                    if gid not in active:
+                        continue
+                    filename, start_time = active.pop(gid)
+                    elapsed = time.time() - start_time
+                    if status.get('status') == 'complete':
+                        print(f"✅ {filename} ({elapsed:.1f}秒)")
+                    else:
+                        reason = status.get('errorMessage') or status.get('status', '')
+                        print(f"❌ {filename} ({elapsed:.1f}秒) {reason}")
+                    last_change = time.time()
+        finally:
+            if notifier:
+                notifier.close()
+        
+        if not active:
+            print("🎉 所有任务已完成！")
         
-        print(f"🎯 开始队列下载 (共{len(file_urls)}个, 并发{max_active})")
+        return gids
+    
+    def poll_finished(self, gids: List[str]) -> Dict[str, dict]:
+        """
+        一次 multicall 批量查询任务状态，返回 gids 中已结束的任务 {gid: status}
+        
+        不在 active/waiting/stopped 列表中的任务 (如结果已被清理) 再单独查询
+        """
+        if not gids:
+            return {}
+        keys = ["gid", "status", "errorMessage"]
+        results = self.multicall([
+            ("aria2.tellActive", [keys]),
+            ("aria2.tellWaiting", [0, 1000, keys]),
+            ("aria2.tellStopped", [-1, 1000, keys]),
+        ])
+        
+        known: Dict[str, dict] = {}
+        for result, error in results:
+            if error is not None:
+                return {}
+            for status in result or []:
+                known[status['gid']] = status
         
-        for i, (filename, url) in enumerate(file_urls):
-            # 等待队列有空位
-            while len(active) >= max_active:
-                self._cleanup_completed(active)
-                if len(active) >= max_active:
-                    time.sleep(1)
+        unknown = [gid for gid in gids if gid not in known]
+        if unknown:
+            for gid, (status, error) in zip(unknown, self.multicall(
+                    [("aria2.tellStatus", [gid, keys]) for gid in unknown])):
+                known[gid] = status or {'gid': gid, 'status': 'removed', 'errorMessage': error}
+        
+        return {gid: known[gid] for gid in gids if known[gid].get('status') in STOPPED_STATUSES}
+
+
+# ============ 输入文件 ============
+
+def new_gid() -> str:
+    """生成 aria2 的 GID (16位十六进制)"""
+    return uuid.uuid4().hex[:16]
+
+
+def format_input_entry(url: str, out: str, save_dir: str, gid: Optional[str] = None,
+                       headers: Optional[List[str]] = None) -> str:
+    """格式化输入文件中的一个任务：一行URI，后面是缩进的选项行"""
+    entry = f"{url}\n"
+    if gid:
+        entry += f"  gid={gid}\n"
+    entry += f"  out={out}\n  dir={save_dir}\n"
+    for header in headers or []:
+        entry += f"  header={header}\n"
+    return entry
+
+
+def write_input_file(file_urls: Iterable[tuple], path: str, save_dir: str = "downloads",
+                     headers: Optional[List[str]] = None,
+                     on_added: Optional[Callable[[str, tuple], None]] = None) -> int:
+    """
+    生成 aria2 输入文件 (--input-file)，大量任务无需逐个通过RPC添加
+    
+    每个任务一行URI，后面是缩进的选项行 (gid、out、dir 和 header)。
+    GID 在这里预先分配，on_added(gid, item) 与 add_downloads_batch 的回调含义相同。
+    aria2 只在启动时读取输入文件，因此要等 file_urls 全部列出、文件写完后才能开始下载
+    (写入本身按流处理，内存占用不随任务数增长)；希望尽快开始下载时用 RPC 流式添加。
+    
+    Args:
+        file_urls: [(filename, url, ...), ...] (可以是流式迭代器)
+        headers: 每个任务附加的请求头，默认与 RPC 添加相同 (DOWNLOAD_HEADERS)
+    
+    Returns:
+        写入的任务数
+    """
+    save_dir = os.path.abspath(save_dir)
+    headers = DOWNLOAD_HEADERS if headers is None else headers
+    count = 0
+    with open(path, 'w', encoding='utf-8', buffering=1024 * 1024) as f:
+        for item in file_urls:
+            gid = new_gid()
+            f.write(format_input_entry(item[1], sanitize_filename(item[0]), save_dir, gid, headers))
+            count += 1
+            if on_added:
+                on_added(gid, item)
+    return count
+
+
+# ============ 过期链接恢复 ============
+
+class UrlRecovery:
+    """
+    签名URL过期恢复
+    
+    Notion 的文件链接约一小时后过期，大队列末尾的任务开始时链接早已失效。后台线程每隔
+    RECOVERY_INTERVAL 秒用一次 multicall 检查：
+    
+    - 因过期 (403 等) 失败的任务：按 key (block ID) 重新获取链接，以相同的 dir/out 和
+      continue=true 重新添加到队首，保留已下载的部分数据
+    - 等待队列最前面的任务链接即将过期时，提前用 aria2.changeUri 换成新链接
+    
+    resolve_url(key) 返回新链接 (如 NotionFileManager.get_file_url)；
+    is_expired(url) 判断链接是否即将过期 (如 notion.is_url_expired)，不提供时只做失败后恢复。
+    
+    指定 keys_file 时 gid -> key 映射会定期保存，配合会话文件在重启后继续恢复 (load=True 时读取)。
+    """
+    
+    def __init__(self, client: Aria2Client, resolve_url: Callable[[str], Optional[str]],
+                 is_expired: Optional[Callable[[str], bool]] = None,
+                 interval: float = RECOVERY_INTERVAL, lookahead: int = RECOVERY_LOOKAHEAD,
+                 keys_file: Optional[str] = None, load: bool = False):
+        self.client = client
+        self.resolve_url = resolve_url
+        self.is_expired = is_expired
+        self.interval = interval
+        self.lookahead = lookahead
+        self.keys: Dict[str, str] = {}       # gid -> key
+        self.attempts: Dict[str, int] = {}   # key -> 重新添加次数
+        self.recovered = 0
+        self.refreshed = 0
+        self.lock = threading.Lock()
+        self.keys_file = keys_file
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+        if keys_file and load and os.path.exists(keys_file):
+            with open(keys_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    gid, _, key = line.rstrip('\n').partition('\t')
+                    if gid and key:
+                        self.keys[gid] = key
+    
+    def track(self, gid: str, key: str):
+        """记录任务对应的文件 (可作为 add_downloads_batch 的 on_added 回调使用)"""
+        if key:
+            with self.lock:
+                self.keys[gid] = key
+                self._dirty = True
+    
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="aria2-recovery")
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.save_keys()
+    
+    def save_keys(self):
+        """原子保存 gid -> key 映射"""
+        if not self.keys_file:
+            return
+        with self.lock:
+            if not self._dirty:
+                return
+            lines = [f"{gid}\t{key}\n" for gid, key in self.keys.items()]
+            self._dirty = False
+        tmp_file = self.keys_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_file, self.keys_file)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+                self.save_keys()
+            except Exception as e:
+                logger.error(f"过期链接检查失败: {e}")
+    
+    def check(self):
+        """检查一次失败任务和即将开始的等待任务"""
+        with self.lock:
+            if not self.keys:
+                return
+        keys = ["gid", "status", "errorCode", "errorMessage", "dir", "files"]
+        calls = [("aria2.tellStopped", [-1, 1000, keys])]
+        if self.is_expired:
+            calls.append(("aria2.tellWaiting", [0, self.lookahead, ["gid", "files"]]))
+        results = self.client.multicall(calls)
+        
+        stopped, error = results[0]
+        if error is None:
+            self._recover_failed([s for s in stopped or [] if s.get('status') == 'error'])
+        if len(results) > 1 and results[1][1] is None:
+            self._refresh_waiting(results[1][0] or [])
+    
+    def _recover_failed(self, failed: List[dict]):
+        """重新获取链接后以续传方式重新添加失败的任务"""
+        for status in failed:
+            gid = status['gid']
+            with self.lock:
+                key = self.keys.pop(gid, None)
+                self._dirty = True
+            if key is None:
+                continue
             
-            # 添加任务
-            clean_name = sanitize_filename(filename)
-            print(f"📥 [{i+1}/{len(file_urls)}] {clean_name}")
+            files = status.get('files') or [{}]
+            path = files[0].get('path', '')
+            if not self._is_url_expiry(status):
+                logger.warning(f"[链接恢复] {path or gid} 下载失败 (errorCode={status.get('errorCode', '')}, "
+                               f"不是链接过期，保留原任务): {status.get('errorMessage', '')}")
+                continue
             
-            gid = self.add_download(url, clean_name, save_dir)
-            if gid:
-                gids.append(gid)
-                active[gid] = (clean_name, time.time())
+            attempts = self.attempts.get(key, 0) + 1
+            if attempts > RECOVERY_RETRIES or not path:
+                logger.warning(f"[链接恢复] {path or gid} 无法恢复: {status.get('errorMessage', '')}")
+                continue
+            self.attempts[key] = attempts
             
-            time.sleep(0.1)
+            url = self.resolve_url(key)
+            if not url:
+                logger.warning(f"[链接恢复] 无法重新获取链接: {key}")
+                continue
+            
+            options = {"dir": status.get('dir') or os.path.dirname(path),
+                       "out": os.path.basename(path), "continue": "true", "header": list(DOWNLOAD_HEADERS)}
+            (new_gid, error), _ = self.client.multicall([
+                ("aria2.addUri", [[url], options, 0]),
+                ("aria2.removeDownloadResult", [gid]),
+            ])
+            if new_gid:
+                self.track(new_gid, key)
+                self.recovered += 1
+                logger.info(f"[链接恢复] {options['out']} 已用新链接重新添加 "
+                            f"(原错误: {status.get('errorMessage', '')})")
+            else:
+                logger.error(f"[链接恢复] 重新添加失败 {options['out']}: {error}")
+    
+    def _is_url_expiry(self, status: dict) -> bool:
+        """
+        失败是否像是签名链接过期
         
-        # 等待所有任务完成
-        print("📊 等待任务完成...")
-        timeout = 3600  # 1小时超时
-        start = time.time()
+        过期的签名链接返回 HTTP 4xx (errorCode 22 且 status=4xx)；也可以直接按链接上的过期时间判断。
+        5xx、磁盘错误等其他失败换链接也无济于事。
+        """
+        if status.get('errorCode') == ERROR_HTTP:
+            match = re.search(r'status=(\d{3})', status.get('errorMessage', ''))
+            if match is None or match.group(1).startswith('4'):
+                return True
+        if self.is_expired:
+            files = status.get('files') or [{}]
+            uris = files[0].get('uris') or []
+            return bool(uris) and self.is_expired(uris[0]['uri'])
+        return False
+    
+    def _refresh_waiting(self, waiting: List[dict]):
+        """把等待队列前面即将过期的链接提前换成新链接"""
+        calls = []
+        for status in waiting:
+            with self.lock:
+                key = self.keys.get(status['gid'])
+            files = status.get('files') or [{}]
+            uris = [u['uri'] for u in files[0].get('uris', [])]
+            if key is None or not uris or not self.is_expired(uris[0]):
+                continue
+            url = self.resolve_url(key)
+            if url:
+                calls.append(("aria2.changeUri", [status['gid'], 1, sorted(set(uris)), [url]]))
         
-        while active and (time.time() - start) < timeout:
-            self._cleanup_completed(active)
-            if active:
-                time.sleep(check_interval)
+        for (result, error), (_, params) in zip(self.client.multicall(calls), calls):
+            if error is None:
+                self.refreshed += 1
+            else:
+                logger.debug(f"[链接恢复] 更换链接失败 {params[0]}: {error}")
+        if calls:
+            logger.info(f"[链接恢复] 已提前刷新 {len(calls)} 个即将过期的链接")
+
+
+# ============ 自适应并发 ============
+
+@dataclass
+class TuneDecision:
+    """一次并发调整记录"""
+    time: float
+    concurrent: int
+    connections: int
+    speed: float        # 决策时的平均吞吐 (字节/秒)
+    errors: int         # 决策窗口内新增的失败任务数
+    reason: str
+
+
+class ConcurrencyTuner:
+    """
+    根据全局吞吐自动调整 aria2 并发数
+    
+    每 TUNE_SAMPLE_INTERVAL 秒用一次 multicall 采样 getGlobalStat 和 tellStopped，每 TUNE_WINDOW
+    次采样做一次决策 (爬山法)：
+    
+    - 有等待任务时把并发数增加到约 1.5 倍，下个窗口吞吐提升不足 TUNE_GAIN 则回退并保持
+      TUNE_PROBE_EVERY 个窗口后再试
+    - 窗口内新增失败任务 (≥2 且多于上个窗口) 时：刚增加过并发则回退，并以此为本次会话的上限；
+      否则并发减半
+    
+    单任务连接数按 CONNECTION_BUDGET / 并发数 设置：changeGlobalOption 对之后开始的任务生效，
+    changeOption 同时更新等待队列最前面的任务 (等待中的任务修改选项不会重启)。
+    每次调整都记录在 decisions 中并写入日志。
+    """
+    
+    def __init__(self, client: Aria2Client, initial: int = 3, min_concurrent: int = 1,
+                 max_concurrent: int = 16, connection_budget: int = CONNECTION_BUDGET,
+                 sample_interval: float = TUNE_SAMPLE_INTERVAL, window: int = TUNE_WINDOW):
+        self.client = client
+        self.min_concurrent = max(1, min_concurrent)
+        self.max_concurrent = max(self.min_concurrent, max_concurrent)
+        self.concurrent = min(max(initial, self.min_concurrent), self.max_concurrent)
+        self.connection_budget = connection_budget
+        self.sample_interval = sample_interval
+        self.window = max(2, window)
+        self.decisions: List[TuneDecision] = []
         
-        if active:
-            print(f"⚠️ 超时，还有{len(active)}个任务未完成")
-        else:
-            print("🎉 所有任务已完成！")
+        self._trial: Optional[Tuple[int, float]] = None    # (调整前的并发数, 调整前的吞吐)
+        self._hold = 0
+        self._ceiling = self.max_concurrent
+        self._last_errors = 0
+        self._seen_errors: set = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def connections_for(self, concurrent: int) -> int:
+        return max(1, min(16, self.connection_budget // concurrent))
+    
+    def start(self):
+        self._stop.clear()
+        self._apply(self.concurrent, 0.0, 0, "初始设置")
+        self._thread = threading.Thread(target=self._run, daemon=True, name="aria2-tuner")
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        speeds: List[float] = []
+        errors = 0
+        waiting = 0
+        skip_first = False
+        while not self._stop.wait(self.sample_interval):
+            try:
+                sample = self._sample()
+            except Exception as e:
+                logger.debug(f"[并发调整] 采样失败: {e}")
+                continue
+            if sample is None:
+                continue
+            speed, new_errors, waiting, busy = sample
+            errors += new_errors
+            if not busy:
+                # 队列已空，不调整
+                speeds.clear()
+                continue
+            if skip_first:
+                # 调整后的第一个采样包含过渡期，不计入
+                skip_first = False
+                continue
+            speeds.append(speed)
+            if len(speeds) < self.window:
+                continue
+            
+            average = sum(speeds) / len(speeds)
+            changed = self.decide(average, errors, waiting)
+            speeds.clear()
+            errors = 0
+            skip_first = changed
+    
+    def _sample(self) -> Optional[Tuple[float, int, int, bool]]:
+        """返回 (吞吐, 新增失败数, 等待任务数, 是否有任务在运行或等待)"""
+        (stat, error), (stopped, _) = self.client.multicall([
+            ("aria2.getGlobalStat", []),
+            ("aria2.tellStopped", [-1, 1000, ["gid", "status"]]),
+        ])
+        if error is not None:
+            return None
+        new_errors = 0
+        for item in stopped or []:
+            if item.get('status') == 'error' and item['gid'] not in self._seen_errors:
+                self._seen_errors.add(item['gid'])
+                new_errors += 1
+        active = int(stat.get('numActive', 0))
+        waiting = int(stat.get('numWaiting', 0))
+        return float(stat.get('downloadSpeed', 0)), new_errors, waiting, bool(active or waiting)
+    
+    def decide(self, speed: float, errors: int, waiting: int) -> bool:
+        """根据一个窗口的平均吞吐和失败数做一次决策，返回是否调整了并发数"""
+        current = self.concurrent
+        target, reason = current, ""
         
-        return gids
+        if errors >= 2 and errors > self._last_errors:
+            if self._trial is not None:
+                target = self._trial[0]
+                self._ceiling = target
+                reason = f"失败增加 ({errors}个)，回退并以 {target} 为上限"
+            else:
+                target = max(self.min_concurrent, current // 2)
+                reason = f"失败增加 ({errors}个)，减少并发"
+            self._trial = None
+            self._hold = TUNE_PROBE_EVERY
+        elif self._trial is not None:
+            previous, baseline = self._trial
+            self._trial = None
+            if speed >= baseline * (1 + TUNE_GAIN):
+                if waiting and current < self._ceiling:
+                    target = self._grow(current)
+                    self._trial = (current, speed)
+                    reason = f"吞吐提升 {self._gain(speed, baseline)}，继续增加"
+            else:
+                target = previous
+                reason = f"吞吐未提升 ({self._gain(speed, baseline)})，回退"
+                self._hold = TUNE_PROBE_EVERY
+        elif self._hold > 0:
+            self._hold -= 1
+        elif waiting and current < self._ceiling:
+            target = self._grow(current)
+            self._trial = (current, speed)
+            reason = "尝试增加并发"
+        
+        self._last_errors = errors
+        if target == current:
+            return False
+        self._apply(target, speed, errors, reason)
+        return True
     
-    def _cleanup_completed(self, active: Dict[str, Tuple[str, float]]):
-        """清理已完成的任务"""
-        for gid in list(active.keys()):
-            status = self.get_status(gid)
-            if status and status.get('status') in ['complete', 'error', 'removed']:
-                filename, start_time = active.pop(gid)
-                elapsed = time.time() - start_time
-                icon = "✅" if status['status'] == 'complete' else "❌"
-                print(f"{icon} {filename} ({elapsed:.1f}秒)")
+    def _grow(self, current: int) -> int:
+        return min(self._ceiling, max(current + 1, int(current * 1.5)))
+    
+    @staticmethod
+    def _gain(speed: float, baseline: float) -> str:
+        return f"{(speed / baseline - 1):+.0%}" if baseline > 0 else "n/a"
+    
+    def _apply(self, concurrent: int, speed: float, errors: int, reason: str):
+        """应用并发数和单任务连接数，并记录决策"""
+        connections = self.connections_for(concurrent)
+        options = {"max-concurrent-downloads": str(concurrent),
+                   "max-connection-per-server": str(connections), "split": str(connections)}
+        (_, error), (waiting, _) = self.client.multicall([
+            ("aria2.changeGlobalOption", [options]),
+            ("aria2.tellWaiting", [0, concurrent, ["gid"]]),
+        ])
+        if error is not None:
+            logger.warning(f"[并发调整] 设置失败: {error}")
+            return
+        if waiting:
+            per_download = {"max-connection-per-server": str(connections), "split": str(connections)}
+            self.client.multicall([("aria2.changeOption", [item['gid'], per_download]) for item in waiting])
+        
+        self.concurrent = concurrent
+        decision = TuneDecision(time.time(), concurrent, connections, speed, errors, reason)
+        self.decisions.append(decision)
+        logger.info(f"[并发调整] 并发 {concurrent}, 单任务连接 {connections} "
+                    f"(吞吐 {speed / 1024 / 1024:.2f}MB/s): {reason}")
 
 
 class Aria2Server:
-    """Aria2 RPC服务器管理"""
+    """
+    Aria2 RPC服务器管理
     
-    def __init__(self, aria2_path: str = "aria2c.exe", port: int = 6800, token: str = ""):
+    端口上已有 aria2 在运行时直接连接 (attached)，stop() 不会终止不是由本程序启动的进程。
+    
+    未完成的任务保存在会话文件中 (--save-session，每 SESSION_SAVE_INTERVAL 秒及退出时保存)，
+    下次启动时作为 --input-file 恢复 (restored 为 True)。
+    """
+    
+    def __init__(self, aria2_path: str = "aria2c.exe", port: int = 6800, token: str = "",
+                 session_file: Optional[str] = SESSION_FILE):
         self.aria2_path = aria2_path
         self.port = port
         self.token = token
+        self.session_file = os.path.abspath(session_file) if session_file else None
         self.process = None
+        self.attached = False
+        self.restored = False
+        self.startup_latency: Optional[float] = None
     
-    def start(self, max_concurrent: int = 3, max_conn_per_server: int = 16) -> bool:
-        """启动服务器"""
-        # 检查可执行文件
-        if not os.path.exists(self.aria2_path):
-            print(f"❌ 找不到aria2c: {self.aria2_path}")
-            return False
+    @property
+    def keys_file(self) -> Optional[str]:
+        """会话任务的 gid -> block ID 映射文件"""
+        return self.session_file + KEYS_SUFFIX if self.session_file else None
+    
+    def has_session(self) -> bool:
+        """是否有上次未完成的会话"""
+        return bool(self.session_file and os.path.exists(self.session_file)
+                    and os.path.getsize(self.session_file) > 0)
+    
+    def start(self, max_concurrent: int = 3, max_conn_per_server: int = 16,
+              input_file: Optional[str] = None) -> bool:
+        """
+        启动服务器 (或连接已在运行的服务器)
         
-        # 检查端口
+        Args:
+            input_file: 启动时加载的输入文件 (批量模式)；不指定时恢复上次的会话
+        """
+        # 端口已被占用：是 aria2 就直接使用
         if self._is_port_in_use():
-            print(f"❌ 端口{self.port}已被占用")
+            version = self._probe_version()
+            if version is None:
+                print(f"❌ 端口{self.port}已被占用 (不是Aria2 RPC服务)")
+                return False
+            if input_file:
+                print(f"❌ 端口{self.port}上已有Aria2在运行，批量模式需要由本程序启动Aria2")
+                return False
+            self.attached = True
+            self.startup_latency = 0.0
+            client = Aria2Client(port=self.port, token=self.token)
+            client._call("aria2.changeGlobalOption", [{"max-concurrent-downloads": str(max_concurrent)}])
+            client.close()
+            print(f"✅ 已连接到运行中的Aria2 {version} (端口{self.port})")
+            return True
+        
+        # 检查可执行文件
+        if not os.path.exists(self.aria2_path) and not shutil.which(self.aria2_path):
+            print(f"❌ 找不到aria2c: {self.aria2_path}")
             return False
         
         # 构建命令
@@ -201,7 +1026,17 @@ class Aria2Server:
         if self.token:
             cmd.append(f"--rpc-secret={self.token}")
         
+        if self.session_file:
+            cmd += [f"--save-session={self.session_file}",
+                    f"--save-session-interval={SESSION_SAVE_INTERVAL}"]
+            if input_file is None and self.has_session():
+                input_file = self.session_file
+                self.restored = True
+        if input_file:
+            cmd.append(f"--input-file={os.path.abspath(input_file)}")
+        
         try:
+            started = time.perf_counter()
             self.process = subprocess.Popen(
                 cmd,
                 stdout=DEVNULL,
@@ -209,20 +1044,25 @@ class Aria2Server:
                 creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
             )
             
-            # 等待启动
-            time.sleep(3)
-            
-            if self.process.poll() is not None:
-                print("❌ Aria2进程异常退出")
-                return False
-            
-            # 验证连接
-            client = Aria2Client(port=self.port, token=self.token)
-            for _ in range(3):
-                if client.is_connected():
-                    print(f"✅ Aria2服务器已启动 (端口{self.port})")
-                    return True
-                time.sleep(1)
+            # 指数退避探测：端口可连接后再确认 getVersion 有响应
+            deadline = started + STARTUP_TIMEOUT
+            delay = PROBE_DELAY
+            while time.perf_counter() < deadline:
+                if self.process.poll() is not None:
+                    print("❌ Aria2进程异常退出")
+                    self.process = None
+                    return False
+                
+                if self._is_port_in_use():
+                    version = self._probe_version()
+                    if version is not None:
+                        self.startup_latency = time.perf_counter() - started
+                        logger.info(f"Aria2 {version} 启动耗时 {self.startup_latency:.3f}秒")
+                        print(f"✅ Aria2服务器已启动 (端口{self.port}, 耗时{self.startup_latency:.2f}秒)")
+                        return True
+                
+                time.sleep(delay)
+                delay = min(delay * 2, PROBE_MAX_DELAY)
             
             print("❌ 无法连接到Aria2服务器")
             self.stop()
@@ -233,11 +1073,23 @@ class Aria2Server:
             return False
     
     def stop(self):
-        """停止服务器"""
+        """停止服务器 (连接的外部服务器保持运行)"""
+        if self.attached:
+            self.attached = False
+            print("ℹ️ Aria2服务器不是由本程序启动的，保持运行")
+            return
         if self.process:
             try:
-                self.process.terminate()
-                self.process.wait(timeout=5)
+                # 先通过RPC正常退出，aria2 会在退出时保存会话
+                client = Aria2Client(port=self.port, token=self.token)
+                try:
+                    client._post("aria2.shutdown", client._params([]))
+                    self.process.wait(timeout=5)
+                except Exception:
+                    self.process.terminate()
+                    self.process.wait(timeout=5)
+                finally:
+                    client.close()
                 print("✅ Aria2服务器已停止")
             except subprocess.TimeoutExpired:
                 self.process.kill()
@@ -247,11 +1099,21 @@ class Aria2Server:
     
     def is_running(self) -> bool:
         """检查是否运行中"""
-        if not self.process or self.process.poll() is not None:
+        if not self.attached and (not self.process or self.process.poll() is not None):
             return False
         client = Aria2Client(port=self.port, token=self.token)
         return client.is_connected()
     
+    def _probe_version(self) -> Optional[str]:
+        """探测端口上的 aria2 RPC，返回版本号 (不是 aria2 或未就绪时返回 None，不记录错误日志)"""
+        client = Aria2Client(port=self.port, token=self.token)
+        try:
+            return client._post("aria2.getVersion", client._params([])).get('version', '?')
+        except Exception:
+            return None
+        finally:
+            client.close()
+    
     def _is_port_in_use(self) -> bool:
         """检查端口是否被占用"""
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -269,4 +1131,5 @@ class Aria2Server:
 
 # 兼容旧API的别名
 Aria2LocalClient = Aria2Client
-Aria2RPCServer = Aria2Server
\ No newline at end of file
+Aria2RPCServer = Aria2Server
+
@@ -0,0 +1,914 @@
+# Notion-Files-Management - 原生多线程下载模块
+# 无需 Aria2 / IDM 的内置下载引擎
+# Copyright (C) 2025-2026 Ruibin_Ningh & Zyx_2012
+# License: GPL v3
+
+import os
+import re
+import json
+import zlib
+import base64
+import time
+import queue
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Iterable, Any, List, Tuple, Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from notion import logger, is_url_expired
+from telemetry import get_metrics
+from profiling import profiled
+from aria2 import sanitize_filename
+
+
+# ============ 配置常量 ============
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024   # 1MB - 每次读取的数据块
+DOWNLOAD_TIMEOUT = 30               # 连接/读取超时(秒)
+DEFAULT_WORKERS = 4
+
+# 分段下载配置
+SEGMENT_SIZE = 16 * 1024 * 1024     # 16MB - 每个Range分段大小 (也是首个请求的范围)
+MAX_CONNECTIONS = 8                 # 单个文件最大连接数
+INITIAL_CONNECTIONS = 2             # 分段下载起始连接数
+RAMP_INTERVAL = 1.0                 # 吞吐采样间隔(秒)
+RAMP_GAIN = 1.1                     # 新增连接后吞吐至少提升10%才继续增加
+SEGMENT_RETRIES = 3                 # 单个分段最大尝试次数
+
+# 磁盘写入配置
+WRITE_BUFFER_SIZE = 64 * 1024 * 1024    # 64MB - 网络线程与写入线程之间的缓冲上限
+WRITE_COALESCE_SIZE = 8 * 1024 * 1024   # 8MB - 相邻数据块合并后单次写入的上限
+WRITER_IDLE_EXIT = 5.0                  # 写入线程空闲多久后退出(秒)，有新数据时自动重启
+
+# 断点续传配置
+PART_SUFFIX = ".part"               # 未完成文件后缀
+STATE_SUFFIX = ".part.json"         # 续传信息旁路文件后缀
+STATE_SAVE_INTERVAL = 1.0           # 续传信息最短保存间隔(秒)
+CORRUPT_SUFFIX = ".corrupt"         # 校验失败的文件保留为 <文件名>.corrupt
+
+# 服务器明确给出的整文件校验值: 响应头 -> 算法 (ETag 不一定是内容的 MD5，不用于校验)
+CHECKSUM_HEADERS = {
+    'x-amz-checksum-sha256': 'sha256',
+    'x-amz-checksum-sha1': 'sha1',
+    'x-amz-checksum-crc32': 'crc32',
+}
+
+
+# ============ 工具函数 ============
+
+def create_download_session(pool_size: int) -> requests.Session:
+    """创建连接池大小与并发数匹配的下载会话 (所有线程共享，复用TCP/TLS连接)"""
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["HEAD", "GET"],
+        backoff_factor=1
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(pool_size, 1), max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def parse_content_range_total(resp: requests.Response) -> Optional[int]:
+    """从 206 响应的 Content-Range (bytes 0-99/1234) 中解析文件总大小"""
+    if resp.status_code != 206:
+        return None
+    match = re.match(r'bytes\s+\d+-\d+/(\d+)', resp.headers.get('content-range', ''))
+    return int(match.group(1)) if match else None
+
+
+class PositionalFile:
+    """
+    定位写入文件 - 多个连接线程按偏移量并发写入同一文件
+
+    POSIX 使用 os.pwrite (无需加锁，互不干扰)；不支持时回退为加锁的 seek + write。
+    经 DiskWriter 写入时，写入失败的异常记录在 error 上，由网络线程检查后中止下载。
+    """
+
+    def __init__(self, path: str):
+        self.fd = os.open(path, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+        self._lock = None if hasattr(os, 'pwrite') else threading.Lock()
+        self.error: Optional[BaseException] = None
+
+    def write(self, offset: int, data: bytes):
+        if self._lock is None:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        else:
+            with self._lock:
+                os.lseek(self.fd, offset, os.SEEK_SET)
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(self.fd, view):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+def allocate_file(path: str, size: int, preallocate: bool = False):
+    """
+    创建指定大小的文件
+
+    preallocate=True 时用 posix_fallocate 预先分配磁盘空间 (减少碎片，空间不足时立即失败)；
+    注意在不支持的文件系统上 glibc 会逐块写零模拟，大文件会很慢，因此默认只截断到目标大小。
+    """
+    with open(path, 'wb') as f:
+        if preallocate and size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError as e:
+                logger.debug(f"预分配失败，改为截断: {e}")
+        f.truncate(size)
+
+
+def response_etag(resp: requests.Response) -> str:
+    """获取响应的 ETag (去掉引号和弱校验前缀)"""
+    return resp.headers.get('etag', '').replace('W/', '').strip('"').lower()
+
+
+def response_checksum(resp: requests.Response) -> str:
+    """
+    获取服务器明确给出的整文件校验值，格式为 "算法:base64"，没有时返回空字符串
+
+    Content-MD5 只在完整响应 (200) 中对应整个文件；分片上传对象的组合校验值
+    (带 "-N" 后缀或 x-amz-checksum-type: COMPOSITE) 无法按整文件计算，跳过
+    """
+    if resp.status_code == 200 and resp.headers.get('content-md5'):
+        return f"md5:{resp.headers['content-md5'].strip()}"
+    if resp.headers.get('x-amz-checksum-type', '').upper() == 'COMPOSITE':
+        return ""
+    for header, algorithm in CHECKSUM_HEADERS.items():
+        value = resp.headers.get(header, '').strip()
+        if value and '-' not in value:
+            return f"{algorithm}:{value}"
+    return ""
+
+
+def display_name(file_info) -> str:
+    """文件保存时使用的名称 (伪装的 .txt 文件还原为原始文件名)"""
+    name, _, _ = file_info
+    return getattr(file_info, 'original_name', None) or name
+
+
+def file_key(file_info) -> str:
+    """文件的唯一标识: block ID，没有时用去掉签名参数的URL"""
+    _, url, _ = file_info
+    return getattr(file_info, 'block_id', '') or url.split('?', 1)[0]
+
+
+def unique_name(name: str, taken: set) -> str:
+    """
+    清理文件名并在与 taken 中已有的名称冲突时加上 " (n)" 后缀，结果加入 taken
+
+    比较时忽略大小写 (Windows / macOS 的文件系统不区分大小写)
+    """
+    name = sanitize_filename(name)
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    n = 1
+    while candidate.casefold() in taken:
+        candidate = f"{stem} ({n}){ext}"
+        n += 1
+    taken.add(candidate.casefold())
+    return candidate
+
+
+def file_checksum(path: str, algorithm: str) -> str:
+    """按 response_checksum 的算法计算文件的校验值 (base64，与响应头格式一致)"""
+    crc = 0
+    digest = None if algorithm == 'crc32' else hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE * 4), b''):
+            if digest is None:
+                crc = zlib.crc32(block, crc)
+            else:
+                digest.update(block)
+    raw = crc.to_bytes(4, 'big') if digest is None else digest.digest()
+    return base64.b64encode(raw).decode('ascii')
+
+
+# ============ 磁盘写入 ============
+
+class WriterStats:
+    """
+    写入流水线统计 (用于判断瓶颈在网络还是磁盘)
+
+    - put_wait: 网络线程因缓冲区已满而阻塞的总时间 (各线程累加) —— 磁盘跟不上
+    - idle: 写入线程等待数据的时间 —— 网络跟不上
+    - busy: 写入线程实际写盘的时间
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.put_wait = 0.0
+        self.idle = 0.0
+        self.busy = 0.0
+        self.bytes_written = 0
+        self.writes = 0
+
+    @property
+    def utilization(self) -> float:
+        """写入线程的忙碌比例"""
+        active = self.busy + self.idle
+        return self.busy / active if active > 0 else 0.0
+
+    @property
+    def bottleneck(self) -> str:
+        # 写入线程几乎不空闲 (缓冲区即将填满) 或网络线程已在等待缓冲区时是磁盘瓶颈，否则是网络
+        if self.utilization > 0.8 or self.put_wait > self.idle:
+            return "磁盘"
+        return "网络"
+
+    def summary(self) -> str:
+        avg = self.bytes_written / self.writes / 1024 / 1024 if self.writes else 0.0
+        return (f"瓶颈: {self.bottleneck} (写盘忙碌 {self.utilization:.0%}, "
+                f"网络线程等待 {self.put_wait:.1f}s, 写入线程空闲 {self.idle:.1f}s, "
+                f"{self.writes} 次写入, 平均 {avg:.1f}MB)")
+
+
+class DiskWriter:
+    """
+    独立的磁盘写入线程
+
+    网络线程只负责把数据块放入有界队列 (submit)，由写入线程按偏移量写入文件，
+    慢速磁盘 (U盘、NAS) 不会阻塞 socket 读取。写入线程每次取出一批数据块 (最多
+    WRITE_COALESCE_SIZE)，按文件和偏移量排序后把首尾相接的块合并为一次大块写入，
+    多个连接交错到达的数据也能合并。回调 (call) 会在此前提交的所有写入完成后执行，
+    用于在数据真正落盘后再记录续传进度。
+
+    写入线程空闲 WRITER_IDLE_EXIT 秒后自动退出，下次提交时重新启动。
+    """
+
+    def __init__(self, buffer_size: int = WRITE_BUFFER_SIZE, chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 coalesce_size: int = WRITE_COALESCE_SIZE):
+        self.queue: queue.Queue = queue.Queue(maxsize=max(2, buffer_size // max(chunk_size, 1)))
+        self.coalesce_size = coalesce_size
+        self.stats = WriterStats()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, target: PositionalFile, offset: int, data: bytes):
+        """提交一个数据块 (缓冲区已满时阻塞，阻塞时间计入 put_wait)"""
+        self._put((target, offset, data))
+
+    def call(self, callback: Callable[[], None]):
+        """在此前提交的写入全部完成后执行回调 (在写入线程中执行)"""
+        self._put((None, 0, callback))
+
+    def flush(self):
+        """等待此前提交的写入全部完成"""
+        done = threading.Event()
+        self.call(done.set)
+        done.wait()
+
+    def _put(self, item: tuple):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            started = time.perf_counter()
+            self.queue.put(item)
+            waited = time.perf_counter() - started
+            with self.stats.lock:
+                self.stats.put_wait += waited
+        # 先入队再检查线程：写入线程只在队列为空时 (持锁) 退出，两者不会错过
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="disk-writer")
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            try:
+                item = self.queue.get(timeout=WRITER_IDLE_EXIT)
+            except queue.Empty:
+                with self._lock:
+                    if self.queue.empty():
+                        self._thread = None
+                        return
+                continue
+            finally:
+                self.stats.idle += time.perf_counter() - started
+
+            # 取出一批数据块，遇到回调为止 (回调必须在之前的写入完成后执行)
+            batch = []
+            size = 0
+            callback = None
+            while True:
+                target, offset, data = item
+                if target is None:
+                    callback = data
+                    break
+                batch.append(item)
+                size += len(data)
+                if size >= self.coalesce_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+            if callback is not None:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"写入回调失败: {e}")
+
+    def _write_batch(self, batch: List[tuple]):
+        """按文件和偏移量排序，合并首尾相接的数据块后写入"""
+        batch.sort(key=lambda item: (id(item[0]), item[1]))
+        i = 0
+        while i < len(batch):
+            target, offset, data = batch[i]
+            blocks = [data]
+            end = offset + len(data)
+            i += 1
+            while i < len(batch) and batch[i][0] is target and batch[i][1] == end:
+                blocks.append(batch[i][2])
+                end += len(batch[i][2])
+                i += 1
+
+            if target.error is not None:
+                continue
+            started = time.perf_counter()
+            try:
+                target.write(offset, blocks[0] if len(blocks) == 1 else b''.join(blocks))
+            except Exception as e:
+                target.error = e
+                logger.error(f"写入文件失败: {e}")
+            self.stats.busy += time.perf_counter() - started
+            self.stats.bytes_written += end - offset
+            self.stats.writes += 1
+
+
+# ============ 断点续传 ============
+
+class PartState:
+    """
+    断点续传信息
+
+    未完成的下载写入 <文件名>.part，旁路文件 <文件名>.part.json 记录 URL、block ID、
+    文件总大小、ETag、服务器给出的校验值和已完成的字节区间；下次下载时只请求缺失的区间。
+    ETag 只用于判断服务器上的文件是否变化。
+    """
+
+    def __init__(self, part_file: str, url: str, block_id: str, total: int,
+                 etag: str = "", completed: Optional[List[List[int]]] = None,
+                 checksum: str = ""):
+        self.part_file = part_file
+        self.url = url
+        self.block_id = block_id
+        self.total = total
+        self.etag = etag
+        self.checksum = checksum
+        self.completed: List[List[int]] = completed or []
+        self.lock = threading.Lock()
+        self._last_save = 0.0
+
+    @property
+    def state_file(self) -> str:
+        return self.part_file[:-len(PART_SUFFIX)] + STATE_SUFFIX
+
+    @classmethod
+    def load(cls, part_file: str, url: str, block_id: str) -> Optional['PartState']:
+        """读取续传信息，与当前文件不匹配或 .part 文件缺失时返回 None"""
+        state_file = part_file[:-len(PART_SUFFIX)] + STATE_SUFFIX
+        if not os.path.exists(part_file) or not os.path.exists(state_file):
+            return None
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # 同一文件：block ID 相同，或签名URL的路径相同 (签名参数每次都会变)
+        if block_id and data.get('block_id'):
+            same = data['block_id'] == block_id
+        else:
+            same = data.get('url', '').split('?')[0] == url.split('?')[0]
+        if not same or os.path.getsize(part_file) != data.get('total'):
+            return None
+
+        return cls(part_file, data.get('url', url), data.get('block_id', block_id),
+                   data['total'], data.get('etag', ''), data.get('completed', []),
+                   data.get('checksum', ''))
+
+    def save(self, force: bool = True):
+        """原子写入续传信息 (force=False 时按 STATE_SAVE_INTERVAL 节流)"""
+        with self.lock:
+            now = time.time()
+            if not force and now - self._last_save < STATE_SAVE_INTERVAL:
+                return
+            self._last_save = now
+            data = {
+                'url': self.url,
+                'block_id': self.block_id,
+                'total': self.total,
+                'etag': self.etag,
+                'checksum': self.checksum,
+                'completed': [list(r) for r in self.completed],
+            }
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.state_file)
+
+    def add_range(self, start: int, end: int):
+        """记录已完成的区间 [start, end]，并与相邻区间合并"""
+        with self.lock:
+            ranges = sorted(self.completed + [[start, end]])
+            merged: List[List[int]] = []
+            for r_start, r_end in ranges:
+                if merged and r_start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], r_end)
+                else:
+                    merged.append([r_start, r_end])
+            self.completed = merged
+
+    def missing(self) -> List[Tuple[int, int]]:
+        """缺失的区间列表"""
+        with self.lock:
+            result = []
+            pos = 0
+            for start, end in self.completed:
+                if start > pos:
+                    result.append((pos, start - 1))
+                pos = max(pos, end + 1)
+            if pos < self.total:
+                result.append((pos, self.total - 1))
+            return result
+
+    @property
+    def done_bytes(self) -> int:
+        with self.lock:
+            return sum(end - start + 1 for start, end in self.completed)
+
+    def remove(self):
+        """删除 .part 和续传信息"""
+        for path in (self.part_file, self.state_file):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# ============ 统计 ============
+
+class DownloadStats:
+    """下载统计 (线程安全)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = get_metrics()
+        self.completed = 0
+        self.failed = 0
+        self.bytes_downloaded = 0
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.end_time = None
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def add_bytes(self, count: int):
+        with self.lock:
+            self.bytes_downloaded += count
+        if self.metrics:
+            self.metrics.inc("notion_download_bytes_total", count)
+
+    def add_result(self, success: bool):
+        with self.lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    @property
+    def elapsed(self) -> float:
+        if not self.start_time:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def speed(self) -> float:
+        """整体吞吐 (字节/秒)"""
+        elapsed = self.elapsed
+        return self.bytes_downloaded / elapsed if elapsed > 0 else 0.0
+
+
+# ============ 下载引擎 ============
+
+class DownloadEngine:
+    """
+    原生多线程下载引擎
+
+    - 线程池并发下载多个文件，所有线程共享一个带连接池的会话
+    - 进度回调 progress_callback(name, downloaded, total, status, key)，key 为 block ID
+      (没有时为目标路径)，同名文件之间不会混淆
+    - 接受任意可迭代的文件列表 (包括 iter_files() 的流式结果)，在途任务数有上限
+    - 网络线程只读取数据，由共享的 DiskWriter 线程写盘 (writer.stats 可判断瓶颈所在)
+    """
+
+    def __init__(self, manager: Any = None, num_workers: int = DEFAULT_WORKERS,
+                 chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+                 segment_size: int = SEGMENT_SIZE, max_connections: int = MAX_CONNECTIONS,
+                 buffer_size: int = WRITE_BUFFER_SIZE, preallocate: bool = False):
+        self.manager = manager
+        self.num_workers = max(1, num_workers)
+        self.chunk_size = chunk_size
+        self.segment_size = segment_size
+        self.max_connections = max(1, max_connections)
+        self.preallocate = preallocate
+        self.session = create_download_session(self.num_workers * self.max_connections)
+        self.writer = DiskWriter(buffer_size, chunk_size)
+        self.stats = DownloadStats()
+        self.stop_event = threading.Event()
+
+    def download_all(self, files: Iterable, save_dir: str,
+                     progress_callback: Optional[Callable] = None) -> DownloadStats:
+        """
+        并发下载多个文件
+
+        Args:
+            files: FileInfo (或旧的 [name, url, load_time] 列表) 的可迭代对象
+            save_dir: 保存目录
+            progress_callback: 单个文件的进度回调
+
+        Returns:
+            本次下载的统计信息
+        """
+        os.makedirs(save_dir, exist_ok=True)
+        self.stats = DownloadStats()
+        self.stats.start()
+        self.stop_event.clear()
+
+        # 限制在途任务数，流式输入时不会一次性提交全部文件
+        slots = threading.BoundedSemaphore(self.num_workers * 2)
+        # 本批次的目标文件名: 文件标识 -> 文件名 (同名文件加 " (n)" 后缀，各自使用独立的 .part)
+        planned: Dict[str, str] = {}
+        taken: set = set()
+
+        pool = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="download")
+        try:
+            for file_info in files:
+                if self.stop_event.is_set():
+                    break
+                key = file_key(file_info)
+                if key in planned:
+                    logger.warning(f"跳过重复的下载任务: {planned[key]}")
+                    continue
+                target_name = planned[key] = unique_name(display_name(file_info), taken)
+                slots.acquire()
+                future = pool.submit(self.download_file, file_info, save_dir, progress_callback, target_name)
+                future.add_done_callback(lambda _: slots.release())
+            pool.shutdown(wait=True)
+        except BaseException:
+            # Ctrl+C 等: 通知进行中的下载在下一个数据块后中止，取消排队的任务，不等待它们结束
+            self.stop_event.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self.stats.finish()
+
+        logger.info(f"下载结束: 成功 {self.stats.completed}, 失败 {self.stats.failed}, "
+                    f"共 {self.stats.bytes_downloaded / 1024 / 1024:.1f}MB, "
+                    f"平均 {self.stats.speed / 1024 / 1024:.2f}MB/s")
+        logger.info(f"下载写入 {self.writer.stats.summary()}")
+        return self.stats
+
+    def stop(self):
+        """停止提交新任务 (已开始的下载会在下一个数据块后中止)"""
+        self.stop_event.set()
+
+    @profiled("download_file")
+    def download_file(self, file_info, save_path: str,
+                      progress_callback: Optional[Callable] = None,
+                      target_name: Optional[str] = None) -> bool:
+        """
+        下载单个文件 (支持断点续传)
+
+        伪装上传的文件 (FileInfo.is_spoofed) 直接保存为原始文件名；target_name 为
+        download_all 规划的不重名文件名。
+        数据先写入 <文件名>.part，校验长度 (以及服务器给出校验值时的内容) 后才原子重命名为最终文件。
+        首个请求只取第一个缺失区间的第一个分段：服务器返回 206 时即可得知文件大小，
+        其余区间按分段并发下载；服务器不支持 Range (返回 200) 时按单连接流式下载。
+        签名URL过期时按 block ID 从 Notion 重新获取。
+        """
+        _, url, _ = file_info
+        block_id = getattr(file_info, 'block_id', '')
+        # 伪装成 .txt 上传的文件直接以原始文件名保存，无需事后重命名
+        name = target_name or sanitize_filename(display_name(file_info))
+        os.makedirs(save_path, exist_ok=True)
+        save_file = os.path.join(save_path, name)
+        part_file = save_file + PART_SUFFIX
+        key = block_id or save_file
+
+        def report(downloaded: int, total: int, status: str):
+            if progress_callback:
+                progress_callback(name, downloaded, total, status, key)
+
+        try:
+            if self.stop_event.is_set():
+                raise InterruptedError("下载已取消")
+            state = PartState.load(part_file, url, block_id)
+            if state and state.done_bytes:
+                logger.info(f"断点续传: {name} (已完成 {state.done_bytes}/{state.total} bytes)")
+
+            source = {'url': url, 'block_id': block_id, 'lock': threading.Lock()}
+            if is_url_expired(url):
+                self._refresh_url(source, url)
+
+            missing = state.missing() if state else [(0, -1)]
+            if missing:
+                first_start = missing[0][0]
+                resp = self._request(source, first_start, first_start + self.segment_size - 1)
+                total = parse_content_range_total(resp)
+
+                if state and (total != state.total or (state.etag and response_etag(resp) != state.etag)):
+                    logger.warning(f"{name} 服务器上的文件已变化，重新下载")
+                    resp.close()
+                    state.remove()
+                    state = None
+                    resp = self._request(source, 0, self.segment_size - 1)
+                    total = parse_content_range_total(resp)
+
+                if total is None:
+                    # 服务器不支持 Range，只能从头流式下载
+                    if state:
+                        state.remove()
+                    state = self._download_stream(name, part_file, source, resp, report)
+                else:
+                    if state is None:
+                        state = PartState(part_file, source['url'], block_id, total, response_etag(resp),
+                                          checksum=response_checksum(resp))
+                        allocate_file(part_file, total, self.preallocate)
+                        state.save()
+                    self._download_ranges(name, source, state, resp, report)
+
+            self._finalize(state, save_file)
+            report(state.total, state.total, "完成")
+
+            self.stats.add_result(True)
+            logger.info(f"下载完成: {name}")
+            return True
+
+        except Exception as e:
+            logger.error(f"下载失败 {name}: {e}")
+            self.stats.add_result(False)
+            report(0, 0, "失败")
+            return False
+
+    def _request(self, source: Dict[str, Any], start: int, end: int) -> requests.Response:
+        """
+        发起 Range 请求 (end < start 时不限制结束位置)
+
+        返回 403/400 且能按 block ID 刷新签名URL时，刷新后重试一次
+        """
+        headers = {"Range": f"bytes={start}-{end if end >= start else ''}"}
+        url = source['url']
+        resp = self.session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers)
+        if resp.status_code in (400, 403) and self._refresh_url(source, url):
+            resp.close()
+            resp = self.session.get(source['url'], stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers)
+        resp.raise_for_status()
+        return resp
+
+    def _refresh_url(self, source: Dict[str, Any], stale_url: str) -> bool:
+        """按 block ID 刷新签名URL (多个连接同时发现过期时只刷新一次)"""
+        if not self.manager or not source['block_id']:
+            return False
+        with source['lock']:
+            if source['url'] != stale_url:
+                return True
+            fresh_url = self.manager.get_file_url(source['block_id'])
+            if not fresh_url:
+                return False
+            source['url'] = fresh_url
+            logger.info(f"已刷新下载地址: {source['block_id']}")
+            return True
+
+    def _download_stream(self, name: str, part_file: str, source: Dict[str, Any],
+                         resp: requests.Response, report: Callable[[int, int, str], None]) -> PartState:
+        """单连接流式下载到 .part 文件 (服务器不支持 Range)"""
+        total = int(resp.headers.get('content-length', 0))
+        state = PartState(part_file, source['url'], source['block_id'], total, response_etag(resp),
+                          checksum=response_checksum(resp))
+        downloaded = 0
+
+        allocate_file(part_file, total, self.preallocate)
+        target = PositionalFile(part_file)
+        try:
+            with resp:
+                for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                    if self.stop_event.is_set():
+                        raise InterruptedError("下载已取消")
+                    if target.error is not None:
+                        raise target.error
+                    if chunk:
+                        self.writer.submit(target, downloaded, chunk)
+                        downloaded += len(chunk)
+                        self.stats.add_bytes(len(chunk))
+                        report(downloaded, total, "下载中")
+        finally:
+            self.writer.flush()
+            target.close()
+            if downloaded and target.error is None:
+                state.add_range(0, downloaded - 1)
+            state.total = state.total or downloaded
+            state.save()
+
+        if target.error is not None:
+            raise target.error
+
+        if total and downloaded != total:
+            raise IOError(f"数据不完整: {downloaded}/{total} bytes")
+        return state
+
+    def _download_ranges(self, name: str, source: Dict[str, Any], state: PartState,
+                         first_resp: requests.Response,
+                         report: Callable[[int, int, str], None]):
+        """
+        多连接分段下载缺失区间
+
+        缺失区间按 segment_size 切分为分段放入队列，各连接线程依次领取分段并把数据交给写入线程
+        按偏移量写进 .part 文件；分段的数据全部落盘后才记录到续传信息中。起始 INITIAL_CONNECTIONS 个连接，之后每隔 RAMP_INTERVAL
+        采样一次总吞吐，新增连接仍能带来 RAMP_GAIN 以上的提升时继续增加，直到 max_connections。
+        """
+        total = state.total
+        pieces: queue.Queue = queue.Queue()
+        first_piece = None
+        for range_start, range_end in state.missing():
+            for start in range(range_start, range_end + 1, self.segment_size):
+                piece = (start, min(start + self.segment_size - 1, range_end), 0)
+                if first_piece is None:
+                    first_piece = piece
+                else:
+                    pieces.put(piece)
+
+        target = PositionalFile(state.part_file)
+        lock = threading.Lock()
+        failed = threading.Event()
+        errors: List[Exception] = []
+        progress = {'bytes': state.done_bytes}
+
+        def fetch(start: int, end: int, resp: Optional[requests.Response] = None):
+            if resp is None:
+                resp = self._request(source, start, end)
+            pos = start
+            try:
+                with resp:
+                    if resp.status_code != 206:
+                        raise IOError(f"分段请求失败: HTTP {resp.status_code}")
+                    for chunk in resp.iter_content(chunk_size=self.chunk_size):
+                        if self.stop_event.is_set() or failed.is_set():
+                            raise InterruptedError("下载已取消")
+                        if target.error is not None:
+                            raise target.error
+                        if pos + len(chunk) > end + 1:
+                            chunk = chunk[:end + 1 - pos]
+                        self.writer.submit(target, pos, chunk)
+                        pos += len(chunk)
+                        self.stats.add_bytes(len(chunk))
+                        with lock:
+                            progress['bytes'] += len(chunk)
+                            done = progress['bytes']
+                        report(done, total, "下载中")
+                        if pos > end:
+                            break
+                if pos != end + 1:
+                    raise IOError(f"分段数据不完整: {start}-{end}")
+            except BaseException:
+                # 续传信息只记录完整分段，未完成分段已计入的进度需要扣除
+                with lock:
+                    progress['bytes'] -= pos - start
+                raise
+            self.writer.call(lambda: piece_written(start, end))
+
+        def piece_written(start: int, end: int):
+            # 在写入线程中执行：此前提交的该分段数据已全部写入
+            if target.error is None:
+                state.add_range(start, end)
+                state.save(force=False)
+
+        def connection(first: Optional[requests.Response] = None):
+            job = first_piece if first is not None else None
+            while not failed.is_set() and not self.stop_event.is_set():
+                if job is None:
+                    try:
+                        job = pieces.get_nowait()
+                    except queue.Empty:
+                        return
+                start, end, tries = job
+                try:
+                    fetch(start, end, first)
+                except Exception as e:
+                    if tries + 1 >= SEGMENT_RETRIES or isinstance(e, InterruptedError):
+                        with lock:
+                            errors.append(e)
+                        failed.set()
+                        return
+                    logger.warning(f"[分段下载] {name} 分段 {start}-{end} 失败，重新排队: {e}")
+                    pieces.put((start, end, tries + 1))
+                first = None
+                job = None
+
+        def add_connection(first: Optional[requests.Response] = None):
+            thread = threading.Thread(target=connection, args=(first,), daemon=True,
+                                      name=f"segment-{len(threads)}")
+            thread.start()
+            threads.append(thread)
+
+        threads: List[threading.Thread] = []
+        try:
+            add_connection(first_resp)
+            while len(threads) < min(INITIAL_CONNECTIONS, self.max_connections) and not pieces.empty():
+                add_connection()
+
+            ramping = True
+            prev_rate = None
+            with lock:
+                last_bytes = progress['bytes']
+            last_time = time.time()
+            while any(t.is_alive() for t in threads):
+                # 等待一个采样间隔 (所有连接提前结束时立即返回)
+                deadline = last_time + RAMP_INTERVAL
+                for thread in list(threads):
+                    thread.join(max(0.0, deadline - time.time()))
+                now = time.time()
+                with lock:
+                    current = progress['bytes']
+                rate = (current - last_bytes) / max(now - last_time, 1e-6)
+                last_bytes, last_time = current, now
+
+                if not ramping or pieces.empty() or len(threads) >= self.max_connections:
+                    continue
+                if prev_rate is None or rate >= prev_rate * RAMP_GAIN:
+                    prev_rate = rate
+                    add_connection()
+                    logger.debug(f"[分段下载] {name} 吞吐 {rate / 1024 / 1024:.2f}MB/s "
+                                 f"(单连接 {rate / (len(threads) - 1) / 1024 / 1024:.2f}MB/s)，"
+                                 f"增加到 {len(threads)} 个连接")
+                else:
+                    ramping = False
+                    logger.debug(f"[分段下载] {name} 吞吐不再提升 ({rate / 1024 / 1024:.2f}MB/s)，"
+                                 f"保持 {len(threads)} 个连接")
+        finally:
+            # 正常结束时所有连接已退出；异常退出时通知剩余连接停止
+            failed.set()
+            for thread in threads:
+                thread.join()
+            self.writer.flush()
+            target.close()
+            state.save()
+
+        if target.error is not None:
+            raise target.error
+        if errors:
+            raise errors[0]
+        if self.stop_event.is_set():
+            raise InterruptedError("下载已取消")
+
+    def _finalize(self, state: PartState, save_file: str):
+        """
+        校验长度和内容 (服务器给出校验值时)，通过后原子重命名为最终文件
+
+        内容校验失败时不删除数据：保留为 <文件名>.corrupt 并报告，重试时重新下载
+        """
+        if state.missing():
+            raise IOError(f"数据不完整: {state.done_bytes}/{state.total} bytes")
+
+        size = os.path.getsize(state.part_file)
+        if size != state.total:
+            state.remove()
+            raise IOError(f"文件长度不符: {size}/{state.total} bytes")
+
+        if state.checksum:
+            algorithm, expected = state.checksum.split(':', 1)
+            actual = file_checksum(state.part_file, algorithm)
+            if actual != expected:
+                corrupt_file = save_file + CORRUPT_SUFFIX
+                os.replace(state.part_file, corrupt_file)
+                state.remove()
+                raise IOError(f"{algorithm} 校验失败 ({actual} != {expected})，"
+                              f"文件已保留为 {os.path.basename(corrupt_file)}")
+
+        os.replace(state.part_file, save_file)
+        try:
+            os.remove(state.state_file)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,268 @@
+# Notion-Files-Management - 下载任务导出模块
+# 支持 IDM / aria2 / curl / wget / JSON Lines 等格式的流式导出
+# Copyright (C) 2025-2026 Ruibin_Ningh & Zyx_2012
+# License: GPL v3
+
+import os
+import json
+import logging
+from abc import ABC, abstractmethod
+from urllib.parse import unquote
+from typing import List, Iterable, Dict, Tuple, Type, Optional
+
+from aria2 import sanitize_filename, format_input_entry
+
+# 与 notion.py 共用同一个日志记录器 (不直接导入 notion，避免循环导入)
+logger = logging.getLogger("notion_upload")
+
+
+# ============ 配置常量 ============
+
+EXPORT_BUFFER_SIZE = 1024 * 1024    # 1MB - 每个导出文件的写缓冲
+RENAMES_FILE = "download_renames.json"
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0"
+
+
+def url_filename(url: str) -> str:
+    """下载器按URL保存时得到的文件名 (字符串切分，比 urlparse 快)"""
+    path = url.split('?', 1)[0].split('#', 1)[0]
+    if '://' in path:
+        path = path.split('://', 1)[1].partition('/')[2]
+    return unquote(path.rsplit('/', 1)[-1])
+
+
+# ============ 导出格式 ============
+
+class TaskExporter(ABC):
+    """
+    导出格式基类
+
+    子类实现 format() 把一个任务格式化为文本片段；header()/footer() 写在每个分片的首尾。
+    carries_filename 为 False 的格式无法指定保存文件名，下载器会按URL中的文件名保存，
+    此时与期望文件名不同的任务会写入重命名清单。
+    """
+
+    name = ""
+    description = ""
+    extension = ".txt"
+    carries_filename = True
+
+    def __init__(self, save_dir: str = "downloads"):
+        self.save_dir = os.path.abspath(save_dir)
+
+    def header(self) -> str:
+        return ""
+
+    @abstractmethod
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        """把一个任务格式化为文本片段"""
+
+    def footer(self) -> str:
+        return ""
+
+
+class EF2Exporter(TaskExporter):
+    """IDM .ef2 任务文件"""
+
+    name = "idm"
+    description = "IDM 任务文件 (.ef2)"
+    extension = ".ef2"
+    carries_filename = False
+
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        return f"<\n{url}\nreferer: {self._extract_referer(url)}\nUser-Agent: {USER_AGENT}\n>\n"
+
+    @staticmethod
+    def _extract_referer(url: str) -> str:
+        if "github" in url:
+            return "https://github.com"
+        scheme, sep, rest = url.partition('://')
+        if not sep:
+            return ""
+        netloc = rest.split('/', 1)[0].split('?', 1)[0]
+        return f"{scheme}://{netloc}" if netloc else ""
+
+
+class Aria2InputExporter(TaskExporter):
+    """aria2 输入文件 (aria2c -i)"""
+
+    name = "aria2"
+    description = "aria2 输入文件 (aria2c -i)"
+    extension = ".aria2.txt"
+
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        return format_input_entry(url, sanitize_filename(filename), self.save_dir)
+
+
+class CurlConfigExporter(TaskExporter):
+    """curl 配置文件 (curl --parallel -K)"""
+
+    name = "curl"
+    description = "curl 配置文件 (curl --parallel -K)"
+    extension = ".curl"
+
+    def header(self) -> str:
+        return "create-dirs\nfail\nlocation\n\n"
+
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        output = os.path.join(self.save_dir, sanitize_filename(filename))
+        return f"url = {self._quote(url)}\noutput = {self._quote(output)}\n"
+
+    @staticmethod
+    def _quote(value: str) -> str:
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class WgetListExporter(TaskExporter):
+    """URL 列表 (wget -i，也适用于大多数下载工具)"""
+
+    name = "wget"
+    description = "URL 列表 (wget -i)"
+    extension = ".urls.txt"
+    carries_filename = False
+
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        return url + "\n"
+
+
+class JsonLinesExporter(TaskExporter):
+    """JSON Lines (每行一个任务，便于脚本处理)"""
+
+    name = "jsonl"
+    description = "JSON Lines (每行一个任务)"
+    extension = ".jsonl"
+
+    def format(self, filename: str, url: str, block_id: str = "") -> str:
+        record = {"name": filename, "url": url, "block_id": block_id,
+                  "out": os.path.join(self.save_dir, sanitize_filename(filename))}
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+EXPORTERS: Dict[str, Type[TaskExporter]] = {
+    cls.name: cls for cls in (EF2Exporter, Aria2InputExporter, CurlConfigExporter,
+                              WgetListExporter, JsonLinesExporter)
+}
+
+
+# ============ 导出流程 ============
+
+def export_tasks(file_urls: Iterable[tuple], save_path: str, fmt: str = "idm",
+                 shards: int = 1, base_name: str = "download_tasks") -> List[str]:
+    """
+    流式导出下载任务
+
+    单次遍历输入 (可以是 iter_files() 的流式结果)，按序号轮流写入 shards 个分片文件，
+    每个文件带 EXPORT_BUFFER_SIZE 写缓冲；内存占用与任务数无关。
+    无法指定文件名的格式 (IDM、wget) 会把需要改名的任务以 [URL文件名, 原始文件名] 列表
+    流式写入 download_renames.json (同一个URL文件名可能对应多个文件，不能用字典)；
+    本次没有写入清单时删除目录中上次导出留下的清单。
+
+    Args:
+        file_urls: [(filename, url[, block_id]), ...]
+        save_path: 导出目录 (也作为下载保存目录写入支持的格式)
+        fmt: 导出格式，见 EXPORTERS
+        shards: 分片数，供多个下载器并行使用
+        base_name: 导出文件名前缀
+
+    Returns:
+        导出的文件列表 (没有任务时为空)
+    """
+    exporter = EXPORTERS[fmt](save_path)
+    shards = max(1, shards)
+    os.makedirs(save_path, exist_ok=True)
+
+    if shards == 1:
+        paths = [os.path.join(save_path, base_name + exporter.extension)]
+    else:
+        paths = [os.path.join(save_path, f"{base_name}_{i + 1:02d}of{shards:02d}{exporter.extension}")
+                 for i in range(shards)]
+    renames_path = os.path.join(save_path, RENAMES_FILE)
+
+    files = []
+    renames = None
+    count = 0
+    renamed = 0
+    try:
+        for path in paths:
+            f = open(path, 'w', encoding='utf-8', newline='\n', buffering=EXPORT_BUFFER_SIZE)
+            files.append(f)
+            f.write(exporter.header())
+        if not exporter.carries_filename:
+            renames = open(renames_path, 'w', encoding='utf-8', buffering=EXPORT_BUFFER_SIZE)
+            renames.write("[")
+
+        for item in file_urls:
+            filename, url = item[0], item[1]
+            block_id = item[2] if len(item) > 2 else ""
+            files[count % shards].write(exporter.format(filename, url, block_id))
+            count += 1
+
+            if renames is not None:
+                url_name = url_filename(url)
+                if url_name and url_name != filename:
+                    renames.write(("," if renamed else "") + "\n " +
+                                  json.dumps([url_name, filename], ensure_ascii=False))
+                    renamed += 1
+
+        for f in files:
+            f.write(exporter.footer())
+        if renames is not None:
+            renames.write("\n]\n")
+    finally:
+        for f in files:
+            f.close()
+        if renames is not None:
+            renames.close()
+
+    # 清理空的输出
+    if count == 0:
+        for path in paths:
+            os.remove(path)
+        paths = []
+    elif count < shards:
+        for path in paths[count:]:
+            os.remove(path)
+        paths = paths[:count]
+    if not renamed and os.path.exists(renames_path):
+        # 没有需要重命名的任务 (或格式本身能指定文件名)，旧清单不能留给"文件处理"误用
+        os.remove(renames_path)
+
+    logger.info(f"已导出 {count} 个任务 ({exporter.description}, {len(paths)} 个文件, "
+                f"{renamed} 个需重命名)")
+    return paths
+
+
+def _folder_path(folder: str, name: str) -> Optional[str]:
+    """清单中的文件名 -> folder 下的路径；清理后仍指向 folder 之外 (如 "..") 时返回 None"""
+    root = os.path.realpath(folder)
+    path = os.path.realpath(os.path.join(root, sanitize_filename(name)))
+    if os.path.dirname(path) != root:
+        return None
+    return path
+
+
+def apply_renames(folder: str) -> Tuple[int, int]:
+    """
+    按 download_renames.json 清单重命名下载的文件 (只处理清单中的文件，不遍历目录)
+
+    清单可能来自别处，文件名先经 sanitize_filename 清理，且只允许 folder 下的文件
+
+    Returns:
+        (成功数, 跳过/失败数)
+    """
+    with open(os.path.join(folder, RENAMES_FILE), 'r', encoding='utf-8') as f:
+        renames: List[List[str]] = json.load(f)
+
+    success, skipped = 0, 0
+    for url_name, filename in renames:
+        src = _folder_path(folder, url_name)
+        dst = _folder_path(folder, filename)
+        if src is None or dst is None:
+            logger.warning(f"重命名清单中的文件名不安全，已跳过: {url_name} -> {filename}")
+            skipped += 1
+        elif os.path.exists(src) and not os.path.exists(dst):
+            os.rename(src, dst)
+            success += 1
+        else:
+            skipped += 1
+    return success, skipped
@@ -6,14 +6,13 @@ import os
 import sys
 import time
 import math
-import queue
 import platform
 import shutil
 import threading
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from threading import Lock
-from typing import List, Tuple, Optional, Dict
+from typing import List, Tuple, Optional, Dict, Iterable
 
 import questionary
 import requests
@@ -28,14 +27,19 @@ from rich.progress import (
     TransferSpeedColumn
 )
 from rich import box
+from rich.markup import escape
 from dotenv import load_dotenv
 
 from notion import (
-    NotionFileManager, IDMExporter, UploadProgress, UploadStatus,
-    UploadFileInfo, MAX_FILE_SIZE, PART_SIZE, logger as notion_logger
+    NotionFileManager, UploadProgress, UploadStatus,
+    UploadFileInfo, MAX_FILE_SIZE, PART_SIZE, detect_spoofed, is_url_expired,
+    logger as notion_logger
 )
-from aria2 import Aria2Client, Aria2Server
-from rich_ui import ModernUploadUI, TaskStatus as UITaskStatus
+from exporters import EXPORTERS, RENAMES_FILE, export_tasks, apply_renames
+from aria2 import Aria2Client, Aria2Server, UrlRecovery, ConcurrencyTuner, write_input_file
+from downloader import DownloadEngine
+from rich_ui import TaskTable, create_upload_ui, is_headless
+from profiling import get_profiler
 
 # ============ 全局配置 ============
 
@@ -128,65 +132,25 @@ def format_time(seconds: float) -> str:
     return f"{minutes:02d}:{secs:02d}"
 
 
-# ============ 状态映射 ============
-
-def map_status(upload_status: UploadStatus) -> UITaskStatus:
-    """将 notion.py 的 UploadStatus 映射到 rich_ui 的 TaskStatus"""
-    mapping = {
-        UploadStatus.PENDING: UITaskStatus.PENDING,
-        UploadStatus.UPLOADING: UITaskStatus.UPLOADING,
-        UploadStatus.COMPLETING: UITaskStatus.COMPLETING,
-        UploadStatus.ATTACHING: UITaskStatus.ATTACHING,
-        UploadStatus.COMPLETED: UITaskStatus.COMPLETED,
-        UploadStatus.FAILED: UITaskStatus.FAILED,
-        UploadStatus.RETRYING: UITaskStatus.RETRYING,
-        UploadStatus.CHECKING: UITaskStatus.CHECKING,
-        UploadStatus.RECOVERING: UITaskStatus.RECOVERING,
-    }
-    return mapping.get(upload_status, UITaskStatus.PENDING)
-
-
-# ============ 上传任务数据类 ============
-
-class UploadTask:
-    """上传任务"""
-    def __init__(self, task_id: int, file_info: UploadFileInfo, target_page_id: str):
-        self.id = task_id
-        self.file_info = file_info
-        self.target_page_id = target_page_id
-        self.status = UploadStatus.PENDING
-        self.progress = 0.0
-        self.uploaded_bytes = 0
-        self.part_current = 0
-        self.part_total = 0
-        self.retry_count = 0
-        self.error_message = ""
-        self.thread_id: Optional[int] = None
-        self.start_time: Optional[float] = None
-
-
-# ============ 适配器类：保持原有API，内部使用新UI ============
+# ============ 上传UI ============
 
 class RichUploadUI:
     """
-    适配器类 - 保持原有API不变，内部使用新的 ModernUploadUI
-    这样不需要修改 NotionUploader 类的任何代码
+    上传UI - 包装 ModernUploadUI (stdout 不是终端时为 NDJSON 无界面输出)
+    任务状态全部存放在共享的 TaskTable 中，上传器直接写入，UI 只读取
     """
     
-    def __init__(self, total_files: int, total_size: int, num_threads: int):
-        # 使用新的现代UI
-        self._ui = ModernUploadUI(total_files, total_size, num_threads)
+    def __init__(self, table: TaskTable, num_threads: int):
+        self.table = table
+        self._ui = create_upload_ui(table, num_threads)
         self.console = self._ui.console
         self.lock = self._ui.lock
         
         # 兼容性属性
-        self.total_files = total_files
-        self.total_size = total_size
+        self.total_files = len(table)
+        self.total_size = table.total_size
         self.num_threads = num_threads
-        
-        # 任务存储（兼容原有接口）
-        self.tasks: Dict[int, UploadTask] = {}
-        
+    
     @property
     def completed_count(self):
         return self._ui.completed_count
@@ -195,35 +159,9 @@ class RichUploadUI:
     def failed_count(self):
         return self._ui.failed_count
     
-    def add_task(self, task: UploadTask):
-        """添加任务 (保持原有签名)"""
-        self.tasks[task.id] = task
-        self._ui.add_task(
-            task_id=task.id,
-            filename=task.file_info.original_name,
-            filesize=task.file_info.size,
-            target_page_id=task.target_page_id,
-        )
-    
-    def update_task(self, task_id: int, **kwargs):
-        """更新任务 (保持原有签名)"""
-        # 更新本地任务对象
-        if task_id in self.tasks:
-            task = self.tasks[task_id]
-            for key, value in kwargs.items():
-                if hasattr(task, key):
-                    setattr(task, key, value)
-        
-        # 转换状态枚举
-        ui_kwargs = kwargs.copy()
-        if 'status' in ui_kwargs:
-            ui_kwargs['status'] = map_status(ui_kwargs['status'])
-        
-        self._ui.update_task(task_id, **ui_kwargs)
-    
-    def add_uploaded_bytes(self, bytes_count: int):
-        """增加已上传字节数"""
-        self._ui.add_uploaded_bytes(bytes_count)
+    def post(self, task_id: int, status: UploadStatus, uploaded_bytes: int = 0):
+        """上报任务状态和新增上传字节 (工作线程热路径，不加锁)"""
+        self._ui.post(task_id, status, uploaded_bytes)
     
     def mark_completed(self, task_id: int, success: bool):
         """标记任务完成"""
@@ -231,6 +169,9 @@ class RichUploadUI:
     
     def start(self):
         """启动UI"""
+        profiler = get_profiler()
+        if profiler:
+            profiler.mark("上传开始")
         self._ui.start()
     
     def refresh(self):
@@ -241,10 +182,25 @@ class RichUploadUI:
         """停止UI"""
         self._ui.stop()
         
+        # 性能分析 (NOTION_PROFILE): 写出本次上传的结果并打印摘要
+        profiler = get_profiler()
+        if profiler:
+            profiler.mark("上传结束")
+            summary = profiler.write_report()
+            if summary and self._ui.headless:
+                # 无终端时标准输出是 NDJSON 进度流，摘要写到标准错误
+                print("性能分析:\n" + summary, file=sys.stderr)
+            elif summary:
+                console.print(f"\n[bold]⏱ 性能分析[/bold]\n[dim]{escape(summary)}[/dim]")
+        
+        if self._ui.headless:
+            return
+        
         # 显示日志文件路径
         try:
             log_path = getattr(notion_logger, 'log_file_path', None)
-            if log_path:
+            # 日志文件延迟创建，没有写入任何记录时不存在
+            if log_path and os.path.exists(log_path):
                 console.print(f"\n[dim]📋 详细日志已保存到: {log_path}[/dim]")
         except:
             pass
@@ -258,10 +214,11 @@ class NotionUploader:
     def __init__(self, manager: NotionFileManager, num_threads: int = 3):
         self.manager = manager
         self.num_threads = num_threads
-        self.task_queue: queue.Queue = queue.Queue()
+        self.table = TaskTable()
         self.ui: Optional[RichUploadUI] = None
         self.stop_event = threading.Event()
-        self.console = Console()
+        # 无终端时标准输出是 NDJSON 进度流，提示信息写到标准错误
+        self.console = Console(stderr=is_headless())
     
     def upload_files(self, filepaths: List[str], target_page_id: str = None):
         """上传多个文件"""
@@ -269,66 +226,28 @@ class NotionUploader:
         if not page_id:
             raise ValueError("请指定目标页面ID")
         
-        # 过滤有效文件
-        valid_files = []
+        # 过滤有效文件，直接写入任务表
+        table = self.table = TaskTable()
+        spoofed = 0
         for fp in filepaths:
             if os.path.exists(fp) and os.path.getsize(fp) <= MAX_FILE_SIZE:
-                valid_files.append(UploadFileInfo.from_path(fp))
+                file_info = UploadFileInfo.from_path(fp)
+                table.add(file_info.path, file_info.size, page_id)
+                spoofed += file_info.is_spoofed
         
-        if not valid_files:
+        if not len(table):
             self.console.print("[yellow]没有有效的文件可上传[/yellow]")
             return
         
-        total_size = sum(f.size for f in valid_files)
-        
         # 显示文件信息
-        self.console.print(f"\n[green]共 {len(valid_files)} 个文件, 总计 {format_size(total_size)}[/green]")
-        spoofed = [f for f in valid_files if f.is_spoofed]
+        self.console.print(f"\n[green]共 {len(table)} 个文件, 总计 {format_size(table.total_size)}[/green]")
         if spoofed:
-            self.console.print(f"[yellow]⚠️  {len(spoofed)} 个文件将使用后缀伪装上传[/yellow]")
+            self.console.print(f"[yellow]⚠️  {spoofed} 个文件将使用后缀伪装上传[/yellow]")
         
         self.console.print("\n[dim]3秒后开始上传...[/dim]")
         time.sleep(3)
         
-        # 初始化UI - 使用新的适配器
-        self.ui = RichUploadUI(len(valid_files), total_size, self.num_threads)
-        
-        # 创建任务
-        for i, file_info in enumerate(valid_files):
-            task = UploadTask(task_id=i, file_info=file_info, target_page_id=page_id)
-            self.ui.add_task(task)
-            self.task_queue.put(task)
-        
-        self.ui.start()
-        
-        # 启动工作线程
-        threads = []
-        for i in range(self.num_threads):
-            t = threading.Thread(target=self._worker, args=(i,), daemon=True)
-            t.start()
-            threads.append(t)
-        
-        # 主线程刷新UI
-        try:
-            while not self.task_queue.empty() or any(t.is_alive() for t in threads):
-                self.ui.refresh()
-                time.sleep(0.25)
-                
-                with self.ui.lock:
-                    done = self.ui.completed_count + self.ui.failed_count >= self.ui.total_files
-                if done:
-                    break
-        except KeyboardInterrupt:
-            self.console.print("\n\n[yellow]⏹️  正在停止...[/yellow]")
-            self.stop_event.set()
-        
-        try:
-            self.task_queue.join()
-        except:
-            pass
-        
-        self.stop_event.set()
-        self.ui.stop()
+        self._run()
     
     def upload_directory(self, directory: Path, parent_page_id: str = None):
         """上传整个目录（保持目录结构）"""
@@ -336,66 +255,55 @@ class NotionUploader:
         if not page_id:
             raise ValueError("请指定目标页面ID")
         
-        # 扫描目录
+        # 扫描目录，直接写入任务表 (目标页面在创建目录结构后再分配)
+        table = self.table = TaskTable()
+        subdirs = set()
+        spoofed = 0
         with self.console.status("[bold green]正在扫描目录结构...", spinner="dots"):
-            all_files = []
             for item in directory.rglob('*'):
                 if item.is_file():
                     file_info = UploadFileInfo.from_path(str(item))
                     if file_info.size <= MAX_FILE_SIZE:
-                        all_files.append((item, file_info))
+                        table.add(file_info.path, file_info.size, page_id)
+                        spoofed += file_info.is_spoofed
+                        rel_path = item.relative_to(directory)
+                        if len(rel_path.parts) > 1:
+                            subdirs.add(rel_path.parts[0])
         
-        if not all_files:
+        if not len(table):
             self.console.print("[yellow]⚠️  目录中没有找到可上传的文件[/yellow]")
             return
         
-        total_size = sum(f.size for _, f in all_files)
-        
-        # 统计子目录
-        subdirs = set()
-        for item, _ in all_files:
-            rel_path = item.relative_to(directory)
-            if len(rel_path.parts) > 1:
-                subdirs.add(rel_path.parts[0])
-        
-        self.console.print(f"\n[green]✅ 找到 {len(all_files)} 个文件，总大小 {format_size(total_size)}[/green]")
+        self.console.print(f"\n[green]✅ 找到 {len(table)} 个文件，总大小 {format_size(table.total_size)}[/green]")
         if subdirs:
             self.console.print(f"[cyan]📁 包含 {len(subdirs)} 个子目录[/cyan]")
         self.console.print(f"[cyan]🧵 使用 {self.num_threads} 个线程进行上传[/cyan]")
         
-        spoofed = [f for _, f in all_files if f.is_spoofed]
         if spoofed:
-            self.console.print(f"[yellow]⚠️  {len(spoofed)} 个文件将使用后缀伪装上传[/yellow]")
-        
-        # 创建目录对应的页面
-        page_mapping: Dict[Path, str] = {directory: page_id}
+            self.console.print(f"[yellow]⚠️  {spoofed} 个文件将使用后缀伪装上传[/yellow]")
         
+        # 创建目录对应的页面，并分配到对应页面
         if subdirs:
             self.console.print("\n[bold green]正在创建目录结构...[/bold green]")
             page_mapping = self._prepare_directory_pages(directory, page_id)
             self.console.print(f"[green]✅ 创建了 {len(page_mapping) - 1} 个子页面[/green]")
+            
+            for task_id in range(len(table)):
+                file_dir = Path(table.path(task_id)).parent
+                while file_dir != directory.parent:
+                    if file_dir in page_mapping:
+                        table.set_page(task_id, page_mapping[file_dir])
+                        break
+                    file_dir = file_dir.parent
         
         self.console.print("\n[dim]3秒后开始上传...[/dim]")
         time.sleep(3)
         
-        # 初始化UI - 使用新的适配器
-        self.ui = RichUploadUI(len(all_files), total_size, self.num_threads)
-        
-        # 创建任务，分配到对应页面
-        for i, (item, file_info) in enumerate(all_files):
-            target_page = page_id
-            file_dir = item.parent
-            
-            while file_dir != directory.parent:
-                if file_dir in page_mapping:
-                    target_page = page_mapping[file_dir]
-                    break
-                file_dir = file_dir.parent
-            
-            task = UploadTask(task_id=i, file_info=file_info, target_page_id=target_page)
-            self.ui.add_task(task)
-            self.task_queue.put(task)
-        
+        self._run()
+    
+    def _run(self):
+        """启动工作线程上传任务表中的全部任务，主线程刷新UI"""
+        self.ui = RichUploadUI(self.table, self.num_threads)
         self.ui.start()
         
         # 启动工作线程
@@ -407,7 +315,7 @@ class NotionUploader:
         
         # 主线程刷新UI
         try:
-            while not self.task_queue.empty() or any(t.is_alive() for t in threads):
+            while any(t.is_alive() for t in threads):
                 self.ui.refresh()
                 time.sleep(0.25)
                 
@@ -417,12 +325,6 @@ class NotionUploader:
                     break
         except KeyboardInterrupt:
             self.console.print("\n\n[yellow]⏹️  正在停止...[/yellow]")
-            self.stop_event.set()
-        
-        try:
-            self.task_queue.join()
-        except:
-            pass
         
         self.stop_event.set()
         self.ui.stop()
@@ -446,68 +348,61 @@ class NotionUploader:
         return page_mapping
     
     def _worker(self, thread_id: int):
-        """工作线程"""
+        """工作线程: 按顺序领取任务直到全部领取完"""
         while not self.stop_event.is_set():
+            task_id = self.table.claim()
+            if task_id is None:
+                return
             try:
-                task = self.task_queue.get(timeout=0.5)
-                self._upload_task(task, thread_id)
-                self.task_queue.task_done()
-            except queue.Empty:
-                continue
+                self._upload_task(task_id, thread_id)
             except Exception:
                 pass
     
-    def _upload_task(self, task: UploadTask, thread_id: int):
-        """执行单个上传任务"""
-        task.thread_id = thread_id
-        task.start_time = time.time()
-        self.ui.update_task(task.id, thread_id=thread_id)
+    def _upload_task(self, task_id: int, thread_id: int):
+        """执行单个上传任务 (本线程是该任务行的唯一写者)"""
+        table = self.table
+        ui = self.ui
+        table.thread[task_id] = thread_id
+        size = table.size[task_id]
         
         def progress_callback(progress: UploadProgress):
-            task.status = progress.status
-            task.part_current = progress.part_current
-            task.part_total = progress.part_total
-            task.retry_count = progress.retry_count
-            
-            # 先计算差值，再更新已上传字节数
-            bytes_diff = progress.uploaded - task.uploaded_bytes
-            task.uploaded_bytes = progress.uploaded
-            task.progress = progress.uploaded / progress.total if progress.total else 0
+            table.part[task_id] = progress.part_current
+            table.parts[task_id] = progress.part_total
+            table.retries[task_id] = min(progress.retry_count, 0xFFFF)
+            table.sent[task_id] = progress.uploaded
             
-            self.ui.update_task(
-                task.id,
-                status=progress.status,
-                progress=task.progress,
-                part_current=progress.part_current,
-                part_total=progress.part_total,
-                retry_count=progress.retry_count
-            )
-            
-            # 更新已上传字节数
+            # credited 是高水位: 分片重试时进度会回退，重发的字节不重复计入
+            bytes_diff = progress.uploaded - table.credited[task_id]
             if progress.status == UploadStatus.UPLOADING and bytes_diff > 0:
-                self.ui.add_uploaded_bytes(bytes_diff)
+                table.credited[task_id] = progress.uploaded
+            else:
+                bytes_diff = 0
+            
+            # 状态与已上传字节数合并为一个事件投递，不等待UI线程
+            ui.post(task_id, progress.status, bytes_diff)
         
         try:
             success = self.manager.upload_file(
-                task.file_info.path,
-                target_page_id=task.target_page_id,
+                table.path(task_id),
+                target_page_id=table.page_id(task_id),
                 progress_callback=progress_callback
             )
             
             if success:
-                self.ui.update_task(task.id, status=UploadStatus.COMPLETED, progress=1.0)
-                self.ui.mark_completed(task.id, True)
                 # 确保最终字节数正确
-                remaining = task.file_info.size - task.uploaded_bytes
-                if remaining > 0:
-                    self.ui.add_uploaded_bytes(remaining)
+                remaining = max(size - table.credited[task_id], 0)
+                table.sent[task_id] = table.credited[task_id] = size
+                ui.post(task_id, UploadStatus.COMPLETED, remaining)
+                ui.mark_completed(task_id, True)
             else:
-                self.ui.update_task(task.id, status=UploadStatus.FAILED, error_message="上传失败")
-                self.ui.mark_completed(task.id, False)
+                table.errors[task_id] = "上传失败"
+                ui.post(task_id, UploadStatus.FAILED)
+                ui.mark_completed(task_id, False)
                 
         except Exception as e:
-            self.ui.update_task(task.id, status=UploadStatus.FAILED, error_message=str(e))
-            self.ui.mark_completed(task.id, False)
+            table.errors[task_id] = str(e)
+            ui.post(task_id, UploadStatus.FAILED)
+            ui.mark_completed(task_id, False)
 
 
 # ============ 下载流程 ============
@@ -516,10 +411,24 @@ def run_download():
     token, version = check_env()
     page_id = get_page_id()
     
-    console.print("[dim]正在获取文件列表...[/]")
+    list_mode = questionary.select("获取方式:", choices=[
+        Choice("📋 浏览列表后选择", "browse"),
+        Choice("⚡ 全部下载 (边获取边下载)", "stream"),
+        Choice("🔙 返回", "back")
+    ], style=STYLE).ask()
+    
+    if list_mode in ("back", None):
+        return
+    
     manager = NotionFileManager(token, version)
     manager.set_page(page_id)
     
+    if list_mode == "stream":
+        _run_stream_download(manager)
+        return
+    
+    console.print("[dim]正在获取文件列表...[/]")
+    
     try:
         files = manager.file_list()
     except Exception as e:
@@ -531,30 +440,29 @@ def run_download():
         return
     
     console.print(f"\n[green]发现 {len(files)} 个文件:[/]")
-    for i, (name, _, _) in enumerate(files[:20], 1):
+    for i, name in enumerate(files.names[:20], 1):
         console.print(f"  [{i:02d}] {name}")
     if len(files) > 20:
         console.print(f"  [dim]... 还有 {len(files) - 20} 个文件[/]")
     
     has_aria2, aria2_mode = check_aria2()
     
-    download_method = questionary.select("下载方式:", choices=[
-        Choice("📋 导出IDM任务", "idm"),
-        Choice("📥 Aria2下载" + (" (需安装)" if not has_aria2 else ""), "aria2"),
-        Choice("🔙 返回", "back")
-    ], style=STYLE).ask()
+    download_method = _select_download_method(has_aria2)
     
-    if download_method == "back":
+    if download_method in ("back", None):
         return
     
     # 选择文件
     file_selection = questionary.select("选择范围:", choices=[
         Choice("全部文件", "all"),
         Choice("选择序号", "select"),
+        Choice("🔍 搜索筛选", "search"),
     ], style=STYLE).ask()
     
     if file_selection == "all":
         indices = list(range(len(files)))
+    elif file_selection == "search":
+        indices = _search_files(manager)
     else:
         ranges = questionary.text(
             "输入序号(如: 1-5,8,10-15):",
@@ -563,16 +471,7 @@ def run_download():
         if not ranges:
             return
         
-        indices = []
-        for part in ranges.split(','):
-            part = part.strip()
-            if '-' in part:
-                start, end = part.split('-', 1)
-                indices.extend(range(int(start) - 1, int(end)))
-            else:
-                indices.append(int(part) - 1)
-        
-        indices = [i for i in indices if 0 <= i < len(files)]
+        indices = [i for i in parse_ranges(ranges) if 0 <= i < len(files)]
     
     if not indices:
         console.print("[yellow]未选择任何文件[/]")
@@ -583,28 +482,258 @@ def run_download():
     save_dir = questionary.text("保存目录:", default="downloads").ask()
     os.makedirs(save_dir, exist_ok=True)
     
+    # 伪装的 .txt 文件在下载时直接还原为原始文件名
+    if download_method == "native":
+        _download_native(manager, files.select(indices), save_dir, len(indices))
+    elif download_method == "aria2":
+        file_items = [(files.original_name(i), files.urls[i], files.block_id(i)) for i in indices]
+        _download_aria2(manager, file_items, save_dir, has_aria2, aria2_mode)
+    else:
+        _export_tasks([(files.original_name(i), files.urls[i], files.block_id(i)) for i in indices], save_dir)
+
+
+def parse_ranges(ranges: str) -> List[int]:
+    """解析序号范围 (如: 1-5,8,10-15)，返回从0开始的下标"""
+    indices = []
+    for part in ranges.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            indices.extend(range(int(start) - 1, int(end)))
+        else:
+            indices.append(int(part) - 1)
+    return indices
+
+
+def parse_search_query(text: str) -> Tuple[str, str, dict]:
+    """
+    解析搜索语句
+    
+    语法: 关键词 [ext:zip] [type:video] [spoofed:yes] [after:2026-01-01] [before:2026-02-01] [sort:name|ext|edited|-edited]
+    关键词以 re: 开头按正则匹配，包含 * ? [ 按 glob 匹配，否则按子串匹配
+    """
+    words = []
+    filters: dict = {}
+    for word in text.split():
+        key, sep, value = word.partition(':')
+        key = key.lower()
+        if sep and key == 'ext':
+            filters['ext'] = value
+        elif sep and key == 'type':
+            filters['block_type'] = value.lower()
+        elif sep and key == 'spoofed':
+            filters['spoofed'] = value.lower() in ('1', 'y', 'yes', 'true')
+        elif sep and key == 'after':
+            filters['edited_after'] = value
+        elif sep and key == 'before':
+            filters['edited_before'] = value
+        elif sep and key == 'sort':
+            filters['reverse'] = value.startswith('-')
+            filters['sort'] = value.lstrip('-').lower()
+        else:
+            words.append(word)
+    
+    query = " ".join(words)
+    if query.startswith('re:'):
+        return query[3:], "regex", filters
+    if any(c in query for c in '*?['):
+        return query, "glob", filters
+    return query, "substring", filters
+
+
+def _search_files(manager: NotionFileManager) -> List[int]:
+    """在缓存的文件列表中搜索并选择文件，返回选中的行号"""
+    files = manager.file_list()
+    console.print("[dim]语法: 关键词 ext:zip type:video spoofed:yes after:2026-01-01 sort:-edited "
+                  "(re: 前缀为正则, 含 * ? 为通配符)[/]")
+    
+    while True:
+        text = questionary.text("搜索 (输入 :refresh 增量刷新列表):").ask()
+        if not text or not text.strip():
+            return []
+        
+        if text.strip() == ":refresh":
+            with console.status("[bold green]正在增量刷新文件列表...", spinner="dots"):
+                files = manager.refresh_files()
+            console.print(f"[green]当前共 {len(files)} 个文件[/]")
+            continue
+        
+        query, mode, filters = parse_search_query(text.strip())
+        start = time.perf_counter()
+        try:
+            rows = manager.search_files(query, mode, **filters)
+        except ValueError as e:
+            console.print(f"[red]❌ {e}[/]")
+            continue
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        console.print(f"\n[green]匹配 {len(rows)} 个文件[/] [dim]({elapsed_ms:.1f}ms)[/]")
+        for i, row in enumerate(rows[:20], 1):
+            console.print(f"  [{i:02d}] {files.names[row]}")
+        if len(rows) > 20:
+            console.print(f"  [dim]... 还有 {len(rows) - 20} 个文件[/]")
+        
+        if not rows:
+            continue
+        
+        action = questionary.select("操作:", choices=[
+            Choice("选择全部匹配", "all"),
+            Choice("在匹配结果中选择序号", "select"),
+            Choice("重新搜索", "again"),
+        ], style=STYLE).ask()
+        
+        if action == "all":
+            return rows
+        if action == "select":
+            ranges = questionary.text("输入序号(如: 1-5,8,10-15):").ask()
+            if not ranges:
+                return []
+            return [rows[i] for i in parse_ranges(ranges) if 0 <= i < len(rows)]
+        if action is None:
+            return []
+
+
+def _select_download_method(has_aria2: bool) -> Optional[str]:
+    return questionary.select("下载方式:", choices=[
+        Choice("⚡ 原生多线程下载", "native"),
+        Choice("📋 导出任务列表 (IDM/aria2/curl/wget/JSONL)", "export"),
+        Choice("📥 Aria2下载" + (" (需安装)" if not has_aria2 else ""), "aria2"),
+        Choice("🔙 返回", "back")
+    ], style=STYLE).ask()
+
+
+def _run_stream_download(manager: NotionFileManager):
+    """流式下载：每获取一页文件列表就立即交给下载器，不等待完整列表"""
+    has_aria2, aria2_mode = check_aria2()
+    
+    download_method = _select_download_method(has_aria2)
+    
+    if download_method in ("back", None):
+        return
+    
+    save_dir = questionary.text("保存目录:", default="downloads").ask()
+    os.makedirs(save_dir, exist_ok=True)
+    
+    if download_method == "native":
+        _download_native(manager, manager.iter_files(), save_dir)
+        return
+    
     if download_method == "aria2":
-        _download_aria2(files, indices, save_dir, has_aria2, aria2_mode)
+        file_items = ((info.original_name, info.url, info.block_id) for info in manager.iter_files())
+        _download_aria2(manager, file_items, save_dir, has_aria2, aria2_mode)
     else:
-        _export_idm(files, indices, save_dir)
+        _export_tasks(((info.original_name, info.url, info.block_id) for info in manager.iter_files()), save_dir)
+
+
+def _download_native(manager: NotionFileManager, files: Iterable, save_dir: str,
+                     total_files: Optional[int] = None):
+    """使用内置下载引擎并发下载"""
+    workers = questionary.select("并发数:", choices=[
+        Choice("3", 3),
+        Choice("5 (推荐)", 5),
+        Choice("8", 8),
+    ], default=5, style=STYLE).ask()
+    workers = workers if workers else 5
+    
+    engine = DownloadEngine(manager, num_workers=workers)
+    count_text = f"/{total_files}" if total_files else ""
+    
+    progress = Progress(
+        SpinnerColumn(),
+        TextColumn("{task.description}"),
+        BarColumn(),
+        DownloadColumn(),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+        console=console,
+    )
+    overall = progress.add_task(f"[bold]总进度 0{count_text}", total=None)
+    file_tasks: Dict[str, int] = {}  # block ID -> 进度条任务 (同名文件各自一行)
+    ui_lock = Lock()
+    
+    def on_progress(name: str, downloaded: int, total: int, status: str, key: str):
+        with ui_lock:
+            task_id = file_tasks.get(key)
+            if task_id is None:
+                task_id = progress.add_task(name[:40], total=total or None)
+                file_tasks[key] = task_id
+            progress.update(task_id, completed=downloaded, total=total or None)
+            
+            stats = engine.stats
+            progress.update(overall, completed=stats.bytes_downloaded,
+                            description=f"[bold]总进度 {stats.completed + stats.failed}{count_text}")
+            
+            if status in ("完成", "失败"):
+                progress.remove_task(file_tasks.pop(key))
+    
+    try:
+        with progress:
+            stats = engine.download_all(files, save_dir, on_progress)
+    except KeyboardInterrupt:
+        engine.stop()
+        console.print("\n[yellow]⏹️  已停止下载[/]")
+        stats = engine.stats
+    
+    console.print(f"\n[bold]完成: 成功{stats.completed}, 失败{stats.failed}[/]  "
+                  f"📦 {format_size(stats.bytes_downloaded)}  ⏱ {format_time(stats.elapsed)}  "
+                  f"⚡ {format_size(int(stats.speed))}/s")
+    console.print(f"[dim]{engine.writer.stats.summary()}[/]")
+    questionary.text("按回车返回...").ask()
 
 
-def _download_aria2(files: list, indices: list, save_dir: str, has_aria2: bool, aria2_mode: str):
+def _download_aria2(manager: NotionFileManager, file_items: Iterable[Tuple[str, str, str]], save_dir: str,
+                    has_aria2: bool, aria2_mode: str):
+    """file_items: [(文件名, URL, block ID), ...]，过期的链接按 block ID 自动重新获取"""
     if not has_aria2:
         console.print("[red]❌ Aria2不可用[/]")
         return
     
     aria2_path = "aria2c" if aria2_mode == "system" else "aria2c.exe"
     server = Aria2Server(aria2_path)
+    has_session = server.has_session()
+    if has_session:
+        console.print("[dim]检测到上次未完成的Aria2会话，启动后将自动恢复[/]")
+    
+    add_mode = questionary.select("添加方式:", choices=[
+        Choice("📡 RPC批量添加", "rpc"),
+        Choice("📄 生成输入文件启动 (适合大量文件)", "bulk"),
+        Choice("🎯 队列添加 (任务结束即补位，等待全部完成)", "queued"),
+        Choice("🔙 返回", "back")
+    ], style=STYLE).ask()
+    if add_mode in ("back", None):
+        return
     
-    concurrent = questionary.select("并发数:", choices=[
-        Choice("3 (推荐)", 3),
-        Choice("5", 5),
-        Choice("10", 10),
-    ], default=3, style=STYLE).ask()
+    # 队列模式由客户端控制在途任务数，不做自适应调整
+    concurrent_choices = [Choice("3", 3), Choice("5", 5), Choice("10", 10)]
+    if add_mode != "queued":
+        concurrent_choices.insert(0, Choice("🤖 自动 (根据吞吐调整, 推荐)", 0))
+    concurrent = questionary.select("并发数:", choices=concurrent_choices,
+                                    default=concurrent_choices[0].value, style=STYLE).ask()
+    auto_tune = concurrent == 0
     concurrent = concurrent if concurrent else 3
     
-    if not server.start(max_concurrent=concurrent):
+    client = Aria2Client(port=6800)
+    recovery = UrlRecovery(client, manager.get_file_url, is_url_expired,
+                           keys_file=server.keys_file, load=has_session)
+    track = lambda gid, item: recovery.track(gid, item[2])
+    
+    input_file = None
+    if add_mode == "bulk":
+        # 批量模式：任务直接写入输入文件，aria2 启动时加载，无需逐个RPC添加；
+        # aria2 只在启动时读取输入文件，所以要先列出全部文件 (需要尽快开始下载时用RPC批量添加)
+        input_file = os.path.abspath("aria2_input.txt")
+        with console.status("[bold green]正在列出文件并写入输入文件 (完成后启动Aria2)...", spinner="dots"):
+            count = write_input_file(file_items, input_file, save_dir, on_added=track)
+        if has_session:
+            # 会话文件与输入文件格式相同，合并后上次未完成的任务不会丢失
+            with open(server.session_file, 'r', encoding='utf-8') as src, \
+                    open(input_file, 'a', encoding='utf-8') as dst:
+                shutil.copyfileobj(src, dst)
+        console.print(f"[green]已生成输入文件: {input_file} ({count} 个任务)[/]")
+    
+    if not server.start(max_concurrent=concurrent, input_file=input_file):
         console.print("[red]❌ Aria2启动失败[/]")
         return
     
@@ -612,31 +741,74 @@ def _download_aria2(files: list, indices: list, save_dir: str, has_aria2: bool,
         server.open_ariang()
         console.print("[blue]已打开AriaNG界面[/]")
         
-        client = Aria2Client(port=6800)
-        file_urls = [(files[i][0], files[i][1]) for i in indices]
+        tuner = ConcurrencyTuner(client, initial=concurrent) if auto_tune else None
         
-        gids = client.add_downloads_batch(file_urls, save_dir)
-        console.print(f"\n[green]已添加 {len(gids)} 个任务[/]")
-        console.print("[yellow]请在AriaNG中查看进度，输入'stop'关闭服务器...[/]")
+        if server.restored:
+            console.print("[green]已恢复上次会话的任务[/]")
+        if add_mode == "rpc":
+            gids = client.add_downloads_batch(file_items, save_dir, on_added=track)
+            console.print(f"\n[green]已添加 {len(gids)} 个任务[/]")
+        console.print("[dim]链接过期的任务会自动重新获取链接并续传；未完成的任务会保存到会话，下次启动自动恢复[/]")
         
-        # 等待用户输入stop
-        while True:
-            user_input = input().strip().lower()
-            if user_input == "stop":
-                break
-            else:
-                console.print("[yellow]请输入'stop'来关闭服务器[/]")
+        recovery.start()
+        if tuner:
+            tuner.start()
+        try:
+            if add_mode == "queued":
+                gids = client.add_downloads_queued(file_items, save_dir, max_active=concurrent, on_added=track)
+                console.print(f"\n[green]队列下载结束，共 {len(gids)} 个任务[/]")
+            console.print("[yellow]请在AriaNG中查看进度，输入'stop'关闭服务器...[/]")
+            # 等待用户输入stop
+            while True:
+                user_input = input().strip().lower()
+                if user_input == "stop":
+                    break
+                else:
+                    console.print("[yellow]请输入'stop'来关闭服务器[/]")
+        finally:
+            recovery.stop()
+            if tuner:
+                tuner.stop()
+        
+        if recovery.recovered or recovery.refreshed:
+            console.print(f"[dim]已恢复 {recovery.recovered} 个失败任务, "
+                          f"提前刷新 {recovery.refreshed} 个链接[/]")
+        if tuner and len(tuner.decisions) > 1:
+            console.print("[dim]并发调整记录:[/]")
+            for d in tuner.decisions[-10:]:
+                console.print(f"[dim]  {time.strftime('%H:%M:%S', time.localtime(d.time))} "
+                              f"并发 {d.concurrent}, 单任务连接 {d.connections}, "
+                              f"{format_size(int(d.speed))}/s: {d.reason}[/]")
         
     finally:
         server.stop()
 
 
-def _export_idm(files: list, indices: list, save_dir: str):
-    file_urls = [(files[i][0], files[i][1]) for i in indices]
-    ef2_file = IDMExporter.export_tasks(file_urls, save_dir)
+def _export_tasks(file_items: Iterable[Tuple[str, str, str]], save_dir: str):
+    fmt = questionary.select("导出格式:", choices=[
+        Choice(cls.description, name) for name, cls in EXPORTERS.items()
+    ], style=STYLE).ask()
+    if fmt is None:
+        return
     
-    if ef2_file:
-        console.print(f"[green]✅ 已导出: {ef2_file}[/]")
+    shards = questionary.select("分片数 (多个下载器并行):", choices=[
+        Choice("1 (单个文件)", 1), Choice("2", 2), Choice("4", 4), Choice("8", 8),
+    ], default=1, style=STYLE).ask() or 1
+    
+    start_time = time.time()
+    try:
+        paths = export_tasks(file_items, save_dir, fmt, shards)
+    except Exception as e:
+        notion_logger.error(f"导出任务失败: {e}")
+        paths = []
+    
+    if paths:
+        console.print(f"[green]✅ 已导出 {len(paths)} 个文件 ({time.time() - start_time:.1f}秒):[/]")
+        for path in paths:
+            console.print(f"  • {path}")
+        if os.path.exists(os.path.join(save_dir, RENAMES_FILE)):
+            console.print(f"[dim]该格式无法指定文件名，下载完成后在「文件处理」中选择下载目录即可按 "
+                          f"{RENAMES_FILE} 恢复原始文件名[/]")
     else:
         console.print("[red]❌ 导出失败[/]")
     
@@ -717,6 +889,18 @@ def run_file_processing():
         console.print("[red]文件夹不存在[/]")
         return
     
+    # 原生/Aria2 下载已直接保存为原始文件名；IDM/wget 下载按导出时生成的清单重命名，无需遍历目录
+    if os.path.exists(os.path.join(folder, RENAMES_FILE)):
+        if questionary.confirm(f"检测到 {RENAMES_FILE}，按清单恢复文件名?", default=True).ask():
+            try:
+                success, skipped = apply_renames(folder)
+            except Exception as e:
+                console.print(f"[red]读取清单失败: {e}[/]")
+                return
+            console.print(f"\n[bold]完成: 重命名{success}, 跳过{skipped}[/]")
+            questionary.text("按回车返回...").ask()
+            return
+    
     all_files = []
     for root, _, files in os.walk(folder):
         for f in files:
@@ -729,7 +913,7 @@ def run_file_processing():
     console.print(f"\n[green]发现 {len(all_files)} 个文件[/]")
     
     action = questionary.select("操作:", choices=[
-        Choice("🗑️ 去除.txt后缀", "remove_txt"),
+        Choice("🗑️ 去除伪装的.txt后缀", "remove_txt"),
         Choice("📝 查看文件列表", "list"),
         Choice("🔙 返回", "back")
     ], style=STYLE).ask()
@@ -744,13 +928,14 @@ def run_file_processing():
             console.print(f"  [dim]... 还有 {len(all_files) - 20} 个[/]")
         return
     
-    txt_files = [f for f in all_files if f.endswith('.txt')]
+    # 只处理 "xxx.<不支持的扩展名>.txt"，普通 .txt 文件保持不变
+    txt_files = [f for f in all_files if detect_spoofed(os.path.basename(f))]
     
     if not txt_files:
-        console.print("[yellow]没有.txt文件[/]")
+        console.print("[yellow]没有伪装的.txt文件[/]")
         return
     
-    console.print(f"[green]找到 {len(txt_files)} 个.txt文件[/]")
+    console.print(f"[green]找到 {len(txt_files)} 个伪装的.txt文件[/]")
     
     if not questionary.confirm(f"确认去除后缀?", default=False).ask():
         return
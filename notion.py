@@ -4,31 +4,76 @@
 # License: GPL v3
 
 import os
+import re
+import sys
 import math
 import time
+import uuid
+import atexit
+import fnmatch
 import logging
 import mimetypes
-from datetime import datetime
-from typing import List, Tuple, Optional, Callable, Dict, Any, Set
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime, timezone
+from typing import List, Tuple, Optional, Callable, Dict, Any, Set, Iterator, Iterable
+from array import array
 from dataclasses import dataclass
 from enum import Enum
-from urllib.parse import unquote
+from urllib.parse import unquote, urlparse, parse_qs
 
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from urllib3.filepost import encode_multipart_formdata, choose_boundary
 from dotenv import load_dotenv
 
+from telemetry import telemetry_enabled, record_request, get_metrics
+from profiling import profiled, stage
+
 
 # ============ 日志配置 ============
 
-def setup_file_logger(log_dir: str = None, log_level: int = logging.DEBUG) -> logging.Logger:
+LOG_LEVEL_ENV = "NOTION_LOG_LEVEL"    # 日志级别 (DEBUG/INFO/WARNING/ERROR 或数字)
+LOG_DIR_ENV = "NOTION_LOG_DIR"        # 日志目录
+DEFAULT_LOG_LEVEL = logging.INFO
+LOG_MAX_BYTES = 10 * 1024 * 1024      # 10MB - 单个日志文件上限，超过后轮转
+LOG_BACKUP_COUNT = 5                  # 保留的轮转文件数
+LOG_PART_SAMPLE = 20                  # 分片日志采样: 首尾分片和每 N 个分片记录一次 (INFO)
+
+
+class LazyRotatingFileHandler(RotatingFileHandler):
+    """按大小轮转的文件Handler，第一次写日志时才创建目录和文件"""
+    
+    def __init__(self, filename: str, **kwargs):
+        super().__init__(filename, delay=True, **kwargs)
+    
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+def log_level_from_env(default: int = DEFAULT_LOG_LEVEL) -> int:
+    """从环境变量 NOTION_LOG_LEVEL 读取日志级别，无效时使用默认值"""
+    value = os.getenv(LOG_LEVEL_ENV, "").strip().upper()
+    if not value:
+        return default
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value)
+    return level if isinstance(level, int) else default
+
+
+def setup_file_logger(log_dir: str = None, log_level: int = None) -> logging.Logger:
     """
     设置文件日志记录器
     
+    记录经 QueueHandler 放入队列，由 QueueListener 的后台线程写入文件，工作线程不会阻塞在磁盘上；
+    文件按 LOG_MAX_BYTES 轮转，并且在第一条日志写入时才创建 (导入模块不会产生空日志文件)。
+    
     Args:
-        log_dir: 日志目录，默认为当前目录下的 logs 文件夹
-        log_level: 日志级别，默认 DEBUG
+        log_dir: 日志目录，默认为 NOTION_LOG_DIR 或当前目录下的 logs 文件夹
+        log_level: 日志级别，默认为 NOTION_LOG_LEVEL 或 INFO
     
     Returns:
         配置好的 logger
@@ -39,20 +84,20 @@ def setup_file_logger(log_dir: str = None, log_level: int = logging.DEBUG) -> lo
     if logger.handlers:
         return logger
     
-    logger.setLevel(log_level)
+    load_dotenv()
+    logger.setLevel(log_level if log_level is not None else log_level_from_env())
     
     # 日志目录
     if log_dir is None:
-        log_dir = os.path.join(os.getcwd(), "logs")
-    os.makedirs(log_dir, exist_ok=True)
+        log_dir = os.getenv(LOG_DIR_ENV) or os.path.join(os.getcwd(), "logs")
     
     # 日志文件名：upload_YYYYMMDD_HHMMSS.log
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     log_file = os.path.join(log_dir, f"upload_{timestamp}.log")
     
     # 文件Handler - 详细日志（只输出到文件，不干扰进度UI）
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setLevel(logging.DEBUG)
+    file_handler = LazyRotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                           backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
     file_formatter = logging.Formatter(
         '%(asctime)s | %(levelname)-8s | %(funcName)-25s | %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
@@ -62,17 +107,32 @@ def setup_file_logger(log_dir: str = None, log_level: int = logging.DEBUG) -> lo
     # 注意：不添加控制台Handler，避免日志干扰进度条显示
     # 所有日志都会写入文件，上传完成后提示用户查看日志文件
     
-    logger.addHandler(file_handler)
-    
-    # 静默记录日志文件位置（不打印到控制台）
-    logger.debug(f"日志文件: {log_file}")
+    # 异步写入: 调用方只入队，后台线程负责格式化后的磁盘写入；退出时排空队列
+    log_queue = SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_file_logger)
+    logger.addHandler(QueueHandler(log_queue))
     
-    # 保存日志文件路径供外部访问
+    # 保存日志文件路径供外部访问 (文件在第一条日志写入时才存在)
     logger.log_file_path = log_file
+    logger.log_listener = listener
     
     return logger
 
 
+def stop_file_logger():
+    """排空日志队列并停止后台写入线程 (可重复调用)"""
+    listener = getattr(logging.getLogger("notion_upload"), "log_listener", None)
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
+def sample_part(part_num: int, num_parts: int) -> bool:
+    """分片日志采样: 首尾分片和每 LOG_PART_SAMPLE 个分片返回 True"""
+    return part_num == 1 or part_num == num_parts or part_num % LOG_PART_SAMPLE == 0
+
+
 # 初始化日志
 logger = setup_file_logger()
 
@@ -86,6 +146,7 @@ NOTION_BASE_URL = "https://api.notion.com/v1"
 SMALL_FILE_LIMIT = 20 * 1024 * 1024   # 20MB - 小文件直传
 MAX_FILE_SIZE = 5 * 1024 * 1024 * 1024  # 5GB - 最大文件
 PART_SIZE = 10 * 1024 * 1024           # 10MB - 分片大小
+SEND_BLOCK_SIZE = 256 * 1024           # 256KB - 请求体发送块大小 (进度上报粒度)
 
 # 重试配置 - 改为无限重试
 MAX_PART_RETRIES = float('inf')  # 单个分片无限重试
@@ -154,15 +215,286 @@ class UploadStatus(Enum):
     RECOVERING = "recovering"
 
 
+def detect_spoofed(name: str, caption: str = "", block_type: str = "file") -> bool:
+    """
+    判断文件是否为上传时伪装成 .txt 的文件
+    
+    上传时不支持的扩展名会追加 .txt 后缀 (text/plain, file block)，并把原始文件名写入 caption；
+    没有 caption 时按上传规则判断：去掉 .txt 后的扩展名不在支持列表中。
+    """
+    if block_type != 'file' or not name.lower().endswith('.txt'):
+        return False
+    original = name[:-4]
+    if caption:
+        return caption == original
+    ext = os.path.splitext(original)[1].lower()
+    return bool(ext) and ext not in SUPPORTED_EXTENSIONS
+
+
 @dataclass
 class FileInfo:
     """文件信息"""
+    __slots__ = ('name', 'url', 'load_time', 'block_id', 'block_type', 'last_edited', 'is_spoofed')
+    
     name: str
     url: str
     load_time: str
+    block_id: str
+    block_type: str
+    last_edited: str
+    is_spoofed: bool
+    
+    @property
+    def original_name(self) -> str:
+        """去除伪装后缀后的原始文件名"""
+        return self.name[:-4] if self.is_spoofed else self.name
     
     def to_list(self) -> list:
         return [self.name, self.url, self.load_time]
+    
+    def __iter__(self):
+        # 兼容旧的 [name, url, load_time] 列表解包写法
+        return iter((self.name, self.url, self.load_time))
+
+
+class FileListing:
+    """
+    紧凑的文件列表存储
+    
+    按列保存文件信息：同一批次共享一个加载时间，block ID 以16字节存放在 bytearray 中，
+    block类型和编辑时间等重复字符串使用 sys.intern 驻留。
+    file_list、缓存和下载流程共用同一个实例，按需生成 FileInfo，不再来回转换。
+    """
+    __slots__ = ('load_time', 'names', 'urls', '_ids', '_odd_ids', 'block_types', 'edited_times',
+                 'spoofed')
+    
+    def __init__(self, load_time: str):
+        self.load_time = load_time
+        self.names: List[str] = []
+        self.urls: List[str] = []
+        self._ids = bytearray()
+        self._odd_ids: Dict[int, str] = {}  # 非UUID格式的block ID (极少出现)
+        self.block_types: List[str] = []
+        self.edited_times: List[str] = []
+        self.spoofed = bytearray()
+    
+    def append(self, info: FileInfo):
+        """追加一个文件"""
+        row = len(self.names)
+        self.names.append(info.name)
+        self.urls.append(info.url)
+        try:
+            self._ids += uuid.UUID(info.block_id).bytes
+        except (ValueError, TypeError, AttributeError):
+            self._ids += bytes(16)
+            self._odd_ids[row] = info.block_id or ""
+        self.block_types.append(sys.intern(info.block_type))
+        self.edited_times.append(sys.intern(info.last_edited))
+        self.spoofed.append(1 if info.is_spoofed else 0)
+    
+    def block_id(self, index: int) -> str:
+        """获取指定行的block ID"""
+        if index < 0:
+            index += len(self.names)
+        if index in self._odd_ids:
+            return self._odd_ids[index]
+        return str(uuid.UUID(bytes=bytes(self._ids[index * 16:index * 16 + 16])))
+    
+    def __len__(self) -> int:
+        return len(self.names)
+    
+    def __getitem__(self, index: int) -> FileInfo:
+        if index < 0:
+            index += len(self.names)
+        return FileInfo(
+            name=self.names[index],
+            url=self.urls[index],
+            load_time=self.load_time,
+            block_id=self.block_id(index),
+            block_type=self.block_types[index],
+            last_edited=self.edited_times[index],
+            is_spoofed=bool(self.spoofed[index]),
+        )
+    
+    def __iter__(self) -> Iterator[FileInfo]:
+        for i in range(len(self.names)):
+            yield self[i]
+    
+    def select(self, indices: Iterable[int]) -> Iterator[FileInfo]:
+        """按行号产出文件"""
+        for i in indices:
+            yield self[i]
+    
+    def original_name(self, index: int) -> str:
+        """获取指定行去除伪装后缀后的原始文件名"""
+        name = self.names[index]
+        return name[:-4] if self.spoofed[index] else name
+
+
+class FileIndex:
+    """
+    文件列表本地索引
+    
+    在 FileListing 上建立名称分词、扩展名、block类型、伪装标记的倒排索引和排序视图，
+    支持子串 / glob / 正则查询，全部在本地完成，不访问API。查询结果为 FileListing 的行号。
+    """
+    
+    SORT_KEYS = ('index', 'name', 'ext', 'edited')
+    _TOKEN_RE = re.compile(r'\w+')
+    _GLOB_SPECIAL_RE = re.compile(r'\*|\?|\[[^\]]*\]')
+    
+    def __init__(self, listing: FileListing):
+        self.listing = listing
+        self._lower = [name.lower() for name in listing.names]
+        self._exts: List[str] = []
+        self._tokens: Dict[str, array] = {}
+        self._by_ext: Dict[str, array] = {}
+        self._by_type: Dict[str, array] = {}
+        self._sorted: Dict[str, List[int]] = {}
+        
+        for row, lower in enumerate(self._lower):
+            if listing.spoofed[row]:
+                lower = lower[:-4]
+            ext = sys.intern(os.path.splitext(lower)[1])
+            self._exts.append(ext)
+            self._by_ext.setdefault(ext, array('I')).append(row)
+            self._by_type.setdefault(listing.block_types[row], array('I')).append(row)
+            for token in set(self._TOKEN_RE.findall(self._lower[row])):
+                self._tokens.setdefault(token, array('I')).append(row)
+    
+    def __len__(self) -> int:
+        return len(self._lower)
+    
+    def search(self, query: str = "", mode: str = "substring",
+               ext: Optional[str] = None, block_type: Optional[str] = None,
+               spoofed: Optional[bool] = None,
+               edited_after: Optional[str] = None, edited_before: Optional[str] = None,
+               sort: str = "index", reverse: bool = False) -> List[int]:
+        """
+        查询文件
+        
+        Args:
+            query: 查询内容，为空时匹配全部
+            mode: substring (忽略大小写子串) / glob / regex
+            ext: 扩展名过滤 (如 "zip" 或 ".zip"，伪装文件按原始扩展名)
+            block_type: block类型过滤 (file/image/video/pdf/audio)
+            spoofed: 是否为伪装的 .txt 文件
+            edited_after / edited_before: 按 last_edited_time (ISO 8601) 过滤
+            sort: index / name / ext / edited
+            reverse: 是否倒序
+        
+        Returns:
+            匹配的行号列表
+        """
+        if sort not in self.SORT_KEYS:
+            raise ValueError(f"不支持的排序方式: {sort}")
+        
+        candidates: Optional[Set[int]] = None
+        
+        def narrow(rows: Iterable[int]):
+            nonlocal candidates
+            candidates = set(rows) if candidates is None else candidates.intersection(rows)
+        
+        if ext is not None:
+            ext = ext.lower()
+            narrow(self._by_ext.get(ext if ext.startswith('.') or not ext else '.' + ext, ()))
+        if block_type is not None:
+            narrow(self._by_type.get(block_type, ()))
+        if spoofed is not None:
+            flags = self.listing.spoofed
+            narrow(row for row in (candidates if candidates is not None else range(len(flags)))
+                   if bool(flags[row]) == spoofed)
+        if edited_after is not None or edited_before is not None:
+            edited = self.listing.edited_times
+            narrow(row for row in (candidates if candidates is not None else range(len(edited)))
+                   if (edited_after is None or edited[row] >= edited_after)
+                   and (edited_before is None or edited[row] <= edited_before))
+        
+        if query:
+            narrow(self._match(query, mode, candidates))
+        
+        return self._ordered(candidates, sort, reverse)
+    
+    def _match(self, query: str, mode: str, candidates: Optional[Set[int]]) -> List[int]:
+        """按名称匹配，先用分词索引缩小范围再逐个校验"""
+        if mode == "substring":
+            needle = query.lower()
+            rows = self._rows_with_literals(self._TOKEN_RE.findall(needle), candidates)
+            return [row for row in rows if needle in self._lower[row]]
+        
+        if mode == "glob":
+            pattern = re.compile(fnmatch.translate(query.lower()))
+            literals = self._TOKEN_RE.findall(" ".join(self._GLOB_SPECIAL_RE.split(query.lower())))
+            rows = self._rows_with_literals(literals, candidates)
+            return [row for row in rows if pattern.match(self._lower[row])]
+        
+        if mode == "regex":
+            try:
+                pattern = re.compile(query, re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"正则表达式无效: {e}")
+            rows = candidates if candidates is not None else range(len(self._lower))
+            names = self.listing.names
+            return [row for row in rows if pattern.search(names[row])]
+        
+        raise ValueError(f"不支持的查询模式: {mode}")
+    
+    def _rows_with_literals(self, literals: List[str], candidates: Optional[Set[int]]) -> Iterable[int]:
+        """
+        通过分词索引找出可能匹配的行
+        
+        查询中连续的字母数字片段一定包含在文件名的某个分词中，
+        只需扫描词表 (远小于文件数) 就能得到候选行。
+        """
+        if not literals:
+            return candidates if candidates is not None else range(len(self._lower))
+        
+        literal = max(literals, key=len)
+        rows: Set[int] = set()
+        for token, postings in self._tokens.items():
+            if literal in token:
+                rows.update(postings)
+        
+        if candidates is not None:
+            rows &= candidates
+        return rows
+    
+    def _ordered(self, rows: Optional[Set[int]], sort: str, reverse: bool) -> List[int]:
+        """按排序视图输出"""
+        if sort == "index":
+            result = list(range(len(self._lower))) if rows is None else sorted(rows)
+        else:
+            view = self._sorted_view(sort)
+            if rows is None:
+                result = list(view)
+            elif len(rows) * 8 < len(view):
+                rank = self._sorted_view(sort + ":rank")
+                result = sorted(rows, key=rank.__getitem__)
+            else:
+                result = [row for row in view if row in rows]
+        
+        if reverse:
+            result.reverse()
+        return result
+    
+    def _sorted_view(self, key: str) -> List[int]:
+        """懒加载的排序视图 (以及 "<key>:rank" 形式的行号→名次映射)"""
+        if key not in self._sorted:
+            if key.endswith(":rank"):
+                view = self._sorted_view(key[:-5])
+                rank = [0] * len(view)
+                for position, row in enumerate(view):
+                    rank[row] = position
+                self._sorted[key] = rank
+            else:
+                rows = range(len(self._lower))
+                if key == "name":
+                    self._sorted[key] = sorted(rows, key=self._lower.__getitem__)
+                elif key == "ext":
+                    self._sorted[key] = sorted(rows, key=lambda r: (self._exts[r], self._lower[r]))
+                else:
+                    self._sorted[key] = sorted(rows, key=self.listing.edited_times.__getitem__)
+        return self._sorted[key]
 
 
 @dataclass 
@@ -232,6 +564,86 @@ class UploadSession:
     created_time: float
 
 
+def _parse_notion_time(value: str) -> float:
+    """解析 Notion 的 ISO 8601 时间 (如 2026-01-16T03:03:00.000Z)，失败返回0"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except (ValueError, AttributeError):
+        return 0.0
+
+
+def signed_url_expiry(url: str) -> Optional[float]:
+    """
+    解析 S3 签名URL的过期时间 (X-Amz-Date + X-Amz-Expires)
+    
+    Returns:
+        过期时间戳，URL不带签名参数时返回 None
+    """
+    try:
+        query = parse_qs(urlparse(url).query)
+        signed_at = datetime.strptime(query['X-Amz-Date'][0], "%Y%m%dT%H%M%SZ")
+        expires = int(query['X-Amz-Expires'][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+    return signed_at.replace(tzinfo=timezone.utc).timestamp() + expires
+
+
+def is_url_expired(url: str, margin: float = 60) -> bool:
+    """签名URL是否已过期 (或将在 margin 秒内过期)"""
+    expiry = signed_url_expiry(url)
+    return expiry is not None and time.time() + margin >= expiry
+
+
+def retry_sleep(delay: float):
+    """重试前的退避等待 (性能分析时计入 retry_wait 阶段)"""
+    with stage("retry_wait"):
+        time.sleep(delay)
+
+
+# ============ 请求体 ============
+
+class MultipartBody:
+    """
+    带发送进度的 multipart/form-data 请求体 (单个文件字段)
+    
+    各部分头由 urllib3 的 encode_multipart_formdata 生成，与 requests 的 files= 编码一致；
+    文件内容以 memoryview 按 SEND_BLOCK_SIZE 分块发送，不额外复制。
+    requests 通过 __len__ 设置 Content-Length；每次迭代都从头发送，连接层重试时可以重放。
+    """
+    
+    def __init__(self, files: Dict[str, tuple], data: Optional[Dict] = None,
+                 on_sent: Optional[Callable[[int], None]] = None,
+                 block_size: int = SEND_BLOCK_SIZE):
+        if len(files) != 1:
+            raise ValueError("MultipartBody 只支持单个文件字段")
+        (field, (filename, content, mime_type)), = files.items()
+        
+        boundary = choose_boundary()
+        fields = list((data or {}).items()) + [(field, (filename, b"", mime_type))]
+        envelope, self.content_type = encode_multipart_formdata(fields, boundary)
+        self._tail = f"\r\n--{boundary}--\r\n".encode()
+        self._head = envelope[:-len(self._tail)]
+        self._content = memoryview(content)
+        self._on_sent = on_sent
+        self._block_size = block_size
+    
+    def __len__(self) -> int:
+        return len(self._head) + len(self._content) + len(self._tail)
+    
+    def __iter__(self) -> Iterator[bytes]:
+        """发送请求体，每块发送后以文件内容的已发送字节数回调 on_sent"""
+        yield self._head
+        sent = 0
+        total = len(self._content)
+        while sent < total:
+            block = self._content[sent:sent + self._block_size]
+            yield block
+            sent += len(block)
+            if self._on_sent:
+                self._on_sent(sent)
+        yield self._tail
+
+
 # ============ 主类 ============
 
 class NotionFileManager:
@@ -249,6 +661,9 @@ class NotionFileManager:
         
         # 文件列表缓存
         self._cache: Dict[str, dict] = {}
+        
+        # 单文件下载复用的下载引擎 (懒加载，复用连接)
+        self._downloader = None
     
     def _create_session(self) -> requests.Session:
         """创建带重试的HTTP会话"""
@@ -277,38 +692,58 @@ class NotionFileManager:
     def _api_request(self, method: str, endpoint: str,
                      data: Optional[Dict] = None, files: Optional[Dict] = None,
                      params: Optional[Dict] = None,
-                     retry_count: int = 0) -> Tuple[bool, Any]:
-        """统一的API请求方法"""
+                     retry_count: int = 0,
+                     on_sent: Optional[Callable[[int], None]] = None) -> Tuple[bool, Any]:
+        """
+        统一的API请求方法
+        
+        上传文件时可传入 on_sent，请求体改为 MultipartBody 流式发送并回调文件内容的已发送字节数
+        """
         url = f"{self.base_url}/{endpoint}"
         request_id = f"{method}:{endpoint}:{retry_count}"
+        debug = logger.isEnabledFor(logging.DEBUG)
         
         # 记录请求开始
-        logger.debug(f"[{request_id}] 开始请求: {url}")
-        if data and not files:
-            # 记录请求数据（排除敏感信息）
-            safe_data = {k: v for k, v in data.items() if k not in ['file', 'content']}
-            logger.debug(f"[{request_id}] 请求数据: {safe_data}")
-        if files:
-            file_info = {k: f"<{type(v).__name__}, {len(v[1]) if isinstance(v, tuple) else 'unknown'} bytes>" 
-                        for k, v in files.items()}
-            logger.debug(f"[{request_id}] 上传文件: {file_info}")
+        if debug:
+            logger.debug(f"[{request_id}] 开始请求: {url}")
+            if data and not files:
+                # 记录请求数据（排除敏感信息）
+                safe_data = {k: v for k, v in data.items() if k not in ['file', 'content']}
+                logger.debug(f"[{request_id}] 请求数据: {safe_data}")
+            if files:
+                file_info = {k: f"<{type(v).__name__}, {len(v[1]) if isinstance(v, tuple) else 'unknown'} bytes>" 
+                            for k, v in files.items()}
+                logger.debug(f"[{request_id}] 上传文件: {file_info}")
         
+        traced = telemetry_enabled()
         start_time = time.time()
         
         try:
-            if files:
+            if files and on_sent:
+                with stage("multipart"):
+                    body = MultipartBody(files, data, on_sent)
+                headers = self._get_headers(content_type=body.content_type)
+                with stage("http"):
+                    resp = self.session.request(method, url, headers=headers, 
+                                               data=body, timeout=300)
+            elif files:
                 headers = self._get_headers(content_type=None)
-                resp = self.session.request(method, url, headers=headers, 
-                                           files=files, data=data, timeout=300)
+                with stage("http"):
+                    resp = self.session.request(method, url, headers=headers, 
+                                               files=files, data=data, timeout=300)
             else:
                 headers = self._get_headers()
-                resp = self.session.request(method, url, headers=headers, 
-                                           json=data, params=params, timeout=60)
+                with stage("http"):
+                    resp = self.session.request(method, url, headers=headers, 
+                                               json=data, params=params, timeout=60)
             
             elapsed = time.time() - start_time
+            if traced:
+                self._record_response(method, endpoint, resp, start_time, elapsed, retry_count)
             
             if resp.status_code in [200, 201]:
-                logger.debug(f"[{request_id}] ✓ 成功 (HTTP {resp.status_code}, {elapsed:.2f}s)")
+                if debug:
+                    logger.debug(f"[{request_id}] ✓ 成功 (HTTP {resp.status_code}, {elapsed:.2f}s)")
                 return True, resp.json()
             
             error_data = {}
@@ -324,15 +759,16 @@ class NotionFileManager:
             logger.warning(f"[{request_id}] ✗ 失败 (HTTP {resp.status_code}, {elapsed:.2f}s)")
             logger.warning(f"[{request_id}] 错误代码: {error_code}")
             logger.warning(f"[{request_id}] 错误信息: {error_msg}")
-            logger.debug(f"[{request_id}] 响应头: {dict(resp.headers)}")
+            if debug:
+                logger.debug(f"[{request_id}] 响应头: {dict(resp.headers)}")
             
             # 可重试的错误
             if resp.status_code in [429, 500, 502, 503, 504]:
                 if retry_count < 10:  # API级别限制10次重试
                     delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** retry_count), MAX_RETRY_DELAY)
                     logger.info(f"[{request_id}] 可重试错误，{delay}秒后进行第{retry_count + 1}次重试")
-                    time.sleep(delay)
-                    return self._api_request(method, endpoint, data, files, params, retry_count + 1)
+                    retry_sleep(delay)
+                    return self._api_request(method, endpoint, data, files, params, retry_count + 1, on_sent)
                 else:
                     logger.error(f"[{request_id}] 已达最大重试次数(10次)，放弃请求")
             
@@ -340,30 +776,53 @@ class NotionFileManager:
             
         except requests.exceptions.Timeout as e:
             elapsed = time.time() - start_time
+            if traced:
+                record_request(endpoint, method, type(e).__name__, start_time, elapsed, retry=retry_count)
             logger.warning(f"[{request_id}] ✗ 请求超时 ({elapsed:.2f}s): {e}")
             
             if retry_count < 10:
                 delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** retry_count), MAX_RETRY_DELAY)
                 logger.info(f"[{request_id}] 超时重试，{delay}秒后进行第{retry_count + 1}次重试")
-                time.sleep(delay)
-                return self._api_request(method, endpoint, data, files, params, retry_count + 1)
+                retry_sleep(delay)
+                return self._api_request(method, endpoint, data, files, params, retry_count + 1, on_sent)
             
             logger.error(f"[{request_id}] 超时达最大重试次数，放弃请求")
             return False, "请求超时"
             
         except requests.exceptions.RequestException as e:
             elapsed = time.time() - start_time
+            if traced:
+                record_request(endpoint, method, type(e).__name__, start_time, elapsed, retry=retry_count)
             logger.warning(f"[{request_id}] ✗ 网络错误 ({elapsed:.2f}s): {type(e).__name__}: {e}")
             
             if retry_count < 10:
                 delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** retry_count), MAX_RETRY_DELAY)
                 logger.info(f"[{request_id}] 网络错误重试，{delay}秒后进行第{retry_count + 1}次重试")
-                time.sleep(delay)
-                return self._api_request(method, endpoint, data, files, params, retry_count + 1)
+                retry_sleep(delay)
+                return self._api_request(method, endpoint, data, files, params, retry_count + 1, on_sent)
             
             logger.error(f"[{request_id}] 网络错误达最大重试次数，放弃请求")
             return False, f"网络错误: {e}"
     
+    @staticmethod
+    def _record_response(method: str, endpoint: str, resp: requests.Response,
+                         start_time: float, elapsed: float, retry_count: int):
+        """把一次 HTTP 响应写入请求追踪和指标 (仅在开启了任一项时调用)"""
+        body = resp.request.body
+        upload_id = ""
+        if endpoint == "file_uploads" and resp.status_code in [200, 201]:
+            # 创建上传会话时上传ID只在响应里
+            try:
+                upload_id = resp.json().get('id', "")
+            except ValueError:
+                pass
+        # 连接池 (urllib3 Retry) 内部重试过的响应，不会经过这里
+        retries = getattr(resp.raw, 'retries', None)
+        retried = [h.status or type(h.error).__name__ for h in retries.history] if retries else []
+        record_request(endpoint, method, resp.status_code, start_time, elapsed,
+                       sent=len(body) if body is not None else 0, received=len(resp.content),
+                       retry=retry_count, upload_id=upload_id, retried=retried)
+    
     # ============ 页面管理 ============
     
     def set_page(self, page_id: str):
@@ -393,6 +852,26 @@ class NotionFileManager:
         age = time.time() - self._cache[self.current_page_id]['timestamp']
         return age < CACHE_EXPIRY
     
+    def get_index(self, force_refresh: bool = False) -> FileIndex:
+        """获取当前页面文件列表的本地索引 (随缓存一起失效)"""
+        listing = self.file_list(force_refresh)
+        entry = self._cache[self.current_page_id]
+        index = entry.get('index')
+        if index is None or index.listing is not listing or len(index) != len(listing):
+            start = time.time()
+            index = FileIndex(listing)
+            entry['index'] = index
+            logger.debug(f"建立文件索引: {len(listing)} 个文件, 耗时 {(time.time() - start) * 1000:.1f}ms")
+        return index
+    
+    def search_files(self, query: str = "", mode: str = "substring", **filters) -> List[int]:
+        """
+        在缓存的文件列表中查询，不访问API (缓存过期时才会重新获取列表)
+        
+        参数见 FileIndex.search，返回 file_list() 中的行号列表
+        """
+        return self.get_index().search(query, mode, **filters)
+    
     def clear_cache(self, page_id: Optional[str] = None):
         if page_id:
             self._cache.pop(page_id, None)
@@ -401,40 +880,169 @@ class NotionFileManager:
     
     # ============ 文件列表 ============
     
-    def file_list(self, force_refresh: bool = False) -> List[list]:
-        """获取当前页面的文件列表"""
+    def file_list(self, force_refresh: bool = False) -> FileListing:
+        """
+        获取当前页面的文件列表
+        
+        返回的 FileListing 与缓存共享同一实例，调用方不应修改。
+        """
         if not self.current_page_id:
             raise ValueError("请先调用 set_page() 设置页面ID")
         
         if not force_refresh and self._is_cache_valid():
-            return self._cache[self.current_page_id]['data'].copy()
+            return self._cache[self.current_page_id]['data']
+        
+        return self._load_files()
+    
+    def _load_files(self, page_edited: Optional[str] = None) -> FileListing:
+        """
+        完整获取当前页面的文件列表并写入缓存
         
+        page_edited 为获取前读取的页面编辑时间，作为增量刷新的快照；
+        普通的 file_list 不传，省掉一次 pages 请求，由首次 refresh_files 补上。
+        """
         logger.info("正在获取文件列表...")
-        blocks = self._get_file_blocks(self.current_page_id)
+        fetch_time = time.time()
+        load_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        result = FileListing(load_time)
+        state: Dict[str, Any] = {}
+        for info in self._stream_files(self.current_page_id, load_time, state):
+            result.append(info)
+        
+        self._cache[self.current_page_id] = {
+            'data': result,
+            'timestamp': fetch_time,
+            # 增量刷新所需的快照信息
+            'complete': bool(state.get('complete')),
+            'page_edited': page_edited if state.get('complete') else None,
+            'last_child_id': state.get('last_child_id'),
+            'snapshot_time': fetch_time,
+        }
+        logger.info(f"获取到 {len(result)} 个文件")
+        return result
+    
+    def refresh_files(self) -> FileListing:
+        """
+        增量刷新当前页面的文件列表
+        
+        比较页面的 last_edited_time 与缓存快照：未修改时直接沿用缓存；
+        修改时以快照中最后一个子block为 start_cursor 只获取其后新增的block并合并到缓存。
+        新增block无法解释页面的修改 (删除、编辑、移动等) 或缓存已过期时回退为完整获取。
+        编辑时间只精确到分钟，页面的修改与快照落在同一分钟时同分钟内的删除无法与追加区分，也回退为完整获取。
+        file_list 获取的缓存没有页面编辑时间，首次刷新时补上：页面最后一次修改早于获取列表时沿用缓存。
+        """
+        if not self.current_page_id:
+            raise ValueError("请先调用 set_page() 设置页面ID")
         
-        result = []
+        page_id = self.current_page_id
+        entry = self._cache.get(page_id)
+        check_time = time.time()
+        page_edited = self._get_page_edited_time(page_id)
+        if not page_edited:
+            return self._load_files()
+        if not self._is_cache_valid() or not entry.get('complete') or not entry.get('last_child_id'):
+            return self._load_files(page_edited)
+        
+        # Notion 的编辑时间精确到分钟，快照与修改在同一分钟内时无法仅凭时间判断
+        snapshot_edited = entry['page_edited'] or page_edited
+        if page_edited == snapshot_edited and \
+                entry['snapshot_time'] >= _parse_notion_time(snapshot_edited) + 60:
+            entry['page_edited'] = page_edited
+            logger.info("页面未修改，沿用缓存的文件列表")
+            return entry['data']
+        if not entry['page_edited']:
+            logger.info("缓存没有页面编辑时间且页面在获取列表后有修改，回退为完整获取")
+            return self._load_files(page_edited)
+        
+        # 快照之后同一分钟内的删除+追加与单纯追加的编辑时间相同，无法判断
+        if int(_parse_notion_time(page_edited) // 60) == int(entry['snapshot_time'] // 60):
+            logger.info("页面修改与缓存快照在同一分钟内，回退为完整获取")
+            return self._load_files(page_edited)
+        
+        anchor = entry['last_child_id']
+        listing: FileListing = entry['data']
+        state: Dict[str, Any] = {}
+        new_files: List[FileInfo] = []
         load_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         
-        for block in blocks:
+        for info in self._stream_files(page_id, load_time, state, start_cursor=anchor):
+            if info.block_id != anchor:
+                new_files.append(info)
+        
+        if not state.get('complete') or state.get('anchor_edited', '') > snapshot_edited:
+            logger.info("增量获取失败或快照末尾的block已变化，回退为完整获取")
+            return self._load_files(page_edited)
+        
+        # 页面有修改时必须存在新增的子block，且最新的编辑时间与页面一致，否则块数对不上
+        if not state.get('new_children') or state.get('max_edited', '') < page_edited:
+            logger.info("新增block无法解释页面的修改，回退为完整获取")
+            return self._load_files(page_edited)
+        
+        for info in new_files:
+            listing.append(info)
+        
+        entry['page_edited'] = page_edited
+        entry['last_child_id'] = state.get('last_child_id') or anchor
+        entry['snapshot_time'] = check_time
+        logger.info(f"增量刷新完成: 新增 {len(new_files)} 个文件, 共 {len(listing)} 个")
+        return listing
+    
+    def _get_page_edited_time(self, page_id: str) -> Optional[str]:
+        """获取页面的 last_edited_time"""
+        success, result = self._api_request("GET", f"pages/{page_id}")
+        if not success:
+            return None
+        return result.get('last_edited_time')
+    
+    def iter_files(self, force_refresh: bool = False) -> Iterator[FileInfo]:
+        """
+        流式获取当前页面的文件列表
+        
+        每收到一页API结果就立即产出其中的文件，无需等待所有分页完成，
+        下载流程可以边获取边下载。缓存有效时直接从缓存产出；
+        流式获取的结果不写入缓存，内存占用不随页面文件数增长。
+        """
+        if not self.current_page_id:
+            raise ValueError("请先调用 set_page() 设置页面ID")
+        
+        if not force_refresh and self._is_cache_valid():
+            return iter(self._cache[self.current_page_id]['data'])
+        
+        return self._stream_files(self.current_page_id)
+    
+    def _stream_files(self, page_id: str, load_time: str = None,
+                      state: Optional[Dict[str, Any]] = None,
+                      start_cursor: Optional[str] = None) -> Iterator[FileInfo]:
+        """逐个解析并产出页面下的文件"""
+        load_time = load_time or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        
+        for block in self._iter_file_blocks(page_id, state, start_cursor):
             try:
                 info = self._parse_file_block(block, load_time)
                 if info:
-                    result.append(info.to_list())
+                    yield info
             except Exception as e:
                 logger.error(f"解析block失败: {e}")
-        
-        self._cache[self.current_page_id] = {
-            'data': result,
-            'timestamp': time.time()
-        }
-        logger.info(f"获取到 {len(result)} 个文件")
-        return result
     
     def _get_file_blocks(self, block_id: str) -> list:
         """获取页面下的所有文件block"""
+        return list(self._iter_file_blocks(block_id))
+    
+    def _iter_file_blocks(self, block_id: str, state: Optional[Dict[str, Any]] = None,
+                          start_cursor: Optional[str] = None) -> Iterator[dict]:
+        """
+        按API分页逐个产出页面下的文件block
+        
+        state 不为空时记录遍历信息: complete (是否遍历到末尾)、last_child_id (最后一个子block)、
+        max_edited (所有子block中最新的编辑时间)、anchor_edited (start_cursor 对应block的编辑时间)、
+        new_children (start_cursor 之外的子block数)
+        """
         FILE_TYPES = ["file", "image", "video", "pdf", "audio"]
-        blocks = []
-        cursor = None
+        cursor = start_cursor
+        if state is None:
+            state = {}
+        state['complete'] = False
+        state['new_children'] = 0
         
         while True:
             params = {"page_size": 50}
@@ -446,15 +1054,23 @@ class NotionFileManager:
                 break
             
             for block in data.get("results", []):
+                edited = block.get("last_edited_time", "")
+                if start_cursor and block.get("id") == start_cursor:
+                    state['anchor_edited'] = edited
+                else:
+                    state['new_children'] += 1
+                    if edited > state.get('max_edited', ''):
+                        state['max_edited'] = edited
+                state['last_child_id'] = block.get("id")
+                
                 if block.get("type") in FILE_TYPES:
-                    blocks.append(block)
+                    yield block
             
             if not data.get("has_more"):
+                state['complete'] = True
                 break
             cursor = data.get("next_cursor")
             time.sleep(0.3)
-        
-        return blocks
     
     def _parse_file_block(self, block: dict, load_time: str) -> Optional[FileInfo]:
         """解析文件block"""
@@ -481,7 +1097,30 @@ class NotionFileManager:
         if not name:
             name = "未命名文件"
         
-        return FileInfo(name=name, url=url, load_time=load_time)
+        caption = "".join(
+            item.get("plain_text") or item.get("text", {}).get("content", "")
+            for item in content.get("caption", [])
+        )
+        
+        return FileInfo(
+            name=name,
+            url=url,
+            load_time=load_time,
+            block_id=block.get("id", ""),
+            block_type=block_type,
+            last_edited=block.get("last_edited_time", ""),
+            is_spoofed=detect_spoofed(name, caption, block_type),
+        )
+    
+    def get_file_url(self, block_id: str) -> Optional[str]:
+        """按block ID重新获取文件的最新下载地址 (签名URL过期后使用)"""
+        success, block = self._api_request("GET", f"blocks/{block_id}")
+        if not success:
+            logger.error(f"获取文件地址失败 {block_id}: {block}")
+            return None
+        
+        info = self._parse_file_block(block, "")
+        return info.url if info and info.url else None
     
     # ============ 上传会话管理 (新增) ============
     
@@ -527,6 +1166,7 @@ class NotionFileManager:
     
     # ============ 文件上传 (改进核心逻辑) ============
     
+    @profiled("upload_file")
     def upload_file(self, filepath: str, target_page_id: str = None,
                     progress_callback: Optional[Callable[[UploadProgress], None]] = None) -> bool:
         """
@@ -553,16 +1193,17 @@ class NotionFileManager:
         if file_info.size > MAX_FILE_SIZE:
             raise ValueError(f"文件过大: {file_info.size / 1024 / 1024 / 1024:.1f}GB > 5GB")
         
-        # 记录上传开始
-        logger.info("=" * 60)
-        logger.info(f"开始上传文件: {file_info.original_name}")
-        logger.info(f"  文件路径: {filepath}")
-        logger.info(f"  文件大小: {file_info.size / 1024 / 1024:.2f} MB ({file_info.size} bytes)")
-        logger.info(f"  MIME类型: {file_info.mime_type}")
-        logger.info(f"  上传名称: {file_info.upload_name}")
-        logger.info(f"  目标页面: {page_id}")
-        logger.info(f"  是否伪装: {file_info.is_spoofed}")
-        logger.info(f"  上传模式: {'小文件直传' if file_info.size <= SMALL_FILE_LIMIT else '分片上传'}")
+        # 记录上传开始 (INFO 一行摘要，详情在 DEBUG 级别)
+        upload_mode = '小文件直传' if file_info.size <= SMALL_FILE_LIMIT else '分片上传'
+        logger.info(f"开始上传文件: {file_info.original_name} "
+                    f"({file_info.size / 1024 / 1024:.2f} MB, {upload_mode})")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"  文件路径: {filepath}")
+            logger.debug(f"  文件大小: {file_info.size} bytes")
+            logger.debug(f"  MIME类型: {file_info.mime_type}")
+            logger.debug(f"  上传名称: {file_info.upload_name}")
+            logger.debug(f"  目标页面: {page_id}")
+            logger.debug(f"  是否伪装: {file_info.is_spoofed}")
         
         upload_start_time = time.time()
         
@@ -599,14 +1240,10 @@ class NotionFileManager:
             
             if result:
                 speed = file_info.size / elapsed / 1024 / 1024 if elapsed > 0 else 0
-                logger.info(f"✓ 上传成功: {file_info.original_name}")
-                logger.info(f"  耗时: {elapsed:.2f}秒")
-                logger.info(f"  平均速度: {speed:.2f} MB/s")
+                logger.info(f"✓ 上传成功: {file_info.original_name} "
+                            f"(耗时: {elapsed:.2f}秒, 平均速度: {speed:.2f} MB/s)")
             else:
-                logger.error(f"✗ 上传失败: {file_info.original_name}")
-                logger.error(f"  耗时: {elapsed:.2f}秒")
-            
-            logger.info("=" * 60)
+                logger.error(f"✗ 上传失败: {file_info.original_name} (耗时: {elapsed:.2f}秒)")
             return result
                 
         except Exception as e:
@@ -615,7 +1252,6 @@ class NotionFileManager:
             logger.error(f"  异常类型: {type(e).__name__}")
             logger.error(f"  异常信息: {e}")
             logger.error(f"  耗时: {elapsed:.2f}秒")
-            logger.info("=" * 60)
             report(UploadStatus.FAILED, message=str(e))
             return False
     
@@ -640,11 +1276,13 @@ class NotionFileManager:
         
         # 2. 读取并上传文件内容
         logger.debug(f"[小文件上传] 读取文件内容...")
-        with open(file_info.path, 'rb') as f:
+        with stage("disk_read"), open(file_info.path, 'rb') as f:
             file_content = f.read()
         
         logger.debug(f"[小文件上传] 文件内容大小: {len(file_content)} bytes")
-        report(UploadStatus.UPLOADING, file_info.size // 2, 1, 1)
+        
+        def on_sent(sent: int):
+            report(UploadStatus.UPLOADING, sent, 1, 1, retry_count)
         
         # 带无限重试的上传
         retry_count = 0
@@ -654,7 +1292,8 @@ class NotionFileManager:
             logger.debug(f"[小文件上传] 发送文件数据 (尝试 {retry_count + 1})...")
             # 必须指定正确的 MIME 类型，否则会报 content type mismatch 错误
             success, result = self._api_request("POST", f"file_uploads/{upload_id}/send",
-                files={'file': (file_info.upload_name, file_content, file_info.mime_type)}
+                files={'file': (file_info.upload_name, file_content, file_info.mime_type)},
+                on_sent=on_sent
             )
             if success:
                 elapsed = time.time() - upload_start
@@ -665,9 +1304,9 @@ class NotionFileManager:
             delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** retry_count), MAX_RETRY_DELAY)
             logger.warning(f"[小文件上传] 上传失败，{delay}秒后重试 (第{retry_count}次)")
             logger.warning(f"[小文件上传] 失败原因: {result}")
-            report(UploadStatus.RETRYING, file_info.size // 2, 1, 1, retry_count, 
+            report(UploadStatus.RETRYING, 0, 0, 1, retry_count, 
                    f"上传失败，重试中...")
-            time.sleep(delay)
+            retry_sleep(delay)
         
         report(UploadStatus.UPLOADING, file_info.size, 1, 1)
         
@@ -697,6 +1336,7 @@ class NotionFileManager:
         """
         num_parts = math.ceil(file_info.size / PART_SIZE)
         uploaded_parts: Set[int] = set()  # 已成功上传的分片
+        uploaded_bytes = 0                 # 已成功上传分片的实际字节数 (末片可能不足 PART_SIZE)
         
         logger.debug(f"[大文件上传] 开始: {file_info.original_name}")
         logger.debug(f"[大文件上传] 总分片数: {num_parts} (每片 {PART_SIZE/1024/1024:.1f}MB)")
@@ -729,7 +1369,7 @@ class NotionFileManager:
                 logger.warning(f"[大文件上传] 失败原因: {result}")
                 report(UploadStatus.RETRYING, 0, 0, num_parts, retry_count, 
                        "创建上传会话失败，重试中...")
-                time.sleep(delay)
+                retry_sleep(delay)
         
         # 2. 分片上传 - 支持断点续传
         upload_round = 0
@@ -740,7 +1380,7 @@ class NotionFileManager:
                 logger.debug(f"[大文件上传] === 上传轮次 {upload_round} ===")
                 
                 # 检查会话状态
-                report(UploadStatus.CHECKING, len(uploaded_parts) * PART_SIZE, 
+                report(UploadStatus.CHECKING, uploaded_bytes, 
                        len(uploaded_parts), num_parts, 0, "检查上传状态...")
                 
                 logger.debug(f"[大文件上传] 检查会话状态: {upload_id}")
@@ -750,7 +1390,7 @@ class NotionFileManager:
                     # 会话失效，需要重新创建
                     logger.warning(f"[大文件上传] 会话已失效 (状态: {session_info.status if session_info else 'None'})")
                     logger.warning(f"[大文件上传] 已上传分片: {len(uploaded_parts)}/{num_parts}")
-                    report(UploadStatus.RECOVERING, len(uploaded_parts) * PART_SIZE, 
+                    report(UploadStatus.RECOVERING, uploaded_bytes, 
                            len(uploaded_parts), num_parts, 0, "会话失效，重新创建...")
                     
                     retry_count = 0
@@ -768,13 +1408,16 @@ class NotionFileManager:
                         if success:
                             upload_id = result['id']
                             logger.info(f"[大文件上传] 重新创建会话成功: {upload_id}")
+                            metrics = get_metrics()
+                            if metrics:
+                                metrics.inc("notion_session_recoveries_total")
                             # 注意：重新创建会话后，之前的上传记录会丢失
                             # 但我们本地保存了uploaded_parts，可以跳过这些分片
                         else:
                             retry_count += 1
                             delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** retry_count), MAX_RETRY_DELAY)
                             logger.warning(f"[大文件上传] 重新创建会话失败，{delay}秒后重试: {result}")
-                            time.sleep(delay)
+                            retry_sleep(delay)
                     
                     # 重置会话信息
                     session_info = UploadSession(
@@ -803,44 +1446,57 @@ class NotionFileManager:
                 # 上传每个未完成的分片
                 for part_num in sorted(pending_parts):
                     # 读取分片数据
-                    f.seek((part_num - 1) * PART_SIZE)
-                    chunk = f.read(PART_SIZE)
+                    with stage("disk_read"):
+                        f.seek((part_num - 1) * PART_SIZE)
+                        chunk = f.read(PART_SIZE)
                     chunk_size = len(chunk)
                     
-                    logger.debug(f"[大文件上传] 准备分片 {part_num}/{num_parts}, 大小: {chunk_size} bytes")
+                    # 分片日志采样: 首尾和每 LOG_PART_SAMPLE 个分片记在 INFO，其余只在 DEBUG 级别记录
+                    part_level = logging.INFO if sample_part(part_num, num_parts) else logging.DEBUG
+                    part_logged = logger.isEnabledFor(part_level)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"[大文件上传] 准备分片 {part_num}/{num_parts}, 大小: {chunk_size} bytes")
                     
                     # 无限重试直到分片上传成功
                     part_retry_count = 0
                     part_uploaded = False
                     part_start_time = time.time()
                     
+                    def on_sent(sent: int):
+                        report(UploadStatus.UPLOADING, uploaded_bytes + sent,
+                               part_num, num_parts, part_retry_count)
+                    
                     while not part_uploaded:
                         if part_retry_count > 0:
                             delay = min(INITIAL_RETRY_DELAY * (RETRY_BACKOFF_FACTOR ** part_retry_count), MAX_RETRY_DELAY)
                             logger.info(f"[大文件上传] 分片 {part_num}/{num_parts} 重试 (第{part_retry_count}次，等待{delay}秒)")
-                            report(UploadStatus.RETRYING, len(uploaded_parts) * PART_SIZE, 
+                            report(UploadStatus.RETRYING, uploaded_bytes, 
                                    part_num, num_parts, part_retry_count,
                                    f"分片 {part_num} 上传失败，重试中...")
-                            time.sleep(delay)
+                            retry_sleep(delay)
                         else:
-                            logger.info(f"[大文件上传] 上传分片 {part_num}/{num_parts} ({chunk_size / 1024 / 1024:.1f}MB)")
-                            report(UploadStatus.UPLOADING, len(uploaded_parts) * PART_SIZE, 
+                            if part_logged:
+                                logger.log(part_level, f"[大文件上传] 上传分片 {part_num}/{num_parts} ({chunk_size / 1024 / 1024:.1f}MB)")
+                            report(UploadStatus.UPLOADING, uploaded_bytes, 
                                    part_num, num_parts, 0)
                         
                         # 尝试上传分片 - 必须指定正确的 MIME 类型
                         success, result = self._api_request("POST", f"file_uploads/{upload_id}/send",
                             files={'file': (file_info.upload_name, chunk, file_info.mime_type)},
-                            data={'part_number': str(part_num)}
+                            data={'part_number': str(part_num)},
+                            on_sent=on_sent
                         )
                         
                         if success:
                             part_uploaded = True
                             uploaded_parts.add(part_num)
-                            part_elapsed = time.time() - part_start_time
-                            part_speed = chunk_size / part_elapsed / 1024 / 1024 if part_elapsed > 0 else 0
-                            logger.info(f"[大文件上传] ✓ 分片 {part_num}/{num_parts} 上传成功 "
-                                       f"(耗时: {part_elapsed:.2f}s, 速度: {part_speed:.2f}MB/s)")
-                            report(UploadStatus.UPLOADING, len(uploaded_parts) * PART_SIZE, 
+                            uploaded_bytes += chunk_size
+                            if part_logged:
+                                part_elapsed = time.time() - part_start_time
+                                part_speed = chunk_size / part_elapsed / 1024 / 1024 if part_elapsed > 0 else 0
+                                logger.log(part_level, f"[大文件上传] ✓ 分片 {part_num}/{num_parts} 上传成功 "
+                                           f"(耗时: {part_elapsed:.2f}s, 速度: {part_speed:.2f}MB/s)")
+                            report(UploadStatus.UPLOADING, uploaded_bytes, 
                                    part_num, num_parts, 0)
                         else:
                             part_retry_count += 1
@@ -872,7 +1528,7 @@ class NotionFileManager:
             logger.warning(f"[大文件上传] 失败原因: {result}")
             report(UploadStatus.RETRYING, file_info.size, num_parts, num_parts, retry_count,
                    "完成上传失败，重试中...")
-            time.sleep(delay)
+            retry_sleep(delay)
         
         # 4. 附加到页面
         logger.debug(f"[大文件上传] 附加文件到页面: {page_id}")
@@ -892,7 +1548,7 @@ class NotionFileManager:
             logger.warning(f"[大文件上传] 附加文件失败 (第{retry_count}次)，{delay}秒后重试")
             report(UploadStatus.RETRYING, file_info.size, num_parts, num_parts, retry_count,
                    "附加文件失败，重试中...")
-            time.sleep(delay)
+            retry_sleep(delay)
         
         report(UploadStatus.COMPLETED, file_info.size, num_parts, num_parts)
         logger.debug(f"[大文件上传] 完成: {file_info.original_name}")
@@ -965,80 +1621,20 @@ class NotionFileManager:
     
     # ============ 文件下载 ============
     
-    def download_file(self, file_info: list, save_path: str,
+    def download_file(self, file_info: FileInfo, save_path: str,
                       progress_callback: Optional[Callable] = None) -> bool:
-        """下载单个文件"""
-        name, url, _ = file_info
-        os.makedirs(save_path, exist_ok=True)
-        save_file = os.path.join(save_path, name)
-        
-        try:
-            resp = requests.get(url, stream=True, timeout=30)
-            resp.raise_for_status()
-            
-            total = int(resp.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(save_file, 'wb') as f:
-                for chunk in resp.iter_content(chunk_size=1024 * 1024):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if progress_callback:
-                            progress_callback(name, downloaded, total, "下载中")
-            
-            if progress_callback:
-                progress_callback(name, total, total, "完成")
-            
-            logger.info(f"下载完成: {name}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"下载失败 {name}: {e}")
-            return False
-
-
-# ============ IDM导出器 ============
+        """
+        下载单个文件 (兼容旧的 [name, url, load_time] 列表)
 
-class IDMExporter:
-    """IDM任务文件导出器"""
-    
-    @staticmethod
-    def export_tasks(file_urls: List[Tuple[str, str]], save_path: str) -> Optional[str]:
-        """导出IDM .ef2任务文件"""
-        if not file_urls:
-            return None
-        
-        os.makedirs(save_path, exist_ok=True)
-        ef2_file = os.path.join(save_path, "idm_tasks.ef2")
-        
-        try:
-            with open(ef2_file, 'w', encoding='utf-8') as f:
-                for filename, url in file_urls:
-                    referer = IDMExporter._extract_referer(url)
-                    f.write("<\n")
-                    f.write(f"{url}\n")
-                    f.write(f"referer: {referer}\n")
-                    f.write("User-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0\n")
-                    f.write(">\n")
-            
-            logger.info(f"IDM任务文件已导出: {ef2_file}")
-            return ef2_file
-            
-        except Exception as e:
-            logger.error(f"导出IDM任务失败: {e}")
-            return None
-    
-    @staticmethod
-    def _extract_referer(url: str) -> str:
-        from urllib.parse import urlparse
-        try:
-            if "github" in url:
-                return "https://github.com"
-            parsed = urlparse(url)
-            return f"{parsed.scheme}://{parsed.netloc}" if parsed.netloc else ""
-        except:
-            return ""
+        progress_callback 沿用旧的 (name, downloaded, total, status) 签名
+        """
+        if self._downloader is None:
+            from downloader import DownloadEngine
+            self._downloader = DownloadEngine(self, num_workers=1)
+        callback = None
+        if progress_callback:
+            callback = lambda name, downloaded, total, status, _key: progress_callback(name, downloaded, total, status)
+        return self._downloader.download_file(file_info, save_path, callback)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,378 @@
+# Notion-Files-Management - 性能分析模块
+# 按需开启的阶段计时、采样/cProfile 分析和 tracemalloc 内存快照
+# Copyright (C) 2025-2026 Ruibin_Ningh & Zyx_2012
+# License: GPL v3
+#
+# 用法:
+#   NOTION_PROFILE=1 python main.py                   # 阶段计时 + 采样分析
+#   NOTION_PROFILE=cprofile,mem python main.py        # 阶段计时 + cProfile + 内存快照
+#
+# 结果写在日志文件旁边 (logs/upload_*.profileN.txt 等)，上传结束时打印摘要。
+
+import os
+import sys
+import time
+import atexit
+import logging
+import pstats
+import cProfile
+import functools
+import threading
+import tracemalloc
+from io import StringIO
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List, Dict, Tuple, Optional, Callable, Any
+
+# 与 notion.py 共用同一个日志记录器 (不直接导入 notion，避免循环导入)
+logger = logging.getLogger("notion_upload")
+
+
+# ============ 配置常量 ============
+
+PROFILE_ENV = "NOTION_PROFILE"   # 逗号分隔: 1/sample (采样分析), cprofile, mem (tracemalloc)
+SAMPLE_INTERVAL = 0.005          # 5ms - 采样间隔
+SAMPLE_MAX_DEPTH = 64            # 每个调用栈最多记录的帧数
+TRACEMALLOC_FRAMES = 1           # tracemalloc 记录的调用帧数
+REPORT_TOP = 20                  # 报告中列出的函数/内存位置数
+SUMMARY_TOP = 5                  # 摘要中列出的函数数
+
+_NULL_STAGE = nullcontext()
+
+
+def parse_modes(value: str) -> Dict[str, bool]:
+    """解析 NOTION_PROFILE，返回 {"sample", "cprofile", "mem"} 的开关；全部关闭时返回空字典"""
+    tokens = {t.strip().lower() for t in value.split(',') if t.strip()}
+    tokens -= {"0", "false", "off", "no"}
+    if not tokens:
+        return {}
+    modes = {
+        "sample": bool(tokens & {"1", "true", "on", "yes", "all", "sample"}),
+        "cprofile": bool(tokens & {"all", "cprofile"}),
+        "mem": bool(tokens & {"all", "mem", "memory"}),
+    }
+    # 只写了 mem 之类时仍然只做阶段计时；cProfile 和采样同时开启没有意义，以 cProfile 为准
+    if modes["cprofile"]:
+        modes["sample"] = False
+    return modes
+
+
+# ============ 调用栈采样 ============
+
+class StackSampler:
+    """
+    采样分析器
+
+    后台线程每隔 SAMPLE_INTERVAL 读取一次 sys._current_frames()，只记录正处于分析阶段内的线程，
+    按调用栈计数。不依赖解释器的 profile 钩子，多个工作线程同时运行时也能使用，开销与调用次数无关。
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.threads: Dict[int, int] = {}     # 线程ID -> 阶段嵌套深度
+        self.stacks: Counter = Counter()      # (帧, ...) 从外到内 -> 样本数
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ProfileSampler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止采样并等待采样线程退出，之后读取 stacks / samples 不会与采样竞争"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            active = [tid for tid, depth in list(self.threads.items()) if depth > 0 and tid != own]
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for tid in active:
+                frame = frames.get(tid)
+                stack = []
+                while frame is not None and len(stack) < SAMPLE_MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    self.stacks[tuple(stack)] += 1
+                    self.samples += 1
+
+    def top(self, limit: int) -> List[Tuple[str, int, int]]:
+        """按包含样本数排序的函数列表: [(函数, 包含样本数, 自身样本数), ...]"""
+        inclusive: Counter = Counter()
+        own: Counter = Counter()
+        for stack, count in list(self.stacks.items()):
+            for name in set(stack):
+                inclusive[name] += count
+            own[stack[-1]] += count
+        return [(name, count, own[name]) for name, count in inclusive.most_common(limit)]
+
+    def collapsed(self) -> str:
+        """折叠调用栈格式 (flamegraph.pl / speedscope 可直接读取)"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# ============ 分析器 ============
+
+class Profiler:
+    """
+    阶段计时 + 可选的 CPU 分析和内存快照 (线程安全)
+
+    stage() 记录每个阶段的次数、总耗时和最长耗时；cpu=True 的阶段 (upload_file、download_file、
+    _render 等入口) 同时进入 CPU 分析。mark() 在阶段边界记录 tracemalloc 快照。
+    """
+
+    def __init__(self, modes: Dict[str, bool]):
+        self.modes = modes
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stages: Dict[str, List[float]] = {}      # 阶段 -> [次数, 总耗时, 最长耗时]
+        self.marks: List[Tuple[str, float, int, int, Any]] = []   # (标签, 时间, 当前内存, 峰值, 快照)
+        self.profiles: List[cProfile.Profile] = []
+        self.sampler: Optional[StackSampler] = None
+        self.cprofile_skipped = 0
+        self.reports = 0
+        self.started = time.time()
+
+        if modes.get("sample"):
+            self.sampler = StackSampler()
+            self.sampler.start()
+        if modes.get("mem") and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    @contextmanager
+    def stage(self, name: str, cpu: bool = False):
+        # CPU 分析只在最外层的 cpu 阶段开启/关闭 (例如 upload_file 内部再调用带分析的函数)
+        local = self._local
+        depth = getattr(local, "cpu_depth", 0)
+        outermost = cpu and depth == 0
+        if cpu:
+            local.cpu_depth = depth + 1
+        if outermost:
+            self._cpu_enter(local)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if cpu:
+                local.cpu_depth = depth
+            if outermost:
+                self._cpu_exit(local)
+            with self._lock:
+                entry = self.stages.get(name)
+                if entry is None:
+                    self.stages[name] = [1, elapsed, elapsed]
+                else:
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    if elapsed > entry[2]:
+                        entry[2] = elapsed
+
+    def _cpu_enter(self, local):
+        if self.sampler is not None:
+            tid = threading.get_ident()
+            self.sampler.threads[tid] = self.sampler.threads.get(tid, 0) + 1
+        elif self.modes.get("cprofile"):
+            profile = getattr(local, "profile", None)
+            if profile is None:
+                profile = local.profile = cProfile.Profile()
+                with self._lock:
+                    self.profiles.append(profile)
+            try:
+                profile.enable()
+                local.profiling = True
+            except ValueError:
+                # Python 3.12+ 同一时刻只允许一个 profile 工具，其他线程的调用只计时
+                local.profiling = False
+                with self._lock:
+                    self.cprofile_skipped += 1
+
+    def _cpu_exit(self, local):
+        if self.sampler is not None:
+            tid = threading.get_ident()
+            self.sampler.threads[tid] -= 1
+        elif getattr(local, "profiling", False):
+            local.profile.disable()
+            local.profiling = False
+
+    def mark(self, label: str):
+        """阶段边界: 记录时间和内存 (开启 mem 时保存 tracemalloc 快照)"""
+        current = peak = 0
+        snapshot = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+        with self._lock:
+            self.marks.append((label, time.time(), current, peak, snapshot))
+
+    def has_data(self) -> bool:
+        return bool(self.stages or self.marks)
+
+    def report_paths(self, sampled: bool, profiled: bool) -> Dict[str, str]:
+        """本次报告的输出文件 (放在日志文件旁边，按报告序号区分)"""
+        log_path = getattr(logger, "log_file_path", None)
+        if log_path:
+            base = os.path.splitext(log_path)[0]
+        else:
+            base = os.path.join(os.getcwd(), "logs", f"profile_{datetime.fromtimestamp(self.started):%Y%m%d_%H%M%S}")
+        base = f"{base}.profile{self.reports + 1}"
+        paths = {"report": base + ".txt"}
+        if sampled:
+            paths["stacks"] = base + ".stacks"
+        if profiled:
+            paths["pstats"] = base + ".prof"
+        return paths
+
+    def write_report(self) -> str:
+        """
+        写出分析结果并清空已统计的数据 (每次上传各自一份报告)
+
+        Returns:
+            打印用的简短摘要 (没有数据时为空字符串)
+        """
+        with self._lock:
+            if not self.has_data():
+                return ""
+            stages, self.stages = self.stages, {}
+            marks, self.marks = self.marks, []
+            profiles, self.profiles = self.profiles, []
+            skipped, self.cprofile_skipped = self.cprofile_skipped, 0
+        sampler = self.sampler
+        if sampler is not None:
+            self.sampler = StackSampler(sampler.interval)
+            self.sampler.threads = sampler.threads
+            self.sampler.start()
+            sampler.stop()
+        self._local = threading.local()     # 已交出的 cProfile 对象不再使用
+
+        paths = self.report_paths(sampler is not None, bool(profiles))
+        self.reports += 1
+        os.makedirs(os.path.dirname(paths["report"]), exist_ok=True)
+
+        full, summary = [], []
+        stage_lines = self._format_stages(stages)
+        full += ["[阶段耗时]"] + stage_lines
+        summary += stage_lines
+
+        if sampler is not None:
+            with open(paths["stacks"], 'w', encoding='utf-8') as f:
+                f.write(sampler.collapsed())
+            total = max(sampler.samples, 1)
+            full.append("")
+            full.append(f"[采样分析] {sampler.samples} 个样本 (间隔 {sampler.interval * 1000:.0f}ms)，"
+                        f"按包含时间排序: 包含% 自身% 函数")
+            top = sampler.top(REPORT_TOP)
+            for name, inclusive, own in top:
+                full.append(f"  {inclusive / total:6.1%} {own / total:6.1%}  {name}")
+            hot = sorted(top, key=lambda item: item[2], reverse=True)[:SUMMARY_TOP]
+            summary.append("热点函数 (自身时间): " + ", ".join(
+                f"{name.split(' ', 1)[0]} {own / total:.0%}" for name, _, own in hot if own))
+
+        if profiles:
+            stats = None
+            for profile in profiles:
+                profile.create_stats()
+                if not profile.stats:
+                    continue
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            if stats is not None:
+                stats.dump_stats(paths["pstats"])
+                buffer = StringIO()
+                stats.stream = buffer
+                stats.sort_stats("cumulative").print_stats(REPORT_TOP)
+                full += ["", "[cProfile] 按累计时间排序", buffer.getvalue().rstrip()]
+                if skipped:
+                    full.append(f"  {skipped} 次调用因其他线程正在分析而只计时")
+                hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:SUMMARY_TOP]
+                summary.append("热点函数 (自身时间): " + ", ".join(
+                    f"{func[2]} {tt:.2f}s" for func, (cc, nc, tt, ct, callers) in hot))
+
+        if any(m[4] is not None for m in marks):
+            full += ["", "[内存]"]
+            prev = None
+            for label, ts, current, peak, snapshot in marks:
+                full.append(f"  {datetime.fromtimestamp(ts):%H:%M:%S} {label}: "
+                            f"当前 {current / 1024 / 1024:.1f}MB, 峰值 {peak / 1024 / 1024:.1f}MB")
+                if snapshot is not None and prev is not None:
+                    for stat in snapshot.compare_to(prev, "lineno")[:REPORT_TOP]:
+                        full.append(f"      {stat}")
+                prev = snapshot if snapshot is not None else prev
+            peak = max(m[3] for m in marks)
+            if peak:
+                summary.append(f"内存峰值: {peak / 1024 / 1024:.1f}MB")
+
+        with open(paths["report"], 'w', encoding='utf-8') as f:
+            f.write("\n".join(full) + "\n")
+        summary.append("分析结果: " + ", ".join(paths.values()))
+        logger.info(f"性能分析结果已写入: {paths['report']}")
+        return "\n".join(summary)
+
+    @staticmethod
+    def _format_stages(stages: Dict[str, List[float]]) -> List[str]:
+        lines = [f"  {'阶段':<14} {'次数':>7} {'总计':>9} {'平均':>9} {'最长':>9}"]
+        for name, (count, total, longest) in sorted(stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"  {name:<16} {count:>7} {total:>8.2f}s {total / count * 1000:>7.1f}ms "
+                         f"{longest * 1000:>7.1f}ms")
+        return lines
+
+
+_profiler: Optional[Profiler] = None
+_profiler_checked = False
+_init_lock = threading.Lock()
+
+
+def get_profiler() -> Optional[Profiler]:
+    """返回全局分析器；未设置 NOTION_PROFILE 时返回 None (只在第一次调用时读取环境变量)"""
+    global _profiler, _profiler_checked
+    if _profiler_checked:
+        return _profiler
+    with _init_lock:
+        if not _profiler_checked:
+            modes = parse_modes(os.getenv(PROFILE_ENV, ""))
+            if modes:
+                _profiler = Profiler(modes)
+                atexit.register(_write_pending_report)
+            _profiler_checked = True
+    return _profiler
+
+
+def _write_pending_report():
+    """退出时写出尚未报告的数据 (例如只做了下载，没有经过上传UI)"""
+    if _profiler is not None and _profiler.has_data():
+        try:
+            _profiler.write_report()
+        except Exception as e:
+            logger.warning(f"写入性能分析结果失败: {e}")
+
+
+def stage(name: str):
+    """阶段计时上下文 (未开启分析时为空操作)"""
+    profiler = get_profiler()
+    return profiler.stage(name) if profiler is not None else _NULL_STAGE
+
+
+def profiled(name: str) -> Callable:
+    """装饰器: 把函数作为一个分析阶段，同时纳入 CPU 分析 (未开启时直接调用)"""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = get_profiler()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(name, cpu=True):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
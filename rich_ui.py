@@ -5,16 +5,22 @@
 
 import os
 import sys
+import math
 import time
 import threading
 import subprocess
 import tempfile
 import json
+from array import array
+from collections import deque
+from bisect import bisect_left, insort
 from enum import Enum
-from dataclasses import dataclass, field
 from typing import Dict, Optional, List, Callable
 from threading import Lock
 
+from telemetry import get_metrics
+from profiling import profiled
+
 
 # ============ 状态枚举 ============
 
@@ -45,24 +51,182 @@ STATUS_DISPLAY = {
     TaskStatus.RECOVERING: ("🔧", "恢复中"),
 }
 
+# 计入总进度的进行中状态
+INFLIGHT_STATUSES = frozenset((TaskStatus.UPLOADING, TaskStatus.COMPLETING,
+                               TaskStatus.ATTACHING, TaskStatus.RETRYING))
+# 已结束的状态 (不在任务详情中显示)
+FINISHED_STATUSES = frozenset((TaskStatus.COMPLETED, TaskStatus.FAILED))
+
+# 速率估计
+RATE_WINDOW = 5.0          # 滑动窗口长度 (秒)
+RATE_SMOOTHING = 1.0       # EWMA 时间常数 (秒)
+
+# 无界面模式 (stdout 不是终端时): 以 NDJSON 输出进度
+PROGRESS_FILE_ENV = "NOTION_PROGRESS_FILE"          # 输出到文件 (追加)
+PROGRESS_FD_ENV = "NOTION_PROGRESS_FD"              # 输出到已打开的文件描述符
+PROGRESS_INTERVAL_ENV = "NOTION_PROGRESS_INTERVAL"  # 输出间隔 (秒)
+DEFAULT_PROGRESS_INTERVAL = 5.0
+
 
-# ============ 数据类 ============
+# ============ 任务表 ============
+
+# 状态码: 按 TaskStatus 的定义顺序编号 (PENDING 为 0)
+# notion.UploadStatus 与 TaskStatus 的取值相同，统一按 value 转换，无需逐个映射
+STATUS_BY_CODE: List[TaskStatus] = list(TaskStatus)
+STATUS_CODES: Dict[str, int] = {status.value: code for code, status in enumerate(STATUS_BY_CODE)}
+CODE_PENDING = STATUS_CODES[TaskStatus.PENDING.value]
+CODE_RETRYING = STATUS_CODES[TaskStatus.RETRYING.value]
+CODE_COMPLETED = STATUS_CODES[TaskStatus.COMPLETED.value]
+CODE_FAILED = STATUS_CODES[TaskStatus.FAILED.value]
+INFLIGHT_CODES = frozenset(STATUS_CODES[s.value] for s in INFLIGHT_STATUSES)
+FINISHED_CODES = frozenset(STATUS_CODES[s.value] for s in FINISHED_STATUSES)
+
+
+class TaskTable:
+    """
+    上传任务表 - 上传器和各UI共享的唯一任务状态
+    
+    按列存储在 array 中，每个任务固定占用 49 字节，另加 UTF-8 编码的路径；
+    文件名按路径即时解析，页面ID去重后按下标引用，失败原因稀疏存放。
+    每一行只由正在处理该任务的工作线程写入 (单写者，无需加锁)，
+    状态切换通过 UI 的事件通道通知，UI 线程据此维护视图。
+    """
+    
+    def __init__(self):
+        self.size = array('q')          # 文件大小
+        self.sent = array('q')          # 当前已发送字节 (分片重试时会回退)
+        self.credited = array('q')      # 已计入统计的字节 (高水位)
+        self.status = array('B')        # 状态码
+        self.thread = array('h')        # 工作线程ID，-1 表示未分配
+        self.retries = array('H')       # 重试次数
+        self.part = array('I')          # 当前分片
+        self.parts = array('I')         # 总分片数
+        self.page = array('I')          # 目标页面 (pages 中的下标)
+        self.pages: List[str] = []
+        self.errors: Dict[int, str] = {}
+        self.total_size = 0
+        
+        self._page_index: Dict[str, int] = {}
+        self._path_data = bytearray()
+        self._path_end = array('Q')
+        self._claim_lock = Lock()
+        self._claimed = 0
+    
+    def __len__(self) -> int:
+        return len(self.size)
+    
+    def add(self, path: str, size: int, page_id: str) -> int:
+        """添加任务，返回任务ID (即行号)"""
+        task_id = len(self.size)
+        self._path_data += path.encode('utf-8', 'surrogateescape')
+        self._path_end.append(len(self._path_data))
+        self.size.append(size)
+        self.sent.append(0)
+        self.credited.append(0)
+        self.status.append(CODE_PENDING)
+        self.thread.append(-1)
+        self.retries.append(0)
+        self.part.append(0)
+        self.parts.append(0)
+        self.page.append(self._page_code(page_id))
+        self.total_size += size
+        return task_id
+    
+    def _page_code(self, page_id: str) -> int:
+        code = self._page_index.get(page_id)
+        if code is None:
+            code = self._page_index[page_id] = len(self.pages)
+            self.pages.append(page_id)
+        return code
+    
+    def set_page(self, task_id: int, page_id: str):
+        self.page[task_id] = self._page_code(page_id)
+    
+    def page_id(self, task_id: int) -> str:
+        return self.pages[self.page[task_id]]
+    
+    def path(self, task_id: int) -> str:
+        start = self._path_end[task_id - 1] if task_id else 0
+        return self._path_data[start:self._path_end[task_id]].decode('utf-8', 'surrogateescape')
+    
+    def name(self, task_id: int) -> str:
+        return os.path.basename(self.path(task_id))
+    
+    def progress(self, task_id: int) -> float:
+        size = self.size[task_id]
+        if size <= 0:
+            return 1.0 if self.status[task_id] == CODE_COMPLETED else 0.0
+        return min(self.sent[task_id] / size, 1.0)
+    
+    def claim(self) -> Optional[int]:
+        """工作线程按顺序领取下一个任务，全部领取完时返回 None"""
+        with self._claim_lock:
+            if self._claimed >= len(self.size):
+                return None
+            task_id = self._claimed
+            self._claimed += 1
+            return task_id
+    
+    def ids_with_status(self, code: int) -> List[int]:
+        """查找处于某状态的全部任务 (在字节串上查找，不逐行解释)"""
+        data = self.status.tobytes()
+        target = bytes((code,))
+        ids = []
+        i = data.find(target)
+        while i >= 0:
+            ids.append(i)
+            i = data.find(target, i + 1)
+        return ids
+    
+    def nbytes(self) -> int:
+        """任务表占用的字节数 (列数组 + 路径数据)"""
+        columns = (self.size, self.sent, self.credited, self.status, self.thread,
+                   self.retries, self.part, self.parts, self.page, self._path_end)
+        return sum(col.itemsize * len(col) for col in columns) + len(self._path_data)
 
-@dataclass
-class TaskInfo:
-    """任务信息"""
-    task_id: int
-    filename: str
-    filesize: int
-    target_page_id: str
-    status: TaskStatus = TaskStatus.PENDING
-    progress: float = 0.0
-    part_current: int = 0
-    part_total: int = 0
-    retry_count: int = 0
-    thread_id: Optional[int] = None
-    error_message: str = ""
-    start_time: Optional[float] = None
+
+# ============ 速率估计 ============
+
+class RateMeter:
+    """
+    滑动窗口 + EWMA 速率估计
+    
+    add() 累计字节数，sample() 在渲染时调用: 先取最近 RATE_WINDOW 秒的平均速率，
+    再按时间常数 RATE_SMOOTHING 做指数平滑。停顿时速率会在一个窗口内衰减到0，
+    不会像"总字节/总耗时"那样被早期的慢启动或长时间停顿拖累整个运行过程。
+    """
+    
+    def __init__(self, window: float = RATE_WINDOW, smoothing: float = RATE_SMOOTHING):
+        self.window = window
+        self.smoothing = smoothing
+        self.total = 0
+        self.rate = 0.0
+        self._samples: deque = deque()     # (时间, 累计字节)
+    
+    def add(self, nbytes: int):
+        self.total += nbytes
+    
+    def sample(self, now: Optional[float] = None) -> float:
+        """记录一个采样点并返回平滑后的速率 (字节/秒)"""
+        now = time.time() if now is None else now
+        samples = self._samples
+        if not samples:
+            samples.append((now, self.total))
+            return self.rate
+        
+        last_time = samples[-1][0]
+        if now <= last_time:
+            return self.rate
+        samples.append((now, self.total))
+        # 保留窗口起点之前的最后一个采样，作为窗口基准
+        while len(samples) > 2 and samples[1][0] <= now - self.window:
+            samples.popleft()
+        
+        base_time, base_total = samples[0]
+        windowed = (self.total - base_total) / (now - base_time)
+        weight = 1 - math.exp(-(now - last_time) / self.smoothing)
+        self.rate += (windowed - self.rate) * weight
+        return self.rate
 
 
 # ============ 工具函数 ============
@@ -296,12 +460,14 @@ class ModernUploadUI:
     - 日志：缓存收集，可选输出到文件或新终端
     """
     
-    def __init__(self, total_files: int, total_size: int, num_threads: int):
-        self.total_files = total_files
-        self.total_size = total_size
+    headless = False
+    
+    def __init__(self, table: TaskTable, num_threads: int):
+        self.table = table
+        self.total_files = len(table)
+        self.total_size = table.total_size
         self.num_threads = num_threads
         
-        self.tasks: Dict[int, TaskInfo] = {}
         self.lock = Lock()
         
         # 兼容性: 提供console属性 (用于RichUploadUI适配器)
@@ -317,15 +483,35 @@ class ModernUploadUI:
         self.failed_count = 0
         self.uploaded_bytes = 0
         
+        # 增量维护的视图: 进行中的任务ID (有序，数量不超过线程数)；
+        # 等待中的任务按行号顺序被领取，只需维护第一个等待中任务的游标和已离开等待的数量
+        self._active_ids: List[int] = []
+        self._pending_cursor = 0
+        self._left_pending = 0
+        
+        # 速率: 总体 + 每个进行中的任务
+        self.rate = RateMeter()
+        self._task_rates: Dict[int, RateMeter] = {}
+        
+        # 工作线程 → UI线程 的事件通道: (task_id, 旧状态码, 新状态码, 新增上传字节)
+        # deque 的 append/popleft 是原子操作，工作线程投递事件无需加锁，由渲染时统一处理
+        self._events: deque = deque()
+        
         # 时间追踪
         self.start_time: Optional[float] = None
         
+        # 指标端点 (NOTION_METRICS_PORT): 状态切换计数，以及抓取时计算的队列深度和活跃线程数
+        self.metrics = get_metrics()
+        self._set_gauges(True)
+        
         # 日志
         self.logger = SimpleLogger()
         
         # 显示状态
         self._running = False
         self._last_render = 0
+        self._last_lines: List[str] = []     # 上一帧内容，用于差量重绘
+        self._last_size = (0, 0)
         
         # 终端尺寸
         self._term_width = 80
@@ -341,55 +527,113 @@ class ModernUploadUI:
         except:
             pass
     
-    def add_task(self, task_id: int, filename: str, filesize: int, target_page_id: str):
-        """添加任务"""
-        with self.lock:
-            self.tasks[task_id] = TaskInfo(
-                task_id=task_id,
-                filename=filename,
-                filesize=filesize,
-                target_page_id=target_page_id,
-            )
-        self.logger.write(f"添加任务 #{task_id}: {filename} ({format_size(filesize)})")
+    def post(self, task_id: int, status, uploaded_bytes: int = 0):
+        """
+        上报任务状态和新增上传字节 (工作线程热路径，不加锁)
+        
+        只能由正在处理该任务的线程调用: 状态码直接写入任务表，视图和日志在下次渲染时更新。
+        status 可以是 TaskStatus 或 notion.UploadStatus。
+        """
+        statuses = self.table.status
+        new = STATUS_CODES[status.value]
+        old = statuses[task_id]
+        if new != old:
+            statuses[task_id] = new
+        elif new != CODE_RETRYING and not uploaded_bytes:
+            return
+        self._events.append((task_id, old, new, uploaded_bytes))
+    
+    def _drain_events(self):
+        """
+        处理积压的事件 (调用方持有锁)
+        
+        进度字段由工作线程直接写在任务表中，事件只有状态切换和字节增量，逐个处理即可
+        """
+        events = self._events
+        for _ in range(len(events)):
+            task_id, old, new, uploaded_bytes = events.popleft()
+            if uploaded_bytes:
+                self.uploaded_bytes += uploaded_bytes
+                self.rate.add(uploaded_bytes)
+                meter = self._task_rates.get(task_id)
+                if meter is None:
+                    meter = self._task_rates[task_id] = RateMeter()
+                meter.add(uploaded_bytes)
+            if old != new:
+                self._move(task_id, old, new)
+            if new == CODE_RETRYING:
+                self.logger.write(f"[#{task_id}] 重试 #{self.table.retries[task_id]}")
     
-    def update_task(self, task_id: int, **kwargs):
-        """更新任务状态"""
+    def _move(self, task_id: int, old: int, new: int):
+        """任务状态切换: 更新视图并记录日志 (调用方持有锁)"""
+        if old == CODE_PENDING:
+            self._left_pending += 1
+        elif old not in FINISHED_CODES:
+            ids = self._active_ids
+            i = bisect_left(ids, task_id)
+            if i < len(ids) and ids[i] == task_id:
+                del ids[i]
+        
+        if new == CODE_PENDING:
+            self._left_pending -= 1
+            self._pending_cursor = min(self._pending_cursor, task_id)
+        elif new in FINISHED_CODES:
+            self._task_rates.pop(task_id, None)
+        else:
+            insort(self._active_ids, task_id)
+        
+        status = STATUS_BY_CODE[new]
+        if self.metrics is not None:
+            self.metrics.inc("notion_task_transitions_total", status=status.value)
+        icon, name = STATUS_DISPLAY.get(status, ("?", "未知"))
+        self.logger.write(f"[#{task_id}] {self.table.name(task_id)[:20]}... → {icon} {name}")
+    
+    def _set_gauges(self, enable: bool):
+        """注册/注销本次上传的仪表指标"""
+        if self.metrics is None:
+            return
+        self.metrics.gauge("notion_upload_queue_depth", self._gauge_queue_depth if enable else None)
+        self.metrics.gauge("notion_upload_active_workers", self._gauge_active_workers if enable else None)
+    
+    def _gauge_queue_depth(self) -> int:
         with self.lock:
-            if task_id not in self.tasks:
-                return
-            
-            task = self.tasks[task_id]
-            old_status = task.status
-            
-            for key, value in kwargs.items():
-                if hasattr(task, key):
-                    setattr(task, key, value)
-            
-            # 记录状态变化
-            if 'status' in kwargs and kwargs['status'] != old_status:
-                icon, name = STATUS_DISPLAY.get(kwargs['status'], ("?", "未知"))
-                self.logger.write(f"[#{task_id}] {task.filename[:20]}... → {icon} {name}")
-            
-            # 记录重试
-            if kwargs.get('retry_count', 0) > 0:
-                self.logger.write(f"[#{task_id}] 重试 #{kwargs['retry_count']}")
+            self._drain_events()
+            return self.pending_count
     
-    def add_uploaded_bytes(self, bytes_count: int):
-        """增加已上传字节数"""
+    def _gauge_active_workers(self) -> int:
         with self.lock:
-            self.uploaded_bytes += bytes_count
+            self._drain_events()
+            return len(self._active_ids)
+    
+    def _pending_view(self, limit: int) -> List[int]:
+        """前 limit 个等待中的任务 (游标之前的任务都已被领取，调用方持有锁)"""
+        statuses = self.table.status
+        n = len(statuses)
+        cursor = self._pending_cursor
+        while cursor < n and statuses[cursor] != CODE_PENDING:
+            cursor += 1
+        self._pending_cursor = cursor
+        
+        ids = []
+        while cursor < n and len(ids) < limit:
+            if statuses[cursor] == CODE_PENDING:
+                ids.append(cursor)
+            cursor += 1
+        return ids
+    
+    @property
+    def pending_count(self) -> int:
+        return self.total_files - self._left_pending
     
     def mark_completed(self, task_id: int, success: bool):
         """标记任务完成"""
         with self.lock:
             if success:
                 self.completed_count += 1
-                if task_id in self.tasks:
-                    self.logger.write(f"✅ 完成: {self.tasks[task_id].filename}")
+                self.logger.write(f"✅ 完成: {self.table.name(task_id)}")
             else:
                 self.failed_count += 1
-                if task_id in self.tasks:
-                    self.logger.write(f"❌ 失败: {self.tasks[task_id].filename}")
+                self.logger.write(f"❌ 失败: {self.table.name(task_id)}")
     
     def start(self):
         """启动UI"""
@@ -397,6 +641,7 @@ class ModernUploadUI:
         self.start_time = time.time()
         hide_cursor()
         clear_screen()
+        self._last_lines = []
         self.logger.write("上传开始")
     
     def refresh(self):
@@ -410,30 +655,27 @@ class ModernUploadUI:
             return
         self._last_render = now
         
-        self._update_terminal_size()
         self._render()
     
+    @profiled("render")
     def _render(self):
-        """渲染UI"""
+        """渲染UI (锁内只读取增量维护的统计，终端输出在锁外进行)"""
+        self._update_terminal_size()
         with self.lock:
-            self._update_terminal_size()
+            self._drain_events()
             lines = []
             
-            # 计算总进度
+            # 计算总进度 (进行中的任务不超过线程数)
+            table = self.table
             if self.total_files > 0:
-                total_progress = (self.completed_count + self.failed_count) / self.total_files
-                for t in self.tasks.values():
-                    if t.status in (TaskStatus.UPLOADING, TaskStatus.COMPLETING, 
-                                   TaskStatus.ATTACHING, TaskStatus.RETRYING):
-                        total_progress += t.progress / self.total_files
+                inflight = sum(table.progress(i) for i in self._active_ids
+                               if table.status[i] in INFLIGHT_CODES)
+                total_progress = (self.completed_count + self.failed_count + inflight) / self.total_files
                 total_progress = min(total_progress, 1.0)
             else:
                 total_progress = 0
             
-            elapsed = time.time() - self.start_time if self.start_time else 0
-            speed = self.uploaded_bytes / elapsed if elapsed > 0 else 0
-            remaining = self.total_size - self.uploaded_bytes
-            eta = remaining / speed if speed > 0 and remaining > 0 else -1
+            speed, eta = self._sample_rates()
             
             # 标题和进度条
             lines.append("")
@@ -454,69 +696,106 @@ class ModernUploadUI:
             lines.append("")
             lines.append("  -- 任务详情 --")
             
-            # 收集任务：正在上传的 + 等待中的
-            active = [t for t in self.tasks.values() 
-                     if t.status not in (TaskStatus.PENDING, TaskStatus.COMPLETED, TaskStatus.FAILED)]
-            pending = [t for t in self.tasks.values() if t.status == TaskStatus.PENDING]
-            
-            active.sort(key=lambda t: t.task_id)
-            pending.sort(key=lambda t: t.task_id)
-            
+            # 正在上传的 + 等待中的 (有序视图直接截取，无需扫描和排序)
             # 自适应终端高度：总高度 - 已用行数 - 底部留白
             max_tasks = max(self._term_height - len(lines) - 2, 3)
-            to_show = (active + pending)[:max_tasks]
+            to_show = self._active_ids[:max_tasks]
+            if len(to_show) < max_tasks:
+                to_show = to_show + self._pending_view(max_tasks - len(to_show))
             
-            for task in to_show:
-                lines.append(self._render_task_line(task))
+            for task_id in to_show:
+                lines.append(self._render_task_line(task_id))
             
             lines.append("")
-            
-            # 输出
-            move_cursor(1, 1)
-            print("\n".join(lines) + "\033[J", end="", flush=True)
+        
+        self._paint(lines)
+    
+    def _sample_rates(self):
+        """
+        采样总体和各任务的速率 (调用方持有锁)
+        
+        Returns:
+            (速率, ETA秒数)；ETA 基于最近的速率和队列中剩余的字节数，无法估计时为 -1
+        """
+        now = time.time()
+        speed = self.rate.sample(now)
+        for meter in self._task_rates.values():
+            meter.sample(now)
+        remaining = self.total_size - self.uploaded_bytes
+        eta = remaining / speed if speed > 1 and remaining > 0 else -1
+        return speed, eta
+    
+    def _paint(self, lines: List[str]):
+        """差量输出: 只重绘与上一帧不同的行，终端尺寸变化时整屏重绘"""
+        size = (self._term_width, self._term_height)
+        if size != self._last_size:
+            self._last_size = size
+            self._last_lines = []
+            out = ["\033[2J"]
+        else:
+            out = []
+        
+        last = self._last_lines
+        for row, line in enumerate(lines):
+            if row >= len(last) or last[row] != line:
+                out.append(f"\033[{row + 1};1H{line}\033[K")
+        if len(lines) < len(last):
+            out.append(f"\033[{len(lines) + 1};1H\033[J")
+        self._last_lines = lines
+        
+        if out:
+            sys.stdout.write("".join(out))
+            sys.stdout.flush()
     
-    def _render_task_line(self, task: TaskInfo) -> str:
-        """渲染单个任务行 - 简洁格式"""
-        icon, status_text = STATUS_DISPLAY.get(task.status, ("?", "未知"))
+    def _render_task_line(self, task_id: int) -> str:
+        """渲染单个任务行 - 简洁格式 (调用方持有锁)"""
+        table = self.table
+        status = STATUS_BY_CODE[table.status[task_id]]
+        icon, status_text = STATUS_DISPLAY.get(status, ("?", "未知"))
+        progress = table.progress(task_id)
         
         # 文件名（截断到20个显示宽度）
-        name = truncate_to_width(task.filename, 20)
+        name = truncate_to_width(table.name(task_id), 20)
         name = pad_to_width(name, 20)
         
         # 文件大小
-        size_str = format_size(task.filesize)
+        size_str = format_size(table.size[task_id])
         
         # 子进度条
         bar_width = 12
-        bar = make_bar(task.progress, bar_width)
+        bar = make_bar(progress, bar_width)
         
         # 状态详情
-        if task.status == TaskStatus.UPLOADING and task.part_total > 0:
-            detail = f"{task.part_current}/{task.part_total}"
-        elif task.status == TaskStatus.RETRYING:
-            detail = f"重试{task.retry_count}"
-        elif task.status == TaskStatus.COMPLETING:
+        if status == TaskStatus.UPLOADING and table.parts[task_id] > 0:
+            detail = f"{table.part[task_id]}/{table.parts[task_id]}"
+            meter = self._task_rates.get(task_id)
+            if meter is not None and meter.rate >= 1:
+                detail += f" {format_size(int(meter.rate))}/s"
+        elif status == TaskStatus.RETRYING:
+            detail = f"重试{table.retries[task_id]}"
+        elif status == TaskStatus.COMPLETING:
             detail = "合并"
-        elif task.status == TaskStatus.ATTACHING:
+        elif status == TaskStatus.ATTACHING:
             detail = "附加"
-        elif task.status == TaskStatus.CHECKING:
+        elif status == TaskStatus.CHECKING:
             detail = "检查"
-        elif task.status == TaskStatus.RECOVERING:
+        elif status == TaskStatus.RECOVERING:
             detail = "恢复"
-        elif task.status == TaskStatus.COMPLETED:
+        elif status == TaskStatus.COMPLETED:
             detail = "完成"
-        elif task.status == TaskStatus.FAILED:
+        elif status == TaskStatus.FAILED:
             detail = "失败"
-        elif task.status == TaskStatus.PENDING:
+        elif status == TaskStatus.PENDING:
             detail = "等待"
         else:
             detail = status_text[:4]
         
         # 线程ID
-        thread_str = f"T{task.thread_id}" if task.thread_id is not None else "--"
+        thread_id = table.thread[task_id]
+        thread_str = f"T{thread_id}" if thread_id >= 0 else "--"
         
         # 组装行: icon [T0] filename size [bar] pct% detail
-        line = f"  {icon} [{thread_str:>2}] {name} {size_str:>7} {bar} {task.progress*100:5.1f}% {detail}"
+        line = f"  {icon} [{thread_str:>2}] {name} {size_str:>7} {bar} {progress*100:5.1f}% {detail}"
         
         return line
     
@@ -525,6 +804,10 @@ class ModernUploadUI:
         self._running = False
         show_cursor()
         
+        with self.lock:
+            self._drain_events()
+        self._set_gauges(False)
+        
         # 最终渲染
         clear_screen()
         
@@ -543,17 +826,183 @@ class ModernUploadUI:
         if self.failed_count > 0:
             print("  ❌ 失败任务:")
             with self.lock:
-                for task in self.tasks.values():
-                    if task.status == TaskStatus.FAILED:
-                        print(f"     - {task.filename}")
-                        if task.error_message:
-                            print(f"       原因: {task.error_message}")
+                for task_id in self.table.ids_with_status(CODE_FAILED):
+                    print(f"     - {self.table.name(task_id)}")
+                    error = self.table.errors.get(task_id)
+                    if error:
+                        print(f"       原因: {error}")
             print("")
         
         print(f"  [提示] 共记录 {len(self.logger.logs)} 条日志")
         print("")
 
 
+# ============ 无界面进度输出 ============
+
+class HeadlessProgressUI(ModernUploadUI):
+    """
+    无界面进度输出 - stdout 不是终端时 (cron、systemd 等) 使用
+    
+    与 ModernUploadUI 共用事件通道和统计，不输出任何控制字符，
+    而是每隔 interval 秒写一行 JSON (NDJSON)，包含总体进度、速率、ETA 和进行中的任务。
+    输出位置由环境变量 NOTION_PROGRESS_FD / NOTION_PROGRESS_FILE 指定，默认 stdout。
+    """
+    
+    headless = True
+    
+    def __init__(self, table: TaskTable, num_threads: int,
+                 stream=None, interval: float = DEFAULT_PROGRESS_INTERVAL):
+        super().__init__(table, num_threads)
+        self.interval = interval
+        self._owns_stream = stream is None
+        self._stream = stream if stream is not None else open_progress_stream()
+        self._stream_lock = Lock()
+    
+    def _update_terminal_size(self):
+        pass
+    
+    def start(self):
+        """启动输出"""
+        self._running = True
+        self.start_time = time.time()
+        self.logger.write("上传开始")
+        self._emit({
+            "event": "start",
+            "time": round(self.start_time, 3),
+            "total_files": self.total_files,
+            "total_bytes": self.total_size,
+            "threads": self.num_threads,
+        })
+    
+    def refresh(self):
+        """按 interval 输出一条进度记录"""
+        if not self._running:
+            return
+        now = time.time()
+        if now - self._last_render < self.interval:
+            return
+        self._last_render = now
+        self._render()
+    
+    @profiled("render")
+    def _render(self):
+        with self.lock:
+            self._drain_events()
+            record = self._snapshot()
+        self._emit(record)
+    
+    def _snapshot(self) -> dict:
+        """当前进度记录 (调用方持有锁)"""
+        speed, eta = self._sample_rates()
+        now = time.time()
+        table = self.table
+        tasks = []
+        for task_id in self._active_ids:
+            meter = self._task_rates.get(task_id)
+            thread_id = table.thread[task_id]
+            tasks.append({
+                "id": task_id,
+                "name": table.name(task_id),
+                "status": STATUS_BY_CODE[table.status[task_id]].value,
+                "bytes": table.sent[task_id],
+                "size": table.size[task_id],
+                "rate": round(meter.rate) if meter else 0,
+                "part": table.part[task_id],
+                "parts": table.parts[task_id],
+                "retries": table.retries[task_id],
+                "thread": thread_id if thread_id >= 0 else None,
+            })
+        return {
+            "event": "progress",
+            "time": round(now, 3),
+            "elapsed": round(now - self.start_time, 3) if self.start_time else 0,
+            "completed": self.completed_count,
+            "failed": self.failed_count,
+            "pending": self.pending_count,
+            "total_files": self.total_files,
+            "bytes": self.uploaded_bytes,
+            "total_bytes": self.total_size,
+            "rate": round(speed),
+            "eta": round(eta, 1) if eta >= 0 else None,
+            "tasks": tasks,
+        }
+    
+    def _emit(self, record: dict):
+        """写出一行 JSON (输出失败不影响上传)"""
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._stream_lock:
+            try:
+                self._stream.write(line)
+                self._stream.flush()
+            except (OSError, ValueError):
+                pass
+    
+    def stop(self):
+        """输出最终进度和汇总记录"""
+        self._running = False
+        with self.lock:
+            self._drain_events()
+            record = self._snapshot()
+            failed = [{"id": i, "name": self.table.name(i), "error": self.table.errors.get(i, "")}
+                      for i in self.table.ids_with_status(CODE_FAILED)]
+        self._set_gauges(False)
+        self._emit(record)
+        
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        self._emit({
+            "event": "done",
+            "time": round(time.time(), 3),
+            "elapsed": round(elapsed, 3),
+            "completed": self.completed_count,
+            "failed": self.failed_count,
+            "bytes": self.uploaded_bytes,
+            "avg_rate": round(self.uploaded_bytes / elapsed) if elapsed > 0 else 0,
+            "failed_tasks": failed,
+        })
+        if self._owns_stream and self._stream not in (sys.stdout, sys.stderr):
+            try:
+                self._stream.close()
+            except OSError:
+                pass
+
+
+def open_progress_stream():
+    """按环境变量打开 NDJSON 进度输出 (NOTION_PROGRESS_FD 优先，其次 NOTION_PROGRESS_FILE，默认 stdout)"""
+    fd = os.getenv(PROGRESS_FD_ENV)
+    if fd:
+        try:
+            return os.fdopen(int(fd), 'w', encoding='utf-8', buffering=1, closefd=False)
+        except (ValueError, OSError) as e:
+            print(f"[警告] 无法使用 {PROGRESS_FD_ENV}={fd}: {e}", file=sys.stderr)
+    path = os.getenv(PROGRESS_FILE_ENV)
+    if path:
+        try:
+            return open(path, 'a', encoding='utf-8', buffering=1)
+        except OSError as e:
+            print(f"[警告] 无法打开 {PROGRESS_FILE_ENV}={path}: {e}", file=sys.stderr)
+    return sys.stdout
+
+
+def progress_interval() -> float:
+    """NDJSON 进度输出间隔 (NOTION_PROGRESS_INTERVAL，秒)"""
+    try:
+        return max(float(os.getenv(PROGRESS_INTERVAL_ENV, DEFAULT_PROGRESS_INTERVAL)), 0.1)
+    except ValueError:
+        return DEFAULT_PROGRESS_INTERVAL
+
+
+def is_headless() -> bool:
+    """stdout 不是终端时上传使用 NDJSON 无界面输出 (其他提示信息应写到 stderr)"""
+    return not sys.stdout.isatty()
+
+
+def create_upload_ui(table: TaskTable, num_threads: int) -> ModernUploadUI:
+    """stdout 是终端时使用交互式UI，否则使用 NDJSON 无界面输出"""
+    if not is_headless():
+        return ModernUploadUI(table, num_threads)
+    return HeadlessProgressUI(table, num_threads, interval=progress_interval())
+
+
 # ============ 测试代码 ============
 
 if __name__ == "__main__":
@@ -565,9 +1014,6 @@ if __name__ == "__main__":
     print()
     time.sleep(2)
     
-    # 测试UI
-    ui = ModernUploadUI(total_files=5, total_size=100 * 1024 * 1024, num_threads=2)
-    
     # 添加测试任务
     test_files = [
         ("document.pdf", 10 * 1024 * 1024),
@@ -577,40 +1023,46 @@ if __name__ == "__main__":
         ("music.mp3", 10 * 1024 * 1024),
     ]
     
-    for i, (name, size) in enumerate(test_files):
-        ui.add_task(i, name, size, "page-123")
+    table = TaskTable()
+    for name, size in test_files:
+        table.add(name, size, "page-123")
     
+    # 测试UI
+    ui = ModernUploadUI(table, num_threads=2)
     ui.start()
     
     try:
         # 模拟上传
         for i, (name, size) in enumerate(test_files):
-            ui.update_task(i, status=TaskStatus.UPLOADING, thread_id=i % 2)
+            table.thread[i] = i % 2
+            ui.post(i, TaskStatus.UPLOADING)
             
             # 模拟分片上传
             parts = max(size // (10 * 1024 * 1024), 1)
+            table.parts[i] = parts
             for part in range(1, parts + 1):
                 time.sleep(0.2)
-                progress = part / parts
-                ui.update_task(i, progress=progress, part_current=part, part_total=parts)
-                ui.add_uploaded_bytes(size // parts)
+                table.part[i] = part
+                table.sent[i] = size * part // parts
+                ui.post(i, TaskStatus.UPLOADING, size // parts)
                 ui.refresh()
             
             # 模拟完成阶段
-            ui.update_task(i, status=TaskStatus.COMPLETING, progress=1.0)
+            ui.post(i, TaskStatus.COMPLETING)
             ui.refresh()
             time.sleep(0.1)
             
-            ui.update_task(i, status=TaskStatus.ATTACHING)
+            ui.post(i, TaskStatus.ATTACHING)
             ui.refresh()
             time.sleep(0.1)
             
             # 随机成功或失败
             if random.random() > 0.2:
-                ui.update_task(i, status=TaskStatus.COMPLETED, progress=1.0)
+                ui.post(i, TaskStatus.COMPLETED)
                 ui.mark_completed(i, True)
             else:
-                ui.update_task(i, status=TaskStatus.FAILED, error_message="网络错误")
+                table.errors[i] = "网络错误"
+                ui.post(i, TaskStatus.FAILED)
                 ui.mark_completed(i, False)
             
             ui.refresh()
@@ -0,0 +1,461 @@
+# Notion-Files-Management - 请求遥测模块
+# 按需记录每个 HTTP 请求的结构化追踪 (JSON Lines)，提供分析命令和本地 Prometheus 指标端点
+# Copyright (C) 2025-2026 Ruibin_Ningh & Zyx_2012
+# License: GPL v3
+#
+# 用法:
+#   NOTION_TRACE_FILE=trace.jsonl python main.py      # 记录追踪
+#   python telemetry.py analyze trace.jsonl           # 分析一次运行
+#   NOTION_METRICS_PORT=9464 python main.py           # http://127.0.0.1:9464/metrics
+
+import os
+import re
+import sys
+import json
+import math
+import logging
+import atexit
+import argparse
+import threading
+import unicodedata
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Tuple, Optional, Iterable, Callable, Any
+
+# 与 notion.py 共用同一个日志记录器 (不直接导入 notion，避免循环导入)
+logger = logging.getLogger("notion_upload")
+
+
+# ============ 配置常量 ============
+
+TRACE_FILE_ENV = "NOTION_TRACE_FILE"  # 设置后把每个请求追加写入该文件
+TRACE_BUFFER_SIZE = 64 * 1024         # 64KB - 追踪文件写缓冲
+PERCENTILES = (50, 90, 99)
+
+METRICS_PORT_ENV = "NOTION_METRICS_PORT"  # 设置后在 127.0.0.1:<端口>/metrics 提供指标
+METRICS_HOST = "127.0.0.1"                 # 只监听本机
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 指标名 -> (类型, 说明)
+METRICS: Dict[str, Tuple[str, str]] = {
+    "notion_requests_total": ("counter", "API 请求数 (按端点类别、方法和状态)"),
+    "notion_request_duration_seconds": ("histogram", "API 请求耗时 (按端点类别)"),
+    "notion_sent_bytes_total": ("counter", "API 请求发送的字节数"),
+    "notion_received_bytes_total": ("counter", "API 响应接收的字节数"),
+    "notion_download_bytes_total": ("counter", "文件下载接收的字节数"),
+    "notion_parts_sent_total": ("counter", "成功发送的文件分片数"),
+    "notion_rate_limited_total": ("counter", "HTTP 429 响应数 (包括连接池内部重试掉的)"),
+    "notion_retries_total": ("counter", "重试次数 (layer=api 为应用层重试，layer=transport 为连接池重试)"),
+    "notion_session_recoveries_total": ("counter", "大文件上传会话失效后重新创建的次数"),
+    "notion_task_transitions_total": ("counter", "上传任务状态切换次数 (按新状态)"),
+    "notion_upload_queue_depth": ("gauge", "等待中的上传任务数"),
+    "notion_upload_active_workers": ("gauge", "正在处理任务的上传线程数"),
+}
+
+# 路径中的 ID 段 (Notion 的 UUID，带或不带连字符)
+_ID_SEGMENT = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+
+
+def split_endpoint(endpoint: str) -> Tuple[str, str]:
+    """
+    把 API 路径拆成 (端点类别, 上传ID)
+
+    ID 段替换为 {id}，例如 file_uploads/<id>/send -> file_uploads/{id}/send；
+    路径属于 file_uploads/<id> 时同时返回该上传ID，否则为空字符串。
+    """
+    parts = endpoint.split('?', 1)[0].strip('/').split('/')
+    upload_id = ""
+    for i, part in enumerate(parts):
+        if _ID_SEGMENT.match(part):
+            if i > 0 and parts[i - 1] == "file_uploads":
+                upload_id = part
+            parts[i] = "{id}"
+    return '/'.join(parts), upload_id
+
+
+# ============ 追踪记录 ============
+
+class RequestTracer:
+    """
+    请求追踪写入器 (线程安全)
+
+    每个 HTTP 调用 (包括每一次重试) 写一行 JSON:
+    ts, endpoint, method, sent, received, status, latency, retry, thread, upload_id, retried。
+    status 为 HTTP 状态码，网络异常时为异常类名；retried 为连接池 (urllib3 Retry)
+    在这次调用内部重试掉的响应状态列表，这些尝试不会单独出现在追踪里。
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=TRACE_BUFFER_SIZE)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, endpoint_class: str, method: str, status: Any, start: float, latency: float,
+               sent: int = 0, received: int = 0, retry: int = 0, upload_id: str = "",
+               retried: List[Any] = ()):
+        line = json.dumps({
+            "ts": round(start, 6),
+            "endpoint": endpoint_class,
+            "method": method,
+            "sent": sent,
+            "received": received,
+            "status": status,
+            "latency": round(latency, 6),
+            "retry": retry,
+            "thread": threading.current_thread().name,
+            "upload_id": upload_id,
+            "retried": list(retried),
+        }, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+_tracer: Optional[RequestTracer] = None
+_init_lock = threading.Lock()
+_tracer_checked = False
+
+
+def get_tracer() -> Optional[RequestTracer]:
+    """返回全局追踪器；未设置 NOTION_TRACE_FILE 时返回 None (只在第一次调用时读取环境变量)"""
+    global _tracer, _tracer_checked
+    if _tracer_checked:
+        return _tracer
+    with _init_lock:
+        if not _tracer_checked:
+            path = os.getenv(TRACE_FILE_ENV, "").strip()
+            if path:
+                _tracer = RequestTracer(path)
+                atexit.register(_tracer.close)
+            _tracer_checked = True
+    return _tracer
+
+
+# ============ 指标 ============
+
+class MetricsRegistry:
+    """
+    进程内指标 (线程安全)，按 Prometheus 文本格式输出
+
+    计数器和直方图按标签组合累加；仪表由注册的函数在抓取时计算。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 不带标签的计数器从 0 开始输出，未发生时也能在抓取结果中看到
+        self._counters: Dict[str, Dict[Tuple, float]] = {
+            name: {(): 0} for name in ("notion_sent_bytes_total", "notion_received_bytes_total",
+                                       "notion_download_bytes_total", "notion_parts_sent_total",
+                                       "notion_rate_limited_total", "notion_session_recoveries_total")
+        }
+        self._histograms: Dict[str, Dict[Tuple, List[float]]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """直方图: 每个标签组合保存 [各桶计数..., +Inf 桶计数, 总和]"""
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            buckets = series.get(key)
+            if buckets is None:
+                buckets = series[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            buckets[i] += 1
+            buckets[-1] += value
+
+    def gauge(self, name: str, func: Optional[Callable[[], float]]):
+        """注册仪表的取值函数 (func 为 None 时注销)"""
+        with self._lock:
+            if func is None:
+                self._gauges.pop(name, None)
+            else:
+                self._gauges[name] = func
+
+    def observe_request(self, endpoint_class: str, method: str, status: Any, latency: float,
+                        sent: int = 0, received: int = 0, retry: int = 0, retried: List[Any] = ()):
+        """记录一次 API 调用的结果 (由 record_request 调用)"""
+        self.inc("notion_requests_total", endpoint=endpoint_class, method=method, status=str(status))
+        self.observe("notion_request_duration_seconds", latency, endpoint=endpoint_class)
+        if sent:
+            self.inc("notion_sent_bytes_total", sent)
+        if received:
+            self.inc("notion_received_bytes_total", received)
+        rate_limited = (status == 429) + list(retried).count(429)
+        if rate_limited:
+            self.inc("notion_rate_limited_total", rate_limited)
+        if retry:
+            self.inc("notion_retries_total", layer="api")
+        if retried:
+            self.inc("notion_retries_total", len(retried), layer="transport")
+        if status in (200, 201) and endpoint_class.endswith("/send"):
+            self.inc("notion_parts_sent_total")
+
+    def render(self) -> str:
+        # 先计算仪表: 取值函数可能需要先处理积压的状态事件，从而更新计数器
+        with self._lock:
+            gauges = list(self._gauges.items())
+        gauge_values = {}
+        for name, func in gauges:
+            try:
+                gauge_values[name] = func()
+            except Exception as e:
+                logger.debug(f"指标 {name} 取值失败: {e}")
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                if kind == "gauge":
+                    if name not in gauge_values:
+                        continue
+                    series = {(): gauge_values[name]}
+                elif kind == "counter":
+                    series = self._counters.get(name, {})
+                else:
+                    series = self._histograms.get(name, {})
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind == "histogram":
+                        cumulative = 0
+                        for bound, count in zip(LATENCY_BUCKETS + (math.inf,), value):
+                            cumulative += count
+                            le = "+Inf" if bound == math.inf else repr(bound)
+                            lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                        lines.append(f"{name}_sum{_labels(key)} {value[-1]}")
+                        lines.append(f"{name}_count{_labels(key)} {cumulative}")
+                    else:
+                        lines.append(f"{name}{_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(key: Tuple) -> str:
+    if not key:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in key)
+    return "{" + body + "}"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int) -> ThreadingHTTPServer:
+    """在后台线程中启动指标端点 (只监听 127.0.0.1)"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((METRICS_HOST, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    return server
+
+
+_metrics: Optional[MetricsRegistry] = None
+_metrics_checked = False
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    """返回全局指标；未设置 NOTION_METRICS_PORT 或端口不可用时返回 None (第一次调用时启动端点)"""
+    global _metrics, _metrics_checked
+    if _metrics_checked:
+        return _metrics
+    with _init_lock:
+        if not _metrics_checked:
+            value = os.getenv(METRICS_PORT_ENV, "").strip()
+            if value:
+                try:
+                    registry = MetricsRegistry()
+                    server = start_metrics_server(registry, int(value))
+                    _metrics = registry
+                    logger.info(f"指标端点: http://{METRICS_HOST}:{server.server_port}/metrics")
+                except (ValueError, OSError) as e:
+                    logger.warning(f"无法启动指标端点 ({METRICS_PORT_ENV}={value}): {e}")
+            _metrics_checked = True
+    return _metrics
+
+
+def telemetry_enabled() -> bool:
+    """是否需要记录请求 (追踪或指标任一开启)"""
+    return get_tracer() is not None or get_metrics() is not None
+
+
+def record_request(endpoint: str, method: str, status: Any, start: float, latency: float,
+                   sent: int = 0, received: int = 0, retry: int = 0, upload_id: str = "",
+                   retried: List[Any] = ()):
+    """把一次 API 调用的结果写入追踪和指标 (未开启的忽略)"""
+    endpoint_class, path_upload_id = split_endpoint(endpoint)
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.record(endpoint_class, method, status, start, latency, sent, received, retry,
+                      upload_id or path_upload_id, retried)
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe_request(endpoint_class, method, status, latency, sent, received, retry, retried)
+
+
+# ============ 分析 ============
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩法百分位数 (输入需已排序)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def load_trace(path: str) -> Iterable[Dict[str, Any]]:
+    """逐行读取追踪文件，跳过损坏的行 (例如进程被强制结束时写了一半的最后一行)"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def analyze(records: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    汇总一次运行的追踪记录
+
+    Returns:
+        {"overall": 统计, "endpoints": {端点类别: 统计}}，统计包括请求数、
+        延迟百分位、吞吐量 (请求/秒、发送字节/秒)、429 比例和重试放大系数
+        (包括连接池内部重试在内的总尝试次数 / 首次请求数)
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    everything: List[Dict[str, Any]] = []
+    for record in records:
+        groups.setdefault(f"{record.get('method', '')} {record.get('endpoint', '')}", []).append(record)
+        everything.append(record)
+
+    # 吞吐量按整个运行的时长计算，各端点之间可以直接比较
+    if everything:
+        begin = min(r['ts'] for r in everything)
+        end = max(r['ts'] + r['latency'] for r in everything)
+        duration = max(end - begin, 1e-9)
+    else:
+        duration = 0.0
+
+    def summarize(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        latencies = sorted(r['latency'] for r in items)
+        first_tries = sum(1 for r in items if not r.get('retry'))
+        attempts = sum(1 + len(r.get('retried', ())) for r in items)
+        sent = sum(r.get('sent', 0) for r in items)
+        received = sum(r.get('received', 0) for r in items)
+        stats = {
+            "requests": len(items),
+            "errors": sum(1 for r in items if r.get('status') not in (200, 201)),
+            "attempts": attempts,
+            "rate_limited": sum((r.get('status') == 429) + r.get('retried', []).count(429) for r in items),
+            "sent": sent,
+            "received": received,
+            "req_per_sec": len(items) / duration if duration else 0.0,
+            "sent_per_sec": sent / duration if duration else 0.0,
+            "retry_amplification": attempts / first_tries if first_tries else float(attempts),
+        }
+        stats["rate_429"] = stats["rate_limited"] / attempts if attempts else 0.0
+        for p in PERCENTILES:
+            stats[f"p{p}"] = percentile(latencies, p)
+        return stats
+
+    return {
+        "duration": duration,
+        "overall": summarize(everything),
+        "endpoints": {name: summarize(items) for name, items in sorted(groups.items())},
+    }
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def _pad(text: str, width: int, left: bool = False) -> str:
+    """按终端显示宽度补齐 (中文字符占两列)"""
+    shown = sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text)
+    fill = ' ' * max(0, width - shown)
+    return text + fill if left else fill + text
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """把 analyze() 的结果格式化为文本表格"""
+    header = " ".join([_pad("端点", 36, left=True), _pad("请求", 7), _pad("p50", 8), _pad("p90", 8),
+                       _pad("p99", 8), _pad("请求/s", 8), _pad("发送/s", 10), _pad("429", 7),
+                       _pad("重试放大", 8)])
+    rule = "-" * 102
+    lines = [f"运行时长: {report['duration']:.1f}s", header, rule]
+
+    def row(name: str, s: Dict[str, Any]) -> str:
+        return (f"{_pad(name, 36, left=True)} {s['requests']:>7} {s['p50'] * 1000:>6.0f}ms {s['p90'] * 1000:>6.0f}ms "
+                f"{s['p99'] * 1000:>6.0f}ms {s['req_per_sec']:>8.2f} "
+                f"{format_bytes(s['sent_per_sec']) + '/s':>10} {s['rate_429']:>7.1%} "
+                f"{s['retry_amplification']:>8.2f}")
+
+    for name, stats in report['endpoints'].items():
+        lines.append(row(name, stats))
+    lines.append(rule)
+    lines.append(row("合计", report['overall']))
+    overall = report['overall']
+    lines.append(f"总尝试: {overall['attempts']}  失败请求: {overall['errors']}  发送: {format_bytes(overall['sent'])}  "
+                 f"接收: {format_bytes(overall['received'])}")
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Notion 请求追踪工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_analyze = sub.add_parser("analyze", help="分析追踪文件 (JSON Lines)")
+    p_analyze.add_argument("trace", help=f"追踪文件路径 (由 {TRACE_FILE_ENV} 生成)")
+    p_analyze.add_argument("--json", action="store_true", help="以 JSON 输出统计结果")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.trace):
+        print(f"找不到追踪文件: {args.trace}", file=sys.stderr)
+        return 1
+    report = analyze(load_trace(args.trace))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif not report['overall']['requests']:
+        print("追踪文件中没有请求记录")
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
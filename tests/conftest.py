@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# 测试直接导入仓库根目录下的模块；日志写到临时目录，不污染 logs/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("NOTION_LOG_DIR", tempfile.mkdtemp(prefix="notion_test_logs_"))
@@ -0,0 +1,309 @@
+# 模拟 Aria2 RPC 服务器 (仅用于测试，不依赖 aria2c)
+
+import http.server
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aria2 import STOPPED_STATUSES, _ws_accept_key, _ws_recv, _ws_send, new_gid
+
+
+class FakeAria2Server:
+    """
+    模拟 Aria2 RPC 服务器 (仅用于测试，不依赖 aria2c)
+
+    - HTTP JSON-RPC (含 system.multicall) 与 WebSocket 通知共用同一端口
+    - addUri 的任务按 max-concurrent-downloads 排队，开始后 duration 秒完成；
+      开始时 url_valid(uri) 为 False 的任务 (默认 URL 中包含 "error") 以 403 失败结束
+    - 设置 file_size 后按带宽模型下载：单任务速度为 min(连接数 × per_connection_speed,
+      per_download_limit, bandwidth / 活动任务数)；活动任务数超过 server_limit 时新开始的任务以 503 失败
+    - calls 记录每个 RPC 方法的调用次数 (multicall 的子调用也计入)
+    """
+
+    def __init__(self, port: int = 0, token: str = "", duration: float = 0.2,
+                 max_concurrent: int = 3, websocket: bool = True):
+        self.token = f"token:{token}" if token else ""
+        self.duration = duration
+        self.max_concurrent = max_concurrent
+        self.websocket = websocket
+        self.url_valid: Callable[[str], bool] = lambda uri: 'error' not in uri
+        self.file_size = 0
+        self.bandwidth = 10 * 1024 * 1024
+        self.per_connection_speed = 512 * 1024
+        self.per_download_limit = float('inf')
+        self.server_limit = 0
+        self.global_options: Dict[str, str] = {"max-connection-per-server": "1"}
+        self.calls: Dict[str, int] = {}
+        self.downloads: Dict[str, dict] = {}
+        self.order: List[str] = []
+        self.lock = threading.RLock()
+        self.ws_clients: List[Tuple[socket.socket, threading.Lock]] = []
+        self._stop = threading.Event()
+
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                try:
+                    body = {"jsonrpc": "2.0", "id": request.get('id'),
+                            "result": fake._dispatch(request['method'], request.get('params', []))}
+                except Exception as e:
+                    body = {"jsonrpc": "2.0", "id": request.get('id'),
+                            "error": {"code": 1, "message": str(e)}}
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json-rpc')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                key = self.headers.get('Sec-WebSocket-Key')
+                if not fake.websocket or self.headers.get('Upgrade', '').lower() != 'websocket' or not key:
+                    self.send_response(400)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', _ws_accept_key(key))
+                self.end_headers()
+                self.wfile.flush()
+
+                client = (self.connection, threading.Lock())
+                with fake.lock:
+                    fake.ws_clients.append(client)
+                try:
+                    while True:
+                        opcode, _ = _ws_recv(self.connection)
+                        if opcode == 0x8:
+                            break
+                except (OSError, ConnectionError):
+                    pass
+                finally:
+                    with fake.lock:
+                        fake.ws_clients.remove(client)
+                    self.close_connection = True
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+
+    def start(self) -> 'FakeAria2Server':
+        threading.Thread(target=self.httpd.serve_forever, daemon=True, name="fake-aria2").start()
+        threading.Thread(target=self._simulate, daemon=True, name="fake-aria2-sim").start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        with self.lock:
+            clients = list(self.ws_clients)
+        for sock, _ in clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def notify(self, method: str, gid: str):
+        """向所有 WebSocket 客户端推送通知"""
+        message = json.dumps({"jsonrpc": "2.0", "method": method, "params": [{"gid": gid}]}).encode()
+        with self.lock:
+            clients = list(self.ws_clients)
+        for sock, send_lock in clients:
+            try:
+                with send_lock:
+                    _ws_send(sock, message, mask=False)
+            except OSError:
+                pass
+
+    def _dispatch(self, method: str, params: list):
+        if method == "system.multicall":
+            results = []
+            for call in params[0]:
+                try:
+                    results.append([self._dispatch(call['methodName'], call.get('params', []))])
+                except Exception as e:
+                    results.append({"code": 1, "message": str(e)})
+            return results
+
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.token:
+            if not params or params[0] != self.token:
+                raise Exception("Unauthorized")
+            params = params[1:]
+
+        handler = getattr(self, '_rpc_' + method.split('.', 1)[-1], None)
+        if handler is None:
+            raise Exception(f"No such method: {method}")
+        with self.lock:
+            return handler(*params)
+
+    @staticmethod
+    def _pick(status: dict, keys: Optional[list]) -> dict:
+        status = dict(status)
+        status['files'] = [{
+            'index': '1',
+            'path': os.path.join(status['dir'], status['options'].get('out', '')),
+            'uris': [{'uri': uri, 'status': 'used'} for uri in status['uris']],
+        }]
+        return {k: v for k, v in status.items() if not keys or k in keys}
+
+    def _list(self, statuses: Tuple[str, ...], keys: Optional[list]) -> List[dict]:
+        return [self._pick(self.downloads[gid], keys) for gid in self.order
+                if self.downloads[gid]['status'] in statuses]
+
+    def _rpc_getVersion(self):
+        return {"version": "1.37.0-fake", "enabledFeatures": []}
+
+    def _rpc_getGlobalStat(self):
+        counts = {'active': 0, 'waiting': 0}
+        stopped = 0
+        speed = 0
+        for d in self.downloads.values():
+            if d['status'] in counts:
+                counts[d['status']] += 1
+            else:
+                stopped += 1
+            if d['status'] == 'active':
+                speed += d.get('speed', 0)
+        return {"downloadSpeed": str(int(speed)), "uploadSpeed": "0", "numActive": str(counts['active']),
+                "numWaiting": str(counts['waiting']), "numStopped": str(stopped),
+                "numStoppedTotal": str(stopped)}
+
+    def _rpc_getGlobalOption(self):
+        return dict(self.global_options, **{"max-concurrent-downloads": str(self.max_concurrent)})
+
+    def _rpc_changeGlobalOption(self, options: dict):
+        if 'max-concurrent-downloads' in options:
+            self.max_concurrent = int(options['max-concurrent-downloads'])
+        self.global_options.update({k: str(v) for k, v in options.items()
+                                    if k != 'max-concurrent-downloads'})
+        return "OK"
+
+    def _rpc_shutdown(self):
+        threading.Thread(target=self.stop, daemon=True).start()
+        return "OK"
+
+    def _rpc_changeOption(self, gid: str, options: dict):
+        self.downloads[gid]['options'].update({k: str(v) for k, v in options.items()})
+        return "OK"
+
+    def load_input_file(self, path: str) -> int:
+        """按 aria2 输入文件格式加载任务 (模拟 --input-file)，返回任务数"""
+        count = 0
+        uris, options = None, {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in list(f) + ['']:
+                if line.startswith((' ', '\t')):
+                    name, _, value = line.strip().partition('=')
+                    options[name] = value
+                    continue
+                if uris:
+                    with self.lock:
+                        self._rpc_addUri(uris, options)
+                    count += 1
+                uris, options = (line.split('\t') if line.strip() else None), {}
+                if uris:
+                    uris = [u.strip() for u in uris]
+        return count
+
+    def _rpc_addUri(self, uris: list, options: Optional[dict] = None, position: Optional[int] = None):
+        options = dict(options or {})
+        gid = options.pop('gid', None) or new_gid()
+        self.downloads[gid] = {
+            'gid': gid, 'status': 'waiting', 'uris': list(uris), 'options': options,
+            'dir': options.get('dir', ''), 'errorCode': '0', 'errorMessage': '', 'started': None,
+        }
+        if position is not None:
+            self.order.insert(position, gid)
+        else:
+            self.order.append(gid)
+        return gid
+
+    def _rpc_changeUri(self, gid: str, file_index: int, del_uris: list, add_uris: list):
+        d = self.downloads[gid]
+        deleted = len([u for u in d['uris'] if u in del_uris])
+        d['uris'] = [u for u in d['uris'] if u not in del_uris] + list(add_uris)
+        return [deleted, len(add_uris)]
+
+    def _rpc_removeDownloadResult(self, gid: str):
+        if self.downloads.get(gid, {}).get('status') not in STOPPED_STATUSES:
+            raise Exception(f"Could not remove download result of GID#{gid}")
+        del self.downloads[gid]
+        self.order.remove(gid)
+        return "OK"
+
+    def _rpc_tellStatus(self, gid: str, keys: Optional[list] = None):
+        if gid not in self.downloads:
+            raise Exception(f"GID {gid} is not found")
+        return self._pick(self.downloads[gid], keys)
+
+    def _rpc_tellActive(self, keys: Optional[list] = None):
+        return self._list(('active',), keys)
+
+    def _rpc_tellWaiting(self, offset: int, num: int, keys: Optional[list] = None):
+        return self._list(('waiting',), keys)[offset:offset + num]
+
+    def _rpc_tellStopped(self, offset: int, num: int, keys: Optional[list] = None):
+        stopped = self._list(STOPPED_STATUSES, keys)
+        if offset < 0:
+            # 负偏移量从最近结束的任务开始倒序返回
+            stopped = stopped[::-1]
+            offset = -offset - 1
+        return stopped[offset:offset + num]
+
+    def _simulate(self):
+        """按并发上限启动等待中的任务，并在 duration 秒后 (或按带宽模型下载完 file_size 后) 结束"""
+        last = time.time()
+        while not self._stop.wait(0.01):
+            events = []
+            now = time.time()
+            elapsed, last = now - last, now
+            with self.lock:
+                active = [self.downloads[gid] for gid in self.order if self.downloads[gid]['status'] == 'active']
+                for d in active:
+                    if d['failure'] and now - d['started'] >= min(self.duration, 0.05):
+                        d.update(status='error', errorCode='22', speed=0, errorMessage=d['failure'])
+                        events.append(("aria2.onDownloadError", d['gid']))
+                        continue
+                    if self.file_size:
+                        connections = int(d['options'].get('max-connection-per-server',
+                                                           self.global_options['max-connection-per-server']))
+                        d['speed'] = min(connections * self.per_connection_speed, self.per_download_limit,
+                                         self.bandwidth / len(active))
+                        d['completedLength'] = min(self.file_size, d['completedLength'] + d['speed'] * elapsed)
+                        finished = d['completedLength'] >= self.file_size
+                    else:
+                        finished = now - d['started'] >= self.duration
+                    if finished:
+                        d.update(status='complete', speed=0)
+                        events.append(("aria2.onDownloadComplete", d['gid']))
+                running = sum(1 for d in self.downloads.values() if d['status'] == 'active')
+                for gid in self.order:
+                    if running >= self.max_concurrent:
+                        break
+                    d = self.downloads[gid]
+                    if d['status'] == 'waiting':
+                        failure = None
+                        if not self.url_valid(d['uris'][0]):
+                            failure = 'The response status is not successful. status=403'
+                        elif self.server_limit and running >= self.server_limit:
+                            failure = 'The response status is not successful. status=503'
+                        d.update(status='active', started=now, failure=failure, speed=0, completedLength=0)
+                        running += 1
+                        events.append(("aria2.onDownloadStart", gid))
+            for method, gid in events:
+                self.notify(method, gid)
@@ -0,0 +1,160 @@
+import time
+
+import pytest
+
+import aria2
+from aria2 import Aria2Client, ConcurrencyTuner, UrlRecovery, write_input_file
+from fake_aria2 import FakeAria2Server
+
+
+def test_first_batch_is_flushed_immediately():
+    seen = []
+
+    def items():
+        for i in range(5):
+            seen.append(i)
+            yield i
+
+    batches = aria2._timed_batches(items(), 3, 60)
+    assert next(batches) == [0]
+    assert seen == [0]
+    assert list(batches) == [[1, 2, 3], [4]]
+
+
+def test_batches_flush_on_interval(monkeypatch):
+    clock = iter([0.0, 0.0, 0.1, 1.0, 1.0, 1.0])
+    monkeypatch.setattr(aria2.time, "monotonic", lambda: next(clock))
+    assert list(aria2._timed_batches(range(4), 100, 0.5)) == [[0], [1, 2], [3]]
+
+
+@pytest.fixture
+def fakes():
+    """创建的模拟服务器在测试结束后统一关闭"""
+    servers = []
+
+    def make(**kwargs):
+        fake = FakeAria2Server(**kwargs).start()
+        servers.append(fake)
+        return fake
+
+    yield make
+    for fake in servers:
+        fake.stop()
+
+
+@pytest.mark.parametrize("websocket", [True, False])
+def test_add_downloads_queued(fakes, websocket):
+    files = [(f"file_{i:02d}.bin", f"http://example.com/{'error' if i == 7 else 'ok'}/{i}", f"block-{i}")
+             for i in range(12)]
+    fake = fakes(token="secret", duration=0.3, max_concurrent=10, websocket=websocket)
+    client = Aria2Client(port=fake.port, token="secret", batch_size=5)
+    added = {}
+
+    gids = client.add_downloads_queued(files, "downloads", max_active=4,
+                                       on_added=lambda gid, item: added.__setitem__(gid, item[2]))
+    client.close()
+
+    statuses = [fake.downloads[gid]['status'] for gid in gids]
+    assert len(gids) == len(files)
+    assert statuses.count('complete') == len(files) - 1 and statuses.count('error') == 1
+    assert sorted(added.values()) == sorted(item[2] for item in files)
+
+
+def test_add_downloads_batch(fakes):
+    fake = fakes(token="secret")
+    client = Aria2Client(port=fake.port, token="secret", batch_size=50)
+    gids = client.add_downloads_batch([(f"f{i}", f"http://example.com/{i}") for i in range(120)])
+    assert len(gids) == 120 and fake.calls.get('aria2.addUri') == 120
+
+
+def test_input_file_gids_match_loaded_tasks(fakes, tmp_path):
+    fake = fakes(max_concurrent=0)
+    input_path = str(tmp_path / "input.txt")
+    assigned = {}
+    count = write_input_file(((f"i{i}.bin", f"http://example.com/{i}", f"block-{i}") for i in range(1000)),
+                             input_path, "downloads",
+                             on_added=lambda gid, item: assigned.__setitem__(gid, item[0]))
+    assert count == fake.load_input_file(input_path) == 1000
+    assert all(fake.downloads[gid]['options']['out'] == name for gid, name in assigned.items())
+
+
+def test_input_file_and_rpc_send_same_headers(fakes, tmp_path):
+    fake = fakes(max_concurrent=0)
+    input_path = str(tmp_path / "input.txt")
+    write_input_file([("a.bin", "http://example.com/a")], input_path)
+    client = Aria2Client(port=fake.port)
+    client.add_downloads_batch([("b.bin", "http://example.com/b")])
+    client.close()
+
+    with open(input_path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.startswith("  header=")]
+    rpc_headers = next(iter(fake.downloads.values()))['options']['header']
+    assert lines == [f"header={h}" for h in aria2.DOWNLOAD_HEADERS] and rpc_headers == aria2.DOWNLOAD_HEADERS
+
+
+@pytest.mark.parametrize("proactive", [False, True])
+def test_expired_urls_are_recovered(fakes, proactive):
+    # 旧签名 (sig=old) 的链接开始下载时返回 403
+    fake = fakes(duration=0.1, max_concurrent=2)
+    fake.url_valid = lambda uri: 'sig=old' not in uri
+    client = Aria2Client(port=fake.port)
+    recovery = UrlRecovery(client, lambda key: f"http://example.com/{key}?sig=new",
+                           (lambda uri: 'sig=old' in uri) if proactive else None, interval=0.1)
+    client.add_downloads_batch([(f"r{i}.bin", f"http://example.com/block-{i}?sig=old", f"block-{i}")
+                                for i in range(10)], "downloads",
+                               on_added=lambda gid, item: recovery.track(gid, item[2]))
+    recovery.start()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        with fake.lock:
+            done = [d for d in fake.downloads.values() if d['status'] == 'complete']
+        if len(done) == 10:
+            break
+        time.sleep(0.1)
+    recovery.stop()
+    client.close()
+
+    assert len(done) == 10 and {d['options']['out'] for d in done} == {f"r{i}.bin" for i in range(10)}
+    assert (recovery.refreshed if proactive else recovery.recovered) > 0
+
+
+def failed(gid, name, code, message, uri):
+    return {"gid": gid, "status": "error", "errorCode": code, "errorMessage": message, "dir": "downloads",
+            "files": [{"path": f"downloads/{name}", "uris": [{"uri": uri, "status": "used"}]}]}
+
+
+@pytest.mark.parametrize("proactive, expected", [(False, ["k403"]), (True, ["k403", "kdisk"])])
+def test_recovery_only_reresolves_expired_urls(fakes, proactive, expected):
+    fake = fakes()
+    client = Aria2Client(port=fake.port)
+    resolved = []
+    recovery = UrlRecovery(client, lambda key: resolved.append(key) or f"http://example.com/{key}?sig=new",
+                           (lambda uri: 'sig=old' in uri) if proactive else None)
+    for gid, key in (("g1", "k403"), ("g2", "k503"), ("g3", "kdisk")):
+        recovery.track(gid, key)
+
+    http = "The response status is not successful. status={}"
+    recovery._recover_failed([
+        failed("g1", "a.bin", "22", http.format(403), "http://example.com/a?sig=x"),
+        failed("g2", "b.bin", "22", http.format(503), "http://example.com/b?sig=x"),
+        failed("g3", "c.bin", "9", "No space left on device", "http://example.com/c?sig=old"),
+    ])
+    client.close()
+
+    assert resolved == expected and recovery.recovered == len(expected)
+    names = {"k403": "a.bin", "kdisk": "c.bin"}
+    assert sorted(d['options']['out'] for d in fake.downloads.values()) == [names[k] for k in expected]
+
+
+def test_concurrency_tuner_finds_server_limit(fakes):
+    # 总带宽 12MB/s、单任务最高 1.5MB/s，活动任务超过 9 个时服务器返回 503
+    fake = fakes(max_concurrent=3)
+    fake.file_size, fake.bandwidth, fake.per_download_limit, fake.server_limit = 2 << 20, 12 << 20, 1.5 * (1 << 20), 9
+    client = Aria2Client(port=fake.port)
+    client.add_downloads_batch([(f"t{i}.bin", f"http://example.com/{i}") for i in range(400)])
+    tuner = ConcurrencyTuner(client, initial=3, sample_interval=0.1, window=4)
+    tuner.start()
+    time.sleep(6)
+    tuner.stop()
+    client.close()
+    assert 3 < tuner.concurrent <= 9
@@ -0,0 +1,153 @@
+import base64
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from downloader import DownloadEngine, PartState, unique_name
+from notion import FileInfo
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """按路径返回固定内容；ranges=True 时支持 Range，headers 为附加的响应头"""
+
+    files = {}
+    headers_extra = {}
+    ranges = False
+    requested = []
+
+    def do_GET(self):
+        body = self.files.get(self.path.split("?")[0])
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        self.requested.append(match.group(0) if match else None)
+        if self.ranges and match:
+            start, end = int(match.group(1)), min(int(match.group(2)), len(body) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(body)}")
+            body = body[start:end + 1]
+        else:
+            self.send_response(200)
+        for name, value in self.headers_extra.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    FileHandler.headers_extra = {}
+    FileHandler.ranges = False
+    FileHandler.requested = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def file_info(name, url, block_id):
+    return FileInfo(name, url, "", block_id, "file", "", False)
+
+
+def test_unique_name_adds_suffix_case_insensitively():
+    taken = set()
+    assert unique_name("image.png", taken) == "image.png"
+    assert unique_name("Image.PNG", taken) == "Image (1).PNG"
+    assert unique_name("image.png", taken) == "image (2).png"
+    assert unique_name("a/b.txt", taken) != "a/b.txt"
+
+
+def test_same_named_files_get_separate_targets(server, tmp_path):
+    FileHandler.files = {"/a": b"first" * 1000, "/b": b"second" * 1000}
+    events = {}
+
+    def on_progress(name, downloaded, total, status, key):
+        events.setdefault(key, set()).add(name)
+
+    engine = DownloadEngine(num_workers=2)
+    stats = engine.download_all([file_info("image.png", f"{server}/a", "blk-a"),
+                                 file_info("image.png", f"{server}/b", "blk-b")],
+                                str(tmp_path), on_progress)
+
+    assert stats.completed == 2 and stats.failed == 0
+    contents = {p.name: p.read_bytes() for p in tmp_path.iterdir()}
+    assert contents == {"image.png": b"first" * 1000, "image (1).png": b"second" * 1000}
+    assert events == {"blk-a": {"image.png"}, "blk-b": {"image (1).png"}}
+
+
+def test_interrupt_stops_without_draining_queue(server, tmp_path):
+    FileHandler.files = {"/a": b"x" * 100}
+    engine = DownloadEngine(num_workers=1)
+
+    def files():
+        yield file_info("a.bin", f"{server}/a", "blk-a")
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        engine.download_all(files(), str(tmp_path))
+    assert engine.stop_event.is_set()
+    assert engine.stats.elapsed is not None
+
+
+def test_add_range_merges_adjacent_and_overlapping(tmp_path):
+    state = PartState(str(tmp_path / "f.part"), "u", "b", 100)
+    state.add_range(0, 9)
+    state.add_range(20, 29)
+    state.add_range(10, 14)
+    state.add_range(25, 39)
+    assert state.completed == [[0, 14], [20, 39]]
+    assert state.missing() == [(15, 19), (40, 99)]
+    assert state.done_bytes == 35
+
+
+def test_sidecar_resume_requests_only_missing_ranges(server, tmp_path):
+    body = bytes(range(256)) * 40
+    FileHandler.files = {"/f": body}
+    FileHandler.ranges = True
+    part_file = str(tmp_path / "f.bin.part")
+    with open(part_file, "wb") as f:
+        f.write(body[:4096] + b"\0" * (len(body) - 4096))
+    state = PartState(part_file, f"{server}/f?sig=old", "blk", len(body), completed=[[0, 4095]])
+    state.save()
+
+    engine = DownloadEngine(num_workers=1, segment_size=1024)
+    assert engine.download_file(file_info("f.bin", f"{server}/f?sig=new", "blk"), str(tmp_path))
+
+    assert (tmp_path / "f.bin").read_bytes() == body
+    assert FileHandler.requested[0] == "bytes=4096-5119"
+    assert not os.path.exists(state.state_file)
+
+
+def test_etag_that_is_not_md5_does_not_fail(server, tmp_path):
+    # SSE-KMS 等对象的 ETag 形如 MD5 但并不是内容的 MD5
+    FileHandler.files = {"/f": b"data" * 100}
+    FileHandler.headers_extra = {"ETag": '"' + "0" * 32 + '"'}
+    engine = DownloadEngine(num_workers=1)
+    assert engine.download_file(file_info("f.bin", f"{server}/f", "blk"), str(tmp_path))
+    assert (tmp_path / "f.bin").read_bytes() == b"data" * 100
+
+
+def test_checksum_mismatch_keeps_data(server, tmp_path):
+    body = b"data" * 100
+    FileHandler.files = {"/f": body}
+    FileHandler.headers_extra = {"Content-MD5": base64.b64encode(hashlib.md5(b"other").digest()).decode()}
+    engine = DownloadEngine(num_workers=1)
+    assert not engine.download_file(file_info("f.bin", f"{server}/f", "blk"), str(tmp_path))
+    assert (tmp_path / "f.bin.corrupt").read_bytes() == body
+    assert not (tmp_path / "f.bin").exists()
+
+    FileHandler.headers_extra = {"Content-MD5": base64.b64encode(hashlib.md5(body).digest()).decode()}
+    assert engine.download_file(file_info("f.bin", f"{server}/f", "blk"), str(tmp_path))
+    assert (tmp_path / "f.bin").read_bytes() == body
@@ -0,0 +1,66 @@
+import json
+import os
+
+import pytest
+
+from exporters import EXPORTERS, RENAMES_FILE, TaskExporter, apply_renames, export_tasks
+
+
+def write_manifest(folder, renames):
+    with open(os.path.join(folder, RENAMES_FILE), "w", encoding="utf-8") as f:
+        json.dump(renames, f)
+
+
+def test_apply_renames_stays_inside_folder(tmp_path):
+    folder = tmp_path / "downloads"
+    folder.mkdir()
+    (folder / "a.txt").write_text("a")
+    (folder / "b.txt").write_text("b")
+    write_manifest(folder, [["a.txt", "../escaped.bin"], ["b.txt", ".."], ["../outside", "c.bin"]])
+
+    assert apply_renames(str(folder)) == (1, 2)
+    assert sorted(os.listdir(folder)) == [".._escaped.bin", "b.txt", RENAMES_FILE]
+    assert sorted(os.listdir(tmp_path)) == ["downloads"]
+
+
+def tasks(count):
+    return ((f"file{i}.bin", f"https://files.example/{i}/file{i}.bin.txt?sig=x", f"block-{i}")
+            for i in range(count))
+
+
+def test_shards_round_robin_and_drop_empty(tmp_path):
+    paths = export_tasks(tasks(5), str(tmp_path), "wget", shards=3)
+    assert [os.path.basename(p) for p in paths] == [f"download_tasks_{i}of03.urls.txt" for i in ("01", "02", "03")]
+    lines = [open(p, encoding="utf-8").read().splitlines() for p in paths]
+    assert [len(chunk) for chunk in lines] == [2, 2, 1]
+    assert lines[1][0].startswith("https://files.example/1/")
+
+    assert len(export_tasks(tasks(2), str(tmp_path / "few"), "jsonl", shards=4)) == 2
+    assert export_tasks(tasks(0), str(tmp_path / "none"), "curl") == []
+    assert os.listdir(tmp_path / "none") == []
+
+
+def test_manifest_keeps_duplicate_url_names(tmp_path):
+    items = [("a.png", "https://files.example/1/image.png"),
+             ("b.png", "https://files.example/2/image.png"),
+             ("same.bin", "https://files.example/3/same.bin")]
+    export_tasks(items, str(tmp_path), "idm")
+    with open(tmp_path / RENAMES_FILE, encoding="utf-8") as f:
+        assert json.load(f) == [["image.png", "a.png"], ["image.png", "b.png"]]
+
+    (tmp_path / "image.png").write_text("1")
+    assert apply_renames(str(tmp_path)) == (1, 1)
+    assert (tmp_path / "a.png").read_text() == "1"
+
+
+def test_stale_manifest_is_removed(tmp_path):
+    export_tasks([("a.png", "https://files.example/1/image.png")], str(tmp_path), "idm")
+    assert (tmp_path / RENAMES_FILE).exists()
+    export_tasks([("a.png", "https://files.example/1/image.png")], str(tmp_path), "aria2")
+    assert not (tmp_path / RENAMES_FILE).exists()
+
+
+def test_exporter_base_is_abstract():
+    with pytest.raises(TypeError):
+        TaskExporter()
+    assert all(issubclass(cls, TaskExporter) for cls in EXPORTERS.values())
@@ -0,0 +1,59 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from notion import UploadProgress, UploadStatus
+
+
+class FakeManager:
+    """按分片回调进度的上传，文件名含 "bad" 的任务失败"""
+
+    current_page_id = "page"
+
+    def upload_file(self, filepath, target_page_id=None, progress_callback=None):
+        size = main.os.path.getsize(filepath)
+        for part in (1, 2):
+            progress_callback(UploadProgress(filepath, size * part // 2, size, UploadStatus.UPLOADING, part, 2))
+        return "bad" not in filepath
+
+
+def test_headless_upload_keeps_stdout_ndjson(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("NOTION_PROGRESS_INTERVAL", "0.1")
+    monkeypatch.setattr(main, "time", SimpleNamespace(sleep=lambda _: time.sleep(0.01), time=time.time))
+    paths = []
+    for name in ("a.bin", "b.bin", "bad.bin"):
+        (tmp_path / name).write_bytes(b"x" * 1000)
+        paths.append(str(tmp_path / name))
+
+    uploader = main.NotionUploader(FakeManager(), num_threads=2)
+    uploader.upload_files(paths)
+
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in out.splitlines()]
+    assert records[0]["event"] == "start" and records[-1]["event"] == "done"
+    assert records[-1]["completed"] == 2 and records[-1]["failed"] == 1
+    assert "共 3 个文件" in err
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("report", ("report", "substring", {})),
+    ("annual report", ("annual report", "substring", {})),
+    ("*.zip", ("*.zip", "glob", {})),
+    ("photo_[0-9]", ("photo_[0-9]", "glob", {})),
+    ("re:^a.*b$", ("^a.*b$", "regex", {})),
+    ("ext:zip", ("", "substring", {"ext": "zip"})),
+    ("Type:VIDEO clip", ("clip", "substring", {"block_type": "video"})),
+    ("spoofed:yes", ("", "substring", {"spoofed": True})),
+    ("spoofed:no", ("", "substring", {"spoofed": False})),
+    ("after:2026-01-01 before:2026-02-01", ("", "substring",
+                                            {"edited_after": "2026-01-01", "edited_before": "2026-02-01"})),
+    ("sort:name", ("", "substring", {"sort": "name", "reverse": False})),
+    ("a sort:-Edited", ("a", "substring", {"sort": "edited", "reverse": True})),
+    ("note:todo", ("note:todo", "substring", {})),
+    ("ext", ("ext", "substring", {})),
+])
+def test_parse_search_query(text, expected):
+    assert main.parse_search_query(text) == expected
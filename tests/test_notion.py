@@ -0,0 +1,118 @@
+import pytest
+
+from notion import FileIndex, FileInfo, FileListing, detect_spoofed
+
+BLOCK_ID = "0123abcd-4567-89ef-0123-456789abcdef"
+
+
+def info(name, block_id=BLOCK_ID, block_type="file", edited="2026-01-16T10:00:00.000Z", spoofed=False):
+    return FileInfo(name, f"https://files.example/{name}", "", block_id, block_type, edited, spoofed)
+
+
+def test_listing_packs_uuid_ids():
+    listing = FileListing("2026-01-16 10:00:00")
+    listing.append(info("a.zip.txt", spoofed=True))
+    listing.append(info("b.png", block_id=BLOCK_ID.replace("-", "").upper(), block_type="image"))
+
+    assert len(listing) == 2 and len(listing._ids) == 32 and listing._odd_ids == {}
+    assert listing.block_id(0) == BLOCK_ID and listing.block_id(-1) == BLOCK_ID
+    assert listing[1] == FileInfo("b.png", "https://files.example/b.png", "2026-01-16 10:00:00",
+                                  BLOCK_ID, "image", "2026-01-16T10:00:00.000Z", False)
+    assert listing[0].is_spoofed and listing.original_name(0) == "a.zip"
+    assert listing.block_types == ["file", "image"]
+    assert listing.edited_times[0] is listing.edited_times[1]
+
+
+@pytest.mark.parametrize("block_id", ["blk-1", "", None])
+def test_listing_keeps_odd_ids(block_id):
+    listing = FileListing("t")
+    listing.append(info("a.bin"))
+    listing.append(info("b.bin", block_id=block_id))
+    listing.append(info("c.bin"))
+
+    assert len(listing._ids) == 48 and list(listing._odd_ids) == [1]
+    assert [f.block_id for f in listing] == [BLOCK_ID, block_id or "", BLOCK_ID]
+    assert [f.name for f in listing.select([2, 0])] == ["c.bin", "a.bin"]
+
+
+def test_file_info_unpacks_like_legacy_list():
+    listing = FileListing("2026-01-16 10:00:00")
+    listing.append(info("a.bin"))
+    name, url, load_time = listing[0]
+    assert (name, url, load_time) == ("a.bin", "https://files.example/a.bin", "2026-01-16 10:00:00")
+    assert listing[0].to_list() == [name, url, load_time]
+
+
+@pytest.mark.parametrize("name, caption, block_type, expected", [
+    ("a.zip.txt", "a.zip", "file", True),
+    ("a.zip.txt", "other.zip", "file", False),
+    ("a.pdf.txt", "a.pdf", "file", True),
+    # 没有 caption 时按上传规则: 去掉 .txt 后的扩展名不受支持才算伪装
+    ("a.zip.txt", "", "file", True),
+    ("A.ZIP.TXT", "", "file", True),
+    ("a.pdf.txt", "", "file", False),
+    ("notes.txt", "", "file", False),
+    ("a.zip.txt", "", "image", False),
+    ("a.zip", "", "file", False),
+])
+def test_detect_spoofed(name, caption, block_type, expected):
+    assert detect_spoofed(name, caption, block_type) is expected
+
+
+@pytest.fixture(scope="module")
+def index():
+    listing = FileListing("t")
+    for name, block_type, minute in [("Report 2026.pdf", "pdf", 1), ("holiday.PNG", "image", 3),
+                                     ("backup.zip.txt", "file", 2), ("notes.txt", "file", 5),
+                                     ("clip.mp4", "video", 4), ("archive_2025.7z.txt", "file", 0)]:
+        listing.append(info(name, block_type=block_type, edited=f"2026-01-16T10:0{minute}:00.000Z",
+                            spoofed=detect_spoofed(name, "", block_type)))
+    return FileIndex(listing)
+
+
+@pytest.mark.parametrize("query, kwargs, expected", [
+    ("", {}, [0, 1, 2, 3, 4, 5]),
+    ("report", {}, [0]),
+    ("2026", {}, [0]),
+    ("p.zi", {}, [2]),
+    ("*.txt", {"mode": "glob"}, [2, 3, 5]),
+    ("*.png", {"mode": "glob"}, [1]),
+    ("[bc]*", {"mode": "glob"}, [2, 4]),
+    (r"^(backup|clip)\b", {"mode": "regex"}, [2, 4]),
+    (r"\d{4}", {"mode": "regex"}, [0, 5]),
+    ("", {"ext": "zip"}, [2]),
+    ("", {"ext": ".7Z"}, [5]),
+    ("", {"ext": "txt"}, [3]),
+    ("", {"block_type": "image"}, [1]),
+    ("", {"spoofed": True}, [2, 5]),
+    ("txt", {"spoofed": False}, [3]),
+    ("", {"edited_after": "2026-01-16T10:03"}, [1, 3, 4]),
+    ("", {"edited_before": "2026-01-16T10:01:00.000Z"}, [0, 5]),
+    ("", {"block_type": "file", "edited_after": "2026-01-16T10:01", "edited_before": "2026-01-16T10:03"}, [2]),
+    ("", {"sort": "name"}, [5, 2, 4, 1, 3, 0]),
+    ("", {"sort": "ext"}, [5, 4, 0, 1, 3, 2]),
+    ("", {"sort": "edited", "reverse": True}, [3, 4, 1, 2, 0, 5]),
+    ("txt", {"sort": "name", "reverse": True}, [3, 2, 5]),
+])
+def test_search(index, query, kwargs, expected):
+    assert index.search(query, **kwargs) == expected
+
+
+@pytest.mark.parametrize("query, kwargs", [
+    ("(", {"mode": "regex"}),
+    ("a", {"mode": "fuzzy"}),
+    ("a", {"sort": "size"}),
+])
+def test_search_rejects_bad_arguments(index, query, kwargs):
+    with pytest.raises(ValueError):
+        index.search(query, **kwargs)
+
+
+def test_sorted_search_of_few_rows_uses_rank():
+    listing = FileListing("t")
+    for i in range(100):
+        listing.append(info(f"file_{99 - i:02d}.bin"))
+    index = FileIndex(listing)
+    assert index.search("file_3", sort="name") == list(range(69, 59, -1))
+    assert "name:rank" in index._sorted
+    assert index.search("file_3", sort="name", reverse=True) == list(range(60, 70))
@@ -0,0 +1,28 @@
+import threading
+import time
+
+from profiling import StackSampler
+
+
+def test_stop_waits_for_sampler_thread():
+    sampler = StackSampler(interval=0.001)
+    done = threading.Event()
+
+    def work():
+        sampler.threads[threading.get_ident()] = 1
+        while not done.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=work)
+    worker.start()
+    sampler.start()
+    time.sleep(0.05)
+    sampler.stop()
+    done.set()
+    worker.join()
+
+    assert not sampler._thread.is_alive()
+    samples = sampler.samples
+    time.sleep(0.01)
+    assert sampler.samples == samples > 0
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in sampler.collapsed().splitlines()) == samples
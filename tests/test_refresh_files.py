@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import notion
+from notion import NotionFileManager
+
+
+def ts(minute: int, second: int = 0) -> float:
+    return datetime(2026, 1, 16, 10, minute, second, tzinfo=timezone.utc).timestamp()
+
+
+def iso(minute: int) -> str:
+    return f"2026-01-16T10:{minute:02d}:00.000Z"
+
+
+def block(block_id: str, minute: int) -> dict:
+    return {"id": block_id, "type": "file", "last_edited_time": iso(minute),
+            "file": {"name": f"{block_id}.bin", "type": "file",
+                     "file": {"url": f"https://files.example/{block_id}.bin"}}}
+
+
+class FakePage(NotionFileManager):
+    """在内存中模拟一个页面的 pages / blocks children 接口"""
+
+    def __init__(self):
+        super().__init__("token")
+        self.blocks = []
+        self.page_edited = iso(0)
+        self.requests = []
+
+    def _api_request(self, method, endpoint, data=None, files=None, params=None, **kwargs):
+        self.requests.append((endpoint, dict(params or {})))
+        if endpoint.startswith("pages/"):
+            return True, {"last_edited_time": self.page_edited}
+        results = self.blocks
+        cursor = (params or {}).get("start_cursor")
+        if cursor:
+            ids = [b["id"] for b in self.blocks]
+            if cursor not in ids:
+                return False, "HTTP 400: invalid start_cursor"
+            results = self.blocks[ids.index(cursor):]
+        return True, {"results": results, "has_more": False}
+
+
+@pytest.fixture
+def page(monkeypatch):
+    clock = {"now": ts(1, 20)}
+    monkeypatch.setattr(notion.time, "time", lambda: clock["now"])
+    manager = FakePage()
+    manager.blocks = [block("a", 0), block("b", 1)]
+    manager.page_edited = iso(1)
+    manager.set_page("page")
+    manager.refresh_files()                         # 没有缓存时完整获取并记录页面编辑时间
+    manager.clock = clock
+    return manager
+
+
+def names(listing):
+    return sorted(info.block_id for info in listing)
+
+
+def test_delete_and_append_in_snapshot_minute_forces_full_refresh(page):
+    page.blocks = [block("b", 1), block("c", 1)]    # 同一分钟内删除 a 并追加 c
+    page.clock["now"] = ts(1, 55)
+    assert names(page.refresh_files()) == ["b", "c"]
+
+
+def test_append_in_later_minute_uses_delta(page):
+    page.blocks.append(block("c", 3))
+    page.page_edited = iso(3)
+    page.clock["now"] = ts(4)
+    page.requests.clear()
+    assert names(page.refresh_files()) == ["a", "b", "c"]
+    children = [params for endpoint, params in page.requests if endpoint.endswith("/children")]
+    assert children == [{"page_size": 50, "start_cursor": "b"}]
+
+
+def test_edit_without_new_blocks_forces_full_refresh(page):
+    page.blocks = [block("b", 1)]                   # 删除 a，没有新增
+    page.page_edited = iso(3)
+    page.clock["now"] = ts(4)
+    assert names(page.refresh_files()) == ["b"]
+
+
+def test_unchanged_page_reuses_cache(page):
+    page.clock["now"] = ts(2)                       # 快照晚于页面最后一次修改所在的分钟
+    page.requests.clear()
+    listing = page.file_list(force_refresh=True)
+    assert [endpoint for endpoint, _ in page.requests] == ["blocks/page/children"]
+
+    # file_list 不读取页面编辑时间，首次刷新时补上
+    page.clock["now"] = ts(3)
+    page.requests.clear()
+    assert page.refresh_files() is listing
+    assert page._cache["page"]["page_edited"] == iso(1)
+    assert [endpoint for endpoint, _ in page.requests] == ["pages/page"]
+
+
+def test_unseeded_cache_modified_after_listing_forces_full_refresh(page):
+    page.clock["now"] = ts(1, 30)
+    page.file_list(force_refresh=True)              # 快照与页面修改在同一分钟，无法确认缓存是最新的
+    page.blocks.append(block("c", 3))
+    page.page_edited = iso(3)
+    page.clock["now"] = ts(4)
+    page.requests.clear()
+    assert names(page.refresh_files()) == ["a", "b", "c"]
+    assert page.requests == [("pages/page", {}), ("blocks/page/children", {"page_size": 50})]
+    assert page._cache["page"]["page_edited"] == iso(3)
@@ -0,0 +1,248 @@
+import io
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+from notion import UploadStatus
+from rich_ui import (CODE_COMPLETED, CODE_FAILED, CODE_PENDING, PROGRESS_FD_ENV, PROGRESS_FILE_ENV,
+                     STATUS_BY_CODE, STATUS_CODES, HeadlessProgressUI, ModernUploadUI, RateMeter,
+                     TaskStatus, TaskTable, create_upload_ui, open_progress_stream)
+
+
+def make_table(count=5, size=100):
+    table = TaskTable()
+    for i in range(count):
+        table.add(f"/data/目录/file_{i}.bin", size * (i + 1), f"page-{i % 2}")
+    return table
+
+
+def test_table_packs_rows_and_paths():
+    table = make_table()
+    table.add("/data/\udcff.bin", 7, "page-0")
+
+    assert len(table) == 6 and table.total_size == 100 * 15 + 7
+    assert table.path(0) == "/data/目录/file_0.bin" and table.name(4) == "file_4.bin"
+    assert table.path(5) == "/data/\udcff.bin"
+    assert table.pages == ["page-0", "page-1"] and table.page_id(3) == "page-1"
+    table.set_page(3, "page-2")
+    assert table.page_id(3) == "page-2" and table.pages[-1] == "page-2"
+
+    path_bytes = sum(len(table.path(i).encode("utf-8", "surrogateescape")) for i in range(len(table)))
+    assert table.nbytes() == 49 * len(table) + path_bytes
+
+
+def test_table_progress_claim_and_status_lookup():
+    table = make_table(3)
+    table.sent[0] = 150
+    assert table.progress(0) == 1.0
+    table.sent[1] = 50
+    assert table.progress(1) == 0.25
+
+    table.add("empty.txt", 0, "page-0")
+    assert table.progress(3) == 0.0
+    table.status[3] = CODE_COMPLETED
+    assert table.progress(3) == 1.0
+
+    assert [table.claim() for _ in range(5)] == [0, 1, 2, 3, None]
+    table.status[1] = CODE_FAILED
+    assert table.ids_with_status(CODE_PENDING) == [0, 2]
+    assert table.ids_with_status(CODE_FAILED) == [1]
+
+
+@pytest.mark.parametrize("status", list(UploadStatus))
+def test_upload_status_maps_to_task_status(status):
+    code = STATUS_CODES[status.value]
+    assert STATUS_BY_CODE[code] == TaskStatus(status.value)
+
+
+def feed(meter, start, seconds, per_second, step=0.5):
+    """按固定速率喂数据，每 step 秒采样一次，返回最后的时间点"""
+    now = start
+    for _ in range(int(seconds / step)):
+        meter.add(int(per_second * step))
+        now += step
+        meter.sample(now)
+    return now
+
+
+def test_rate_meter_converges_to_steady_rate():
+    meter = RateMeter(window=5.0, smoothing=1.0)
+    assert meter.sample(0.0) == 0.0
+    feed(meter, 0.0, 20, 1000)
+    assert meter.rate == pytest.approx(1000, rel=0.01)
+
+
+def test_rate_meter_forgets_slow_start_and_stalls():
+    meter = RateMeter(window=5.0, smoothing=1.0)
+    meter.sample(0.0)
+    now = feed(meter, 0.0, 30, 10)
+    now = feed(meter, now, 10, 10000)
+    # 总字节/总耗时只有约 2500，窗口速率已跟上当前速度
+    assert meter.rate == pytest.approx(10000, rel=0.02)
+
+    now = feed(meter, now, 10, 0)
+    assert meter.rate < 10000 * 0.01
+
+
+def test_rate_meter_window_keeps_one_base_sample():
+    meter = RateMeter(window=2.0, smoothing=1.0)
+    meter.sample(0.0)
+    feed(meter, 0.0, 10, 100, step=0.1)
+    times = [t for t, _ in meter._samples]
+    assert times[0] <= times[-1] - 2.0 < times[1]
+    assert meter.sample(times[-1]) == meter.rate
+
+
+def test_paint_redraws_only_changed_rows(capsys):
+    ui = ModernUploadUI(make_table(), num_threads=2)
+    ui._paint(["a", "b", "c"])
+    first = capsys.readouterr().out
+    assert first.startswith("\033[2J") and "\033[3;1Hc" in first
+
+    ui._paint(["a", "B", "c"])
+    assert capsys.readouterr().out == "\033[2;1HB\033[K"
+
+    ui._paint(["a", "B", "c"])
+    assert capsys.readouterr().out == ""
+
+    ui._paint(["a"])
+    assert capsys.readouterr().out == "\033[2;1H\033[J"
+
+    # 终端尺寸变化时整屏重绘
+    ui._term_width += 1
+    ui._paint(["a"])
+    assert capsys.readouterr().out == "\033[2J\033[1;1Ha\033[K"
+
+
+def test_view_tracks_active_and_pending_incrementally():
+    table = make_table(6)
+    ui = ModernUploadUI(table, num_threads=2)
+    with ui.lock:
+        assert ui._pending_view(3) == [0, 1, 2] and ui.pending_count == 6
+
+    for task_id in (2, 0):
+        ui.post(task_id, TaskStatus.UPLOADING)
+    ui.post(0, TaskStatus.COMPLETED)
+    ui.post(3, TaskStatus.RETRYING)
+    with ui.lock:
+        ui._drain_events()
+        assert ui._active_ids == [2, 3]
+        assert ui._pending_view(10) == [1, 4, 5] and ui.pending_count == 3
+
+    # 任务放回等待队列 (如被其他流程重新排队) 时游标回退
+    ui.post(2, TaskStatus.PENDING)
+    with ui.lock:
+        ui._drain_events()
+        assert ui._active_ids == [3]
+        assert ui._pending_view(2) == [1, 2] and ui.pending_count == 4
+
+
+def test_event_channel_from_many_workers():
+    table = make_table(200, size=10)
+    ui = ModernUploadUI(table, num_threads=8)
+
+    def worker():
+        while True:
+            task_id = table.claim()
+            if task_id is None:
+                return
+            ui.post(task_id, TaskStatus.UPLOADING)
+            for _ in range(table.size[task_id] // 10):
+                ui.post(task_id, TaskStatus.UPLOADING, 10)
+            ui.post(task_id, TaskStatus.COMPLETED)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with ui.lock:
+        ui._drain_events()
+    assert ui.uploaded_bytes == ui.rate.total == table.total_size
+    assert ui._active_ids == [] and ui._task_rates == {} and ui.pending_count == 0
+    assert table.ids_with_status(CODE_COMPLETED) == list(range(200))
+
+
+def test_post_skips_no_op_events_but_keeps_retries():
+    table = make_table(1)
+    ui = ModernUploadUI(table, num_threads=1)
+    ui.post(0, TaskStatus.UPLOADING)
+    ui.post(0, TaskStatus.UPLOADING)
+    ui.post(0, TaskStatus.RETRYING)
+    ui.post(0, TaskStatus.RETRYING)
+    assert len(ui._events) == 3
+
+
+def read_records(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_headless_emits_start_progress_done():
+    table = make_table(3)
+    stream = io.StringIO()
+    ui = HeadlessProgressUI(table, num_threads=2, stream=stream, interval=0)
+    ui.start()
+    ui.post(0, TaskStatus.UPLOADING, 50)
+    table.sent[0] = 50
+    ui.refresh()
+    ui.post(0, TaskStatus.COMPLETED, 50)
+    ui.mark_completed(0, True)
+    table.errors[1] = "网络错误"
+    ui.post(1, TaskStatus.FAILED)
+    ui.mark_completed(1, False)
+    ui.stop()
+
+    records = read_records(stream)
+    assert [r["event"] for r in records] == ["start", "progress", "progress", "done"]
+    assert records[0]["total_files"] == 3 and records[0]["total_bytes"] == table.total_size
+    assert records[1]["tasks"] == [{"id": 0, "name": "file_0.bin", "status": "uploading", "bytes": 50,
+                                    "size": 100, "rate": 0, "part": 0, "parts": 0, "retries": 0,
+                                    "thread": None}]
+    done = records[-1]
+    assert (done["completed"], done["failed"], done["bytes"]) == (1, 1, 100)
+    assert done["failed_tasks"] == [{"id": 1, "name": "file_1.bin", "error": "网络错误"}]
+    assert not stream.closed
+
+
+def test_progress_stream_prefers_fd_then_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(PROGRESS_FD_ENV, raising=False)
+    monkeypatch.delenv(PROGRESS_FILE_ENV, raising=False)
+    assert open_progress_stream() is sys.stdout
+
+    path = tmp_path / "progress.ndjson"
+    monkeypatch.setenv(PROGRESS_FILE_ENV, str(path))
+    stream = open_progress_stream()
+    stream.write("file\n")
+    stream.close()
+    assert path.read_text() == "file\n"
+
+    read_fd, write_fd = os.pipe()
+    monkeypatch.setenv(PROGRESS_FD_ENV, str(write_fd))
+    stream = open_progress_stream()
+    stream.write("fd\n")
+    stream.close()
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        assert f.read() == "fd\n"
+    assert path.read_text() == "file\n"
+
+    monkeypatch.setenv(PROGRESS_FD_ENV, "not-a-number")
+    stream = open_progress_stream()
+    assert stream.name == str(path)
+    stream.close()
+
+
+def test_create_upload_ui_picks_headless_without_tty(monkeypatch):
+    table = make_table(1)
+    monkeypatch.setattr(sys, "stdout", io.StringIO())
+    assert isinstance(create_upload_ui(table, 1), HeadlessProgressUI)
+
+    tty = io.StringIO()
+    tty.isatty = lambda: True
+    monkeypatch.setattr(sys, "stdout", tty)
+    ui = create_upload_ui(table, 1)
+    assert type(ui) is ModernUploadUI and not ui.headless
@@ -0,0 +1,154 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import telemetry
+from rich_ui import ModernUploadUI, TaskStatus, TaskTable
+from telemetry import (MetricsRegistry, RequestTracer, analyze, format_report, load_trace, percentile,
+                       split_endpoint, start_metrics_server)
+
+UPLOAD_ID = "1f2e3d4c-5b6a-7980-a1b2-c3d4e5f60718"
+BLOCK_ID = "0123456789abcdef0123456789abcdef"
+
+
+@pytest.mark.parametrize("endpoint, expected", [
+    (f"file_uploads/{UPLOAD_ID}/send", ("file_uploads/{id}/send", UPLOAD_ID)),
+    (f"/blocks/{BLOCK_ID}/children?page_size=100", ("blocks/{id}/children", "")),
+    ("file_uploads", ("file_uploads", "")),
+    ("pages/not-an-id", ("pages/not-an-id", "")),
+])
+def test_split_endpoint_folds_ids(endpoint, expected):
+    assert split_endpoint(endpoint) == expected
+
+
+def test_percentile_nearest_rank():
+    values = [0.1, 0.2, 0.3, 0.5]
+    assert [percentile(values, p) for p in (50, 90, 99, 100)] == [0.2, 0.5, 0.5, 0.5]
+    assert percentile([], 50) == 0.0
+    assert percentile([7.0], 1) == 7.0
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    """三次分片发送 (一次 429 后重试，连接池内部也重试掉一次 429) 和一次读取 (内部重试掉一次 503)"""
+    path = tmp_path / "trace.jsonl"
+    tracer = RequestTracer(str(path))
+    send = "file_uploads/{id}/send"
+    tracer.record(send, "POST", 200, 0.0, 0.1, sent=100, upload_id=UPLOAD_ID)
+    tracer.record(send, "POST", 429, 1.0, 0.3, upload_id=UPLOAD_ID, retried=[429])
+    tracer.record(send, "POST", 200, 2.0, 0.2, sent=100, retry=1, upload_id=UPLOAD_ID)
+    tracer.record("blocks/{id}/children", "GET", 200, 0.5, 0.5, received=2048, retried=[503])
+    tracer.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"ts": 3.0, "endpoint": "trunc')     # 进程被强制结束时写了一半的行
+    return path
+
+
+def test_analyze_rates_and_amplification(trace_file):
+    report = analyze(load_trace(str(trace_file)))
+    assert report["duration"] == pytest.approx(2.2)
+
+    overall = report["overall"]
+    assert overall["requests"] == 4 and overall["errors"] == 1
+    assert (overall["p50"], overall["p90"], overall["p99"]) == (0.2, 0.5, 0.5)
+    # 尝试次数包括 retried 中连接池内部重试掉的响应: 1 + 2 + 1 + 2
+    assert overall["attempts"] == 6
+    assert overall["rate_limited"] == 2 and overall["rate_429"] == pytest.approx(2 / 6)
+    # 3 个首次请求 (retry == 0)
+    assert overall["retry_amplification"] == pytest.approx(2.0)
+    assert overall["sent_per_sec"] == pytest.approx(200 / 2.2)
+
+    send = report["endpoints"]["POST file_uploads/{id}/send"]
+    assert send["requests"] == 3 and send["attempts"] == 4
+    assert send["rate_429"] == 0.5 and send["retry_amplification"] == 2.0
+    read = report["endpoints"]["GET blocks/{id}/children"]
+    assert read["rate_429"] == 0.0 and read["retry_amplification"] == 2.0 and read["received"] == 2048
+
+    text = format_report(report)
+    assert "POST file_uploads/{id}/send" in text and "合计" in text and "50.0%" in text
+
+
+def test_analyze_command_json(trace_file, capsys):
+    assert telemetry.main(["analyze", str(trace_file), "--json"]) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report["overall"]["attempts"] == 6
+    assert set(report["endpoints"]) == {"POST file_uploads/{id}/send", "GET blocks/{id}/children"}
+
+    assert telemetry.main(["analyze", str(trace_file.parent / "missing.jsonl")]) == 1
+
+
+def metric_lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_metrics_render_prometheus_text():
+    registry = MetricsRegistry()
+    registry.observe_request("file_uploads/{id}/send", "POST", 200, 0.07, sent=100)
+    registry.observe_request("file_uploads/{id}/send", "POST", 429, 0.3, retry=1, retried=[429])
+    registry.observe_request("file_uploads/{id}/send", "POST", 200, 500.0, sent=50)
+    registry.inc("notion_task_transitions_total", status='a"b\\c')
+    text = registry.render()
+
+    assert "# TYPE notion_requests_total counter" in text
+    assert "# TYPE notion_request_duration_seconds histogram" in text
+    assert 'notion_requests_total{endpoint="file_uploads/{id}/send",method="POST",status="200"} 2' in text
+    assert 'notion_task_transitions_total{status="a\\"b\\\\c"} 1' in text
+    assert "notion_sent_bytes_total 150" in text
+    assert "notion_rate_limited_total 2" in text and "notion_parts_sent_total 2" in text
+    assert 'notion_retries_total{layer="api"} 1' in text and 'notion_retries_total{layer="transport"} 1' in text
+
+    buckets = metric_lines(text, "notion_request_duration_seconds_bucket")
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and len(counts) == len(telemetry.LATENCY_BUCKETS) + 1
+    labels = 'endpoint="file_uploads/{id}/send"'
+    assert f'notion_request_duration_seconds_bucket{{{labels},le="0.05"}} 0' in text
+    assert f'notion_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'notion_request_duration_seconds_bucket{{{labels},le="300.0"}} 2' in text
+    assert f'notion_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f"notion_request_duration_seconds_sum{{{labels}}} 500.37" in text
+    assert f"notion_request_duration_seconds_count{{{labels}}} 3" in text
+
+
+def test_ui_gauges_disappear_after_unregister():
+    registry = MetricsRegistry()
+    table = TaskTable()
+    for i in range(3):
+        table.add(f"f{i}", 10, "page")
+    ui = ModernUploadUI(table, num_threads=2)
+    ui.metrics = registry
+    ui._set_gauges(True)
+    ui.post(0, TaskStatus.UPLOADING)
+
+    text = registry.render()
+    assert "notion_upload_queue_depth 2" in text and "notion_upload_active_workers 1" in text
+    assert 'notion_task_transitions_total{status="uploading"} 1' in text
+
+    ui._set_gauges(False)
+    text = registry.render()
+    assert "notion_upload_queue_depth" not in text and "notion_upload_active_workers" not in text
+
+
+def test_metrics_server_serves_registry():
+    registry = MetricsRegistry()
+    registry.inc("notion_parts_sent_total")
+    server = start_metrics_server(registry, 0)
+    try:
+        base = f"http://127.0.0.1:{server.server_port}"
+        with urllib.request.urlopen(base + "/metrics") as resp:
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "notion_parts_sent_total 1" in resp.read().decode("utf-8")
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(base + "/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_get_metrics_disabled_without_port(monkeypatch):
+    monkeypatch.delenv(telemetry.METRICS_PORT_ENV, raising=False)
+    monkeypatch.setattr(telemetry, "_metrics", None)
+    monkeypatch.setattr(telemetry, "_metrics_checked", False)
+    assert telemetry.get_metrics() is None
+    assert telemetry._metrics_checked